@@ -36,6 +36,14 @@ const config = {
       baseUrl: "https://api.nasa.gov",
     },
   },
+
+  // Resident Python risk worker (frontend/public/servidor_riesgo.py)
+  riskWorker: {
+    socketPath: null, // e.g. "/tmp/riesgo.sock" to use a Unix socket instead of TCP
+    host: "127.0.0.1",
+    port: 8765,
+    timeoutMs: 30000,
+  },
 };
 
 module.exports = config;
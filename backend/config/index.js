@@ -47,6 +47,14 @@ const config = {
     },
     // Add more external APIs as needed
   },
+
+  // Resident Python risk worker (frontend/public/servidor_riesgo.py)
+  riskWorker: {
+    socketPath: process.env.RISK_WORKER_SOCKET || null,
+    host: process.env.RISK_WORKER_HOST || "127.0.0.1",
+    port: parseInt(process.env.RISK_WORKER_PORT, 10) || 8765,
+    timeoutMs: parseInt(process.env.RISK_WORKER_TIMEOUT_MS, 10) || 30000,
+  },
 };
 
 module.exports = config;
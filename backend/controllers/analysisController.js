@@ -1,4 +1,5 @@
 const normalizationService = require("../services/normalizationService");
+const riskWorkerService = require("../services/riskWorkerService");
 
 const analysisController = {};
 
@@ -112,4 +113,56 @@ analysisController.getStatistics = (req, res) => {
   }
 };
 
+// Headers forwarded from the risk worker response
+const RISK_WORKER_HEADERS = [
+  "content-type",
+  "server-timing",
+  "x-tiempo-total-ms",
+  "x-forma",
+];
+
+// Compute risk for a window / parameter set with the resident Python worker
+analysisController.computeRisk = async (req, res) => {
+  const start = process.hrtime.bigint();
+  try {
+    const result = await riskWorkerService.computeRisk(req.query);
+
+    RISK_WORKER_HEADERS.forEach((header) => {
+      if (result.headers[header]) {
+        res.set(header, result.headers[header]);
+      }
+    });
+    const proxyMs = Number(process.hrtime.bigint() - start) / 1e6;
+    res.set("X-Proxy-Tiempo-Total-ms", proxyMs.toFixed(3));
+
+    res.status(result.statusCode).send(result.body);
+  } catch (error) {
+    console.error("Risk worker error:", error);
+    res.status(503).json({
+      success: false,
+      error: "Risk worker unavailable",
+      message: error.message,
+    });
+  }
+};
+
+// Latency metrics reported by the resident Python worker
+analysisController.getRiskMetrics = async (req, res) => {
+  try {
+    const result = await riskWorkerService.getMetrics();
+
+    res.json({
+      success: result.statusCode === 200,
+      metrics: JSON.parse(result.body.toString("utf8")),
+    });
+  } catch (error) {
+    console.error("Risk worker metrics error:", error);
+    res.status(503).json({
+      success: false,
+      error: "Risk worker unavailable",
+      message: error.message,
+    });
+  }
+};
+
 module.exports = analysisController;
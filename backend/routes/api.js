@@ -28,6 +28,10 @@ router.post("/normalize", analysisController.normalizeData);
 router.get("/models", analysisController.getMethods);
 router.get("/statistics", analysisController.getStatistics);
 
+// Risk worker routes (resident Python worker, see frontend/public/servidor_riesgo.py)
+router.get("/risk", analysisController.computeRisk);
+router.get("/risk/metrics", analysisController.getRiskMetrics);
+
 // NASA routes
 router.get("/nasa/fire-history", nasaController.getFireHistory);
 router.get("/nasa/fire-stats", nasaController.getFireStats);
@@ -119,6 +123,10 @@ router.get("/", (req, res) => {
         models: "/api/models",
         statistics: "/api/statistics",
       },
+      risk: {
+        compute: "/api/risk",
+        metrics: "/api/risk/metrics",
+      },
       nasa: {
         "fire-history": "/api/nasa/fire-history",
         "fire-stats": "/api/nasa/fire-stats",
@@ -0,0 +1,78 @@
+const http = require("http");
+const config = require("../config");
+
+// Client for the resident Python risk worker (frontend/public/servidor_riesgo.py).
+// The worker only listens locally: on a Unix socket when RISK_WORKER_SOCKET is set,
+// otherwise on host:port over plain HTTP.
+const riskWorkerService = {};
+
+// Query parameters accepted by the worker's /riesgo endpoint
+const RISK_PARAMS = [
+  "formato",
+  "fila_inicio",
+  "fila_fin",
+  "columna_inicio",
+  "columna_fin",
+  "peso",
+  "landslide_min",
+  "landslide_max",
+];
+
+const requestWorker = (path, { method = "GET", query = {} } = {}) =>
+  new Promise((resolve, reject) => {
+    const workerConfig = config.riskWorker;
+    const search = new URLSearchParams(query).toString();
+    const options = {
+      method,
+      path: search ? `${path}?${search}` : path,
+      timeout: workerConfig.timeoutMs,
+    };
+
+    if (workerConfig.socketPath) {
+      options.socketPath = workerConfig.socketPath;
+    } else {
+      options.host = workerConfig.host;
+      options.port = workerConfig.port;
+    }
+
+    const req = http.request(options, (res) => {
+      const chunks = [];
+      res.on("data", (chunk) => chunks.push(chunk));
+      res.on("end", () =>
+        resolve({
+          statusCode: res.statusCode,
+          headers: res.headers,
+          body: Buffer.concat(chunks),
+        })
+      );
+      res.on("error", reject);
+    });
+
+    req.on("timeout", () =>
+      req.destroy(new Error("Risk worker request timed out"))
+    );
+    req.on("error", reject);
+    req.end();
+  });
+
+// Keep only the parameters the worker understands
+riskWorkerService.pickRiskParams = (query = {}) => {
+  const params = {};
+  RISK_PARAMS.forEach((name) => {
+    if (query[name] !== undefined && query[name] !== "") {
+      params[name] = String(query[name]);
+    }
+  });
+  return params;
+};
+
+riskWorkerService.computeRisk = (query) =>
+  requestWorker("/riesgo", { query: riskWorkerService.pickRiskParams(query) });
+
+riskWorkerService.getMetrics = () => requestWorker("/metricas");
+
+riskWorkerService.getHealth = () => requestWorker("/salud");
+
+riskWorkerService.reload = () => requestWorker("/recargar", { method: "POST" });
+
+module.exports = riskWorkerService;
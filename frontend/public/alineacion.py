@@ -0,0 +1,273 @@
+"""
+Alineación de capas a una grilla destino declarada, con remuestreo vectorizado y caché.
+
+Por defecto calcular_riesgo() resuelve capas de distinto tamaño recortando todas a las filas y
+columnas mínimas comunes (flood tiene 1297 filas, las demás 1296). Para combinar capas de distinta
+resolución se declara una grilla destino y cada capa se remuestrea a ella. Todas las capas cubren
+la misma extensión (piramide.LIMITES_GEOGRAFICOS), así que la celda destino i de un eje de n celdas
+cubre las celdas [i·N/n, (i+1)·N/n) de una capa con N celdas en ese eje.
+
+Métodos:
+- 'vecino': la celda de origen que contiene el centro de la celda destino (un índice por fila y
+  otro por columna; la banda se arma con np.take en cada eje).
+- 'media': promedio de las celdas de origen que cubre la celda destino, con np.add.reduceat sobre
+  los bordes de los bloques, primero en filas y después en columnas. Resultado en float32.
+- 'moda': valor más frecuente del bloque (ante empate, el menor), contando cada valor con las
+  mismas sumas por bloque. Conserva el dtype y los valores: es el método de las capas categóricas
+  (máscaras 0/1 de water, urban y áreas protegidas, clases de flood y landslide).
+- 'auto' (por defecto): 'moda' para capas enteras con pocos valores posibles y 'media' para las demás.
+En un eje que se amplía (la capa tiene menos celdas que la grilla) cada bloque sería menor que
+una celda: ese eje se resuelve siempre por vecino más cercano.
+
+La grilla se recorre en bandas de filas de salida, así una capa abierta con memory-map no se lee
+entera a memoria. El resultado queda en .cache_capas/alineadas/<capa>-<filas>x<columnas>-<método>.npy
+con sus metadatos; la clave (hash del CSV de origen, grilla y método) se guarda en los metadatos y
+mientras no cambie la capa se abre con memory-map sin volver a remuestrear.
+
+La grilla se declara como 'FILASxCOLUMNAS' (el formato de csv_dimensions.json) o con un JSON
+que además puede elegir el método de cada capa:
+    {"filas": 1296, "columnas": 978, "metodos": {"landslide": "media"}}
+
+Uso:
+    python alineacion.py --grilla 1296x978 [--entrada DIR]      # alinea y cachea las cinco capas
+    python calcular_riesgo.py --grilla grilla.json
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from capas import CACHE_DIR, cargar_capa, metadatos_capa
+from instrumentacion import medir
+
+METODOS = ('vecino', 'media', 'moda')
+
+# Subdirectorio de CACHE_DIR con las capas alineadas
+DIRECTORIO_ALINEADAS = 'alineadas'
+
+# Incrementar si cambia el remuestreo o el formato de los metadatos
+ALINEACION_VERSION = 1
+
+# Capas enteras con a lo sumo esta cantidad de valores posibles se tratan como categóricas ('auto' → 'moda')
+MAX_CATEGORIAS = 64
+
+# Filas de salida remuestreadas por bloque (acota los temporales sobre memory-maps)
+FILAS_POR_BLOQUE = 256
+
+
+def leer_grilla(texto):
+    """
+    Grilla destino desde 'FILASxCOLUMNAS' o desde un archivo JSON con 'filas', 'columnas' y,
+    opcionalmente, 'metodos' por capa. Devuelve {'filas', 'columnas', 'metodos'}.
+    """
+    if os.path.exists(texto):
+        with open(texto, 'r', encoding='utf-8') as f:
+            datos = json.load(f)
+    else:
+        try:
+            filas, columnas = (int(parte) for parte in texto.lower().split('x'))
+        except ValueError:
+            raise ValueError(f"Grilla inválida: {texto!r} (se espera FILASxCOLUMNAS o un archivo JSON)")
+        datos = {'filas': filas, 'columnas': columnas}
+
+    metodos = datos.get('metodos', {})
+    for nombre, metodo in metodos.items():
+        if metodo not in METODOS + ('auto',):
+            raise ValueError(f"Método de remuestreo inválido para {nombre}: {metodo!r}")
+    if int(datos['filas']) < 1 or int(datos['columnas']) < 1:
+        raise ValueError(f"Grilla inválida: {datos['filas']}x{datos['columnas']}")
+    return {'filas': int(datos['filas']), 'columnas': int(datos['columnas']), 'metodos': dict(metodos)}
+
+
+def elegir_metodo(meta, metodo='auto'):
+    """
+    Resuelve 'auto': 'moda' para capas enteras con pocos valores posibles (categóricas), 'media' para las demás.
+    """
+    if metodo != 'auto':
+        return metodo
+    if np.dtype(meta['dtype']).kind in 'iub' and meta['max'] - meta['min'] < MAX_CATEGORIAS:
+        return 'moda'
+    return 'media'
+
+
+def _eje(origen, destino, metodo):
+    """
+    Cómo se resuelve un eje: ('bloques', inicios, tamaños) si se reduce por bloques, o
+    ('indices', índices, None) con la celda de origen que contiene el centro de cada celda destino.
+    """
+    if metodo == 'vecino' or origen < destino:
+        return 'indices', (np.arange(destino, dtype=np.int64) * 2 + 1) * origen // (2 * destino), None
+    bordes = np.arange(destino + 1, dtype=np.int64) * origen // destino
+    return 'bloques', bordes[:-1], np.diff(bordes)
+
+
+def _sumas_bloque(valores, filas, columnas):
+    """
+    Suma de `valores` en cada bloque destino. filas/columnas = (tipo, posiciones) relativas a la banda:
+    inicios de bloque para reduceat, o índices a tomar.
+    """
+    for eje, (tipo, posiciones) in enumerate((filas, columnas)):
+        if tipo == 'bloques':
+            valores = np.add.reduceat(valores, posiciones, axis=eje)
+        else:
+            valores = np.take(valores, posiciones, axis=eje)
+    return valores
+
+
+def remuestrear(matriz, filas, columnas, metodo='vecino', salida=None, filas_por_bloque=FILAS_POR_BLOQUE):
+    """
+    Remuestrea la matriz a filas x columnas con el método dado ('vecino', 'media' o 'moda').
+    `salida` puede ser un memory-map ya creado con la forma y el dtype del resultado
+    (el dtype de la matriz, o float32 con 'media').
+    """
+    if metodo not in METODOS:
+        raise ValueError(f"Método de remuestreo inválido: {metodo!r}")
+
+    tipo_f, pos_f, tam_f = _eje(matriz.shape[0], filas, metodo)
+    tipo_c, pos_c, tam_c = _eje(matriz.shape[1], columnas, metodo)
+    if salida is None:
+        salida = np.empty((filas, columnas), dtype=np.float32 if metodo == 'media' else matriz.dtype)
+
+    # Si los dos ejes se amplían cada bloque es una sola celda: media y moda coinciden con el vecino
+    metodo_banda = 'vecino' if tipo_f == tipo_c == 'indices' else metodo
+
+    # Celdas de origen por bloque (1 en los ejes resueltos por índice)
+    tamanos_c = tam_c if tam_c is not None else np.ones(columnas, dtype=np.int64)
+
+    for inicio in range(0, filas, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque, filas)
+        if tipo_f == 'bloques':
+            primera, ultima = pos_f[inicio], pos_f[fin - 1] + tam_f[fin - 1]
+            tamanos_f = tam_f[inicio:fin]
+        else:
+            primera, ultima = pos_f[inicio], pos_f[fin - 1] + 1
+            tamanos_f = np.ones(fin - inicio, dtype=np.int64)
+        banda = np.asarray(matriz[primera:ultima])
+        ejes = ((tipo_f, pos_f[inicio:fin] - primera), (tipo_c, pos_c))
+        destino = salida[inicio:fin]
+
+        if metodo_banda == 'vecino':
+            destino[:] = _sumas_bloque(banda, *ejes)
+        elif metodo_banda == 'media':
+            suma = _sumas_bloque(banda.astype(np.float64), *ejes)
+            destino[:] = suma / np.outer(tamanos_f, tamanos_c)
+        else:
+            mejor_conteo = np.zeros(destino.shape, dtype=np.int64)
+            destino[:] = 0
+            for valor in np.unique(banda):
+                conteo = _sumas_bloque((banda == valor).astype(np.int32), *ejes)
+                gana = conteo > mejor_conteo
+                destino[gana] = valor
+                mejor_conteo[gana] = conteo[gana]
+
+    return salida
+
+
+def _rutas_alineada(ruta_csv, filas, columnas, metodo, directorio_cache=None):
+    if directorio_cache is None:
+        directorio_cache = os.path.join(os.path.dirname(os.path.abspath(ruta_csv)), CACHE_DIR)
+    nombre = os.path.splitext(os.path.basename(ruta_csv))[0]
+    base = os.path.join(directorio_cache, DIRECTORIO_ALINEADAS, f'{nombre}-{filas}x{columnas}-{metodo}')
+    return f'{base}.npy', f'{base}.json'
+
+
+def _clave(meta_origen, filas, columnas, metodo):
+    texto = json.dumps([ALINEACION_VERSION, meta_origen['sha256'], filas, columnas, metodo])
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=8).hexdigest()
+
+
+@medir('alineacion.capa', argumento_archivo=0)
+def cargar_capa_alineada(ruta_csv, filas, columnas, metodo='auto', directorio_cache=None):
+    """
+    Capa remuestreada a filas x columnas (memory-map desde la caché de capas alineadas) y sus
+    metadatos (forma, dtype, mínimo, máximo, método). Si la capa ya tiene esa forma se devuelve tal cual.
+    """
+    meta_origen = metadatos_capa(ruta_csv, directorio_cache)
+    if tuple(meta_origen['shape']) == (filas, columnas):
+        return cargar_capa(ruta_csv, directorio_cache=directorio_cache), meta_origen
+
+    metodo = elegir_metodo(meta_origen, metodo)
+    ruta_npy, ruta_meta = _rutas_alineada(ruta_csv, filas, columnas, metodo, directorio_cache)
+    clave = _clave(meta_origen, filas, columnas, metodo)
+
+    try:
+        with open(ruta_meta, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+
+    if meta is None or meta.get('clave') != clave or not os.path.exists(ruta_npy):
+        origen = cargar_capa(ruta_csv, directorio_cache=directorio_cache)
+        print(f"Alineando {os.path.basename(ruta_csv)}: {origen.shape[0]}x{origen.shape[1]} → "
+              f"{filas}x{columnas} ({metodo})")
+        os.makedirs(os.path.dirname(ruta_npy), exist_ok=True)
+
+        # Temporal por proceso: el modo de ingesta puede alinear la misma capa en dos procesos
+        ruta_tmp = f'{ruta_npy}.{os.getpid()}.tmp'
+        dtype = np.float32 if metodo == 'media' else origen.dtype
+        salida = np.lib.format.open_memmap(ruta_tmp, mode='w+', dtype=dtype, shape=(filas, columnas))
+        remuestrear(origen, filas, columnas, metodo, salida)
+        salida.flush()
+        meta = {
+            'version': ALINEACION_VERSION,
+            'clave': clave,
+            'origen': os.path.basename(ruta_csv),
+            'forma_origen': list(origen.shape),
+            'metodo': metodo,
+            'dtype': salida.dtype.str,
+            'shape': [filas, columnas],
+            'min': salida.min().item(),
+            'max': salida.max().item()
+        }
+        del salida
+        os.replace(ruta_tmp, ruta_npy)
+
+        ruta_tmp = f'{ruta_meta}.{os.getpid()}.tmp'
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+        os.replace(ruta_tmp, ruta_meta)
+
+    return np.load(ruta_npy, mmap_mode='r'), meta
+
+
+def cargar_capas(rutas, grilla=None):
+    """
+    Abre las capas de `rutas` ({nombre: ruta CSV}) con memory-map y devuelve (capas, metas).
+    Sin grilla se abren tal cual (quien las usa las recorta a las dimensiones mínimas comunes);
+    con grilla (ver leer_grilla) todas se alinean a ella con el método declarado para cada una.
+    """
+    if grilla is None:
+        capas = {nombre: cargar_capa(ruta) for nombre, ruta in rutas.items()}
+        metas = {nombre: metadatos_capa(ruta) for nombre, ruta in rutas.items()}
+        return capas, metas
+
+    capas, metas = {}, {}
+    for nombre, ruta in rutas.items():
+        metodo = grilla.get('metodos', {}).get(nombre, 'auto')
+        capas[nombre], metas[nombre] = cargar_capa_alineada(ruta, grilla['filas'], grilla['columnas'], metodo)
+    return capas, metas
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from calcular_riesgo import rutas_capas
+    from instrumentacion import activar
+
+    parser = argparse.ArgumentParser(description='Alinear las capas de entrada a una grilla destino')
+    parser.add_argument('--grilla', required=True, help="grilla destino: 'FILASxCOLUMNAS' o archivo JSON")
+    parser.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por capa y guardarlos en DIR')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+
+    grilla = leer_grilla(args.grilla)
+    _, metas = cargar_capas(rutas_capas(args.entrada), grilla)
+    for nombre, meta in metas.items():
+        origen = meta.get('forma_origen', meta['shape'])
+        print(f"{nombre}: {origen[0]}x{origen[1]} → {meta['shape'][0]}x{meta['shape'][1]} "
+              f"({meta.get('metodo', 'sin cambios')}, {np.dtype(meta['dtype'])}, {meta['min']} - {meta['max']})")
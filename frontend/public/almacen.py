@@ -0,0 +1,252 @@
+"""
+Almacén binario por chunks comprimidos para matrices raster (resultado de riesgo).
+
+La matriz se divide en chunks de tamaño fijo (256x256 por defecto); cada chunk se
+guarda comprimido en su propio archivo y un metadatos.json describe la forma, el
+dtype, el valor sin dato (99), el tamaño de chunk, la compresión y estadísticas
+por chunk y globales:
+
+    riesgo_almacen/metadatos.json
+    riesgo_almacen/<fila_chunk>.<columna_chunk>
+
+Los lectores abren el almacén sin decodificar nada y leen una ventana descomprimiendo
+solo los chunks que la cubren:
+
+    from almacen import AlmacenChunks
+    riesgo = AlmacenChunks('riesgo_almacen')
+    ventana = riesgo[100:300, 200:450]
+
+La compresión es zlib (biblioteca estándar); si el paquete lz4 está instalado puede
+usarse compresion='lz4', más rápida de leer.
+
+Cuando cambia solo una parte de la matriz, actualizar_chunks() reescribe únicamente los
+chunks afectados y rearma las estadísticas globales a partir de las parciales por chunk.
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    # lz4 es opcional: sin él se usa zlib
+    lz4_frame = None
+
+METADATOS_ALMACEN = 'metadatos.json'
+
+# Incrementar si cambia el formato de los chunks o de los metadatos
+ALMACEN_VERSION = 1
+
+TAMANO_CHUNK = (256, 256)
+
+
+def _comprimir(datos, compresion, nivel):
+    if compresion == 'lz4':
+        return lz4_frame.compress(datos, compression_level=nivel)
+    return zlib.compress(datos, nivel)
+
+
+def _descomprimir(datos, compresion):
+    if compresion == 'lz4':
+        return lz4_frame.decompress(datos)
+    return zlib.decompress(datos)
+
+
+def _escribir_atomico(ruta, datos):
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'wb') as f:
+        f.write(datos)
+    os.replace(ruta_tmp, ruta)
+
+
+def estadisticas_chunk(chunk, valor_sin_dato=99):
+    """
+    Estadísticas de un chunk: mínimo, máximo, suma y cantidad de los valores distintos
+    de valor_sin_dato, y cantidad de celdas sin dato y de ceros.
+    """
+    validos = chunk != valor_sin_dato
+    cantidad = int(np.count_nonzero(validos))
+    return {
+        'min': float(np.min(chunk, where=validos, initial=np.inf)) if cantidad else None,
+        'max': float(np.max(chunk, where=validos, initial=-np.inf)) if cantidad else None,
+        'suma': float(np.sum(chunk, where=validos, dtype=np.float64)),
+        'cantidad': cantidad,
+        'count_sin_dato': int(chunk.size - cantidad),
+        'count_zero': int(np.count_nonzero(chunk == 0))
+    }
+
+
+def combinar_estadisticas(parciales):
+    """
+    Combina estadísticas de chunks (estadisticas_chunk) en las globales de la matriz.
+    """
+    parciales = list(parciales)
+    minimos = [p['min'] for p in parciales if p['min'] is not None]
+    maximos = [p['max'] for p in parciales if p['max'] is not None]
+    cantidad = sum(p['cantidad'] for p in parciales)
+    suma = sum(p['suma'] for p in parciales)
+    return {
+        'min': min(minimos) if minimos else None,
+        'max': max(maximos) if maximos else None,
+        'suma': suma,
+        'cantidad': cantidad,
+        'promedio': suma / cantidad if cantidad else None,
+        'count_sin_dato': sum(p['count_sin_dato'] for p in parciales),
+        'count_zero': sum(p['count_zero'] for p in parciales)
+    }
+
+
+def escribir_almacen(matriz, directorio, tamano_chunk=TAMANO_CHUNK, compresion='zlib', nivel=6,
+                     valor_sin_dato=99):
+    """
+    Guarda la matriz (puede ser un memory-map) en el almacén por chunks y devuelve sus metadatos.
+    Los chunks se recorren por bandas de filas, por lo que la memoria queda acotada por una banda.
+    Los metadatos se escriben al final, así un lector nunca ve un almacén a medio escribir.
+    """
+    if compresion == 'lz4' and lz4_frame is None:
+        raise ValueError("compresion='lz4' requiere el paquete lz4")
+
+    os.makedirs(directorio, exist_ok=True)
+    filas, columnas = matriz.shape
+    alto, ancho = tamano_chunk
+    chunks = {}
+
+    for i, inicio in enumerate(range(0, filas, alto)):
+        banda = np.ascontiguousarray(matriz[inicio:inicio + alto])
+        for j, columna in enumerate(range(0, columnas, ancho)):
+            chunk = np.ascontiguousarray(banda[:, columna:columna + ancho])
+            clave = f'{i}.{j}'
+            datos = _comprimir(chunk.tobytes(), compresion, nivel)
+            _escribir_atomico(os.path.join(directorio, clave), datos)
+
+            chunks[clave] = estadisticas_chunk(chunk, valor_sin_dato)
+            chunks[clave]['bytes'] = len(datos)
+
+    meta = {
+        'version': ALMACEN_VERSION,
+        'shape': [int(filas), int(columnas)],
+        'dtype': np.dtype(matriz.dtype).str,
+        'orden': 'C',
+        'tamano_chunk': [alto, ancho],
+        'compresion': compresion,
+        'nivel': nivel,
+        'nodata': valor_sin_dato,
+        'estadisticas': combinar_estadisticas(chunks.values()),
+        'chunks': chunks
+    }
+    _escribir_atomico(os.path.join(directorio, METADATOS_ALMACEN),
+                      json.dumps(meta, indent=2, ensure_ascii=False).encode('utf-8'))
+
+    return meta
+
+
+def actualizar_chunks(matriz, directorio, claves, valor_sin_dato=99):
+    """
+    Reescribe solo los chunks `claves` ('i.j') de un almacén existente con los valores de la
+    matriz (misma forma y dtype que el almacén) y recalcula las estadísticas globales combinando
+    las parciales de cada chunk: las de los chunks no tocados se reutilizan de metadatos.json.
+    Devuelve los metadatos actualizados.
+    """
+    ruta_meta = os.path.join(directorio, METADATOS_ALMACEN)
+    with open(ruta_meta, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    if (meta.get('version') != ALMACEN_VERSION or tuple(meta['shape']) != tuple(matriz.shape)
+            or np.dtype(meta['dtype']) != np.dtype(matriz.dtype)):
+        raise ValueError(f"El almacén {directorio} no corresponde a la matriz {matriz.shape} {matriz.dtype}")
+    if meta['compresion'] == 'lz4' and lz4_frame is None:
+        raise ValueError("El almacén usa lz4 y el paquete lz4 no está instalado")
+
+    alto, ancho = meta['tamano_chunk']
+    for clave in claves:
+        i, j = (int(parte) for parte in clave.split('.'))
+        chunk = np.ascontiguousarray(matriz[i * alto:(i + 1) * alto, j * ancho:(j + 1) * ancho])
+        datos = _comprimir(chunk.tobytes(), meta['compresion'], meta['nivel'])
+        _escribir_atomico(os.path.join(directorio, clave), datos)
+
+        meta['chunks'][clave] = estadisticas_chunk(chunk, valor_sin_dato)
+        meta['chunks'][clave]['bytes'] = len(datos)
+
+    meta['estadisticas'] = combinar_estadisticas(meta['chunks'].values())
+    _escribir_atomico(ruta_meta, json.dumps(meta, indent=2, ensure_ascii=False).encode('utf-8'))
+
+    return meta
+
+
+class AlmacenChunks:
+    """
+    Lector perezoso de un almacén por chunks: solo se leen y descomprimen
+    los chunks que intersectan la ventana pedida.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        with open(os.path.join(directorio, METADATOS_ALMACEN), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+        if self.meta.get('version') != ALMACEN_VERSION:
+            raise ValueError(f"Versión de almacén no soportada: {self.meta.get('version')}")
+        if self.meta['compresion'] == 'lz4' and lz4_frame is None:
+            raise ValueError("El almacén usa lz4 y el paquete lz4 no está instalado")
+
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.tamano_chunk = tuple(self.meta['tamano_chunk'])
+        self.valor_sin_dato = self.meta['nodata']
+
+    @property
+    def estadisticas(self):
+        return self.meta['estadisticas']
+
+    def leer_chunk(self, i, j):
+        """
+        Lee y descomprime el chunk (i, j).
+        """
+        alto, ancho = self.tamano_chunk
+        forma = (min(alto, self.shape[0] - i * alto), min(ancho, self.shape[1] - j * ancho))
+        with open(os.path.join(self.directorio, f'{i}.{j}'), 'rb') as f:
+            datos = _descomprimir(f.read(), self.meta['compresion'])
+        return np.frombuffer(datos, dtype=self.dtype).reshape(forma)
+
+    def leer_ventana(self, fila_inicio, fila_fin, columna_inicio, columna_fin):
+        """
+        Devuelve la ventana [fila_inicio:fila_fin, columna_inicio:columna_fin] como matriz nueva.
+        """
+        fila_inicio, fila_fin, _ = slice(fila_inicio, fila_fin).indices(self.shape[0])
+        columna_inicio, columna_fin, _ = slice(columna_inicio, columna_fin).indices(self.shape[1])
+        alto, ancho = self.tamano_chunk
+
+        ventana = np.empty((max(0, fila_fin - fila_inicio), max(0, columna_fin - columna_inicio)), dtype=self.dtype)
+        if ventana.size == 0:
+            return ventana
+
+        for i in range(fila_inicio // alto, (fila_fin - 1) // alto + 1):
+            for j in range(columna_inicio // ancho, (columna_fin - 1) // ancho + 1):
+                chunk = self.leer_chunk(i, j)
+                f0, c0 = i * alto, j * ancho
+                # Intersección del chunk con la ventana, en coordenadas absolutas
+                fa, fb = max(f0, fila_inicio), min(f0 + chunk.shape[0], fila_fin)
+                ca, cb = max(c0, columna_inicio), min(c0 + chunk.shape[1], columna_fin)
+                ventana[fa - fila_inicio:fb - fila_inicio, ca - columna_inicio:cb - columna_inicio] = \
+                    chunk[fa - f0:fb - f0, ca - c0:cb - c0]
+
+        return ventana
+
+    def __getitem__(self, clave):
+        """
+        Soporta almacen[filas, columnas] con slices de paso 1 (o un solo slice de filas).
+        """
+        if not isinstance(clave, tuple):
+            clave = (clave, slice(None))
+        filas, columnas = clave
+        if not (isinstance(filas, slice) and isinstance(columnas, slice)) or \
+                filas.step not in (None, 1) or columnas.step not in (None, 1):
+            raise IndexError("AlmacenChunks solo admite slices de paso 1")
+        return self.leer_ventana(filas.start, filas.stop, columnas.start, columnas.stop)
+
+    def __array__(self, dtype=None, copy=None):
+        matriz = self.leer_ventana(None, None, None, None)
+        return matriz if dtype is None else matriz.astype(dtype)
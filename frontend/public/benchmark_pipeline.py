@@ -0,0 +1,205 @@
+"""
+Benchmark del pipeline raster (calcular_riesgo.py y csv_to_jpeg.py) con grillas sintéticas.
+
+Para cada tamaño se generan capas sintéticas flood/landslide/water/urban/áreas
+protegidas con la misma estructura que las reales (clases enteras con regiones
+continuas) y se miden por separado las etapas de ambos scripts: carga del CSV,
+carga desde la caché, normalización, cálculo, escritura del CSV y renderizado
+JPEG. Cada tamaño corre en un proceso nuevo para que el pico de memoria (RSS)
+de uno no contamine al siguiente.
+
+El reporte JSON tiene claves ordenadas para poder compararlo entre versiones
+con un diff.
+
+Uso:
+    python benchmark_pipeline.py [--tamanos 1000,4000,16000] [--repeticiones 3]
+                                 [--salida benchmark_report.json]
+"""
+
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Windows: no hay getrusage, el pico de memoria se informa como null
+    resource = None
+
+TAMANOS_POR_DEFECTO = [1000, 4000, 16000]
+
+# Archivo y rango de valores de cada capa sintética
+CAPAS_SINTETICAS = {
+    'flood.csv': (0, 10),
+    'landslide.csv': (0, 4),
+    'water.csv': (0, 1),
+    'urban.csv': (0, 1),
+    'pixeles_areas_protegidas.csv': (0, 1)
+}
+
+
+def rss_pico_mb():
+    """
+    Pico de memoria residente del proceso actual en MB (None si no se puede medir).
+    """
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB, macOS bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def generar_capa(n, minimo, maximo, rng, tamano_region=16):
+    """
+    Genera una capa n x n de enteros en [minimo, maximo] formada por regiones constantes
+    de tamano_region x tamano_region, parecida a las capas categóricas reales.
+    """
+    m = -(-n // tamano_region)
+    base = rng.integers(minimo, maximo + 1, size=(m, m), dtype=np.uint8)
+    if maximo - minimo == 1:
+        # Máscaras mayormente en 1, como water/urban/áreas protegidas reales
+        base = (rng.random((m, m)) < 0.8).astype(np.uint8)
+    capa = np.repeat(np.repeat(base, tamano_region, axis=0), tamano_region, axis=1)
+    return capa[:n, :n]
+
+
+def generar_capas(directorio, n, semilla=0, filas_por_bloque=2048):
+    """
+    Escribe las cinco capas sintéticas de n x n como CSV sin encabezado en el directorio.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(semilla)
+    for archivo, (minimo, maximo) in CAPAS_SINTETICAS.items():
+        capa = generar_capa(n, minimo, maximo, rng)
+        with open(os.path.join(directorio, archivo), 'w', newline='') as f:
+            for inicio in range(0, n, filas_por_bloque):
+                pd.DataFrame(capa[inicio:inicio + filas_por_bloque]).to_csv(f, index=False, header=False)
+
+
+def medir(resultados, etapa, funcion, repeticiones=1):
+    """
+    Ejecuta la función `repeticiones` veces sin su salida por consola y registra el mejor
+    tiempo y el pico de memoria acumulado del proceso. Devuelve el resultado de la última ejecución.
+    """
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+            inicio = time.perf_counter()
+            resultado = funcion()
+            mejor = min(mejor, time.perf_counter() - inicio)
+
+    resultados[etapa] = {'segundos': round(mejor, 4), 'rss_pico_mb': rss_pico_mb()}
+    print(f"  {etapa:<28} {mejor:9.3f} s   RSS pico: {resultados[etapa]['rss_pico_mb']} MB")
+    return resultado
+
+
+def medir_tamano(n, repeticiones=1):
+    """
+    Corre todas las etapas para una grilla de n x n en un directorio temporal.
+    Pensada para ejecutarse en un proceso propio (ver ejecutar_benchmark).
+    """
+    import calcular_riesgo
+    import csv_to_jpeg
+    from capas import CACHE_DIR, cargar_capa
+
+    directorio_original = os.getcwd()
+    directorio = tempfile.mkdtemp(prefix=f'benchmark_{n}_')
+    resultados = {}
+
+    try:
+        os.chdir(directorio)
+        print(f"\nGrilla {n}x{n} ({directorio})")
+
+        medir(resultados, 'generacion_csv', lambda: generar_capas(directorio, n))
+        archivos = list(CAPAS_SINTETICAS)
+        resultados['tamano_csv_mb'] = round(sum(os.path.getsize(a) for a in archivos) / 2**20, 1)
+
+        # calcular_riesgo.py
+        medir(resultados, 'riesgo.carga_csv', lambda: [cargar_capa(a) for a in archivos])
+        medir(resultados, 'riesgo.carga_cache',
+              lambda: [int(np.asarray(cargar_capa(a)).sum()) for a in archivos], repeticiones)
+        entradas = medir(resultados, 'riesgo.normalizacion', calcular_riesgo.preparar_entradas, repeticiones)
+
+        capas = [entradas[nombre] for nombre in ('flood', 'landslide', 'water', 'urban', 'area_protegida')]
+        dtype = entradas['dtype']
+        medir(resultados, 'riesgo.calculo_clasico',
+              lambda: calcular_riesgo.aplicar_formula(*capas, dtype), repeticiones)
+        riesgo, _, _ = medir(resultados, 'riesgo.calculo_fusionado',
+                             lambda: calcular_riesgo.calcular_riesgo_fusionado(*capas, dtype), repeticiones)
+        medir(resultados, 'riesgo.escritura_csv',
+              lambda: calcular_riesgo.escribir_csv_riesgo(riesgo, 'riesgo.csv'), repeticiones)
+        medir(resultados, 'riesgo.render_jpeg', lambda: calcular_riesgo.crear_jpeg_riesgo(riesgo), repeticiones)
+        del riesgo, capas, entradas
+        os.remove('riesgo.csv')
+
+        # csv_to_jpeg.py: sin la caché que dejó calcular_riesgo, la primera carga parsea los CSV
+        shutil.rmtree(CACHE_DIR)
+        medir(resultados, 'csv_to_jpeg.carga_csv', lambda: [csv_to_jpeg.load_csv_data(a) for a in archivos])
+        matrices = medir(resultados, 'csv_to_jpeg.carga_cache',
+                         lambda: [csv_to_jpeg.load_csv_data(a) for a in archivos], repeticiones)
+        medir(resultados, 'csv_to_jpeg.render',
+              lambda: [csv_to_jpeg.save_as_jpeg(m, a.replace('.csv', '.jpeg'), a.replace('.csv', ''))
+                       for m, a in zip(matrices, archivos)], repeticiones)
+        del matrices
+        medir(resultados, 'csv_to_jpeg.lote',
+              lambda: csv_to_jpeg.process_csv_files('.', '.', workers=1, force=True), repeticiones)
+
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return resultados
+
+
+def ejecutar_benchmark(tamanos=None, salida='benchmark_report.json', repeticiones=1):
+    """
+    Ejecuta el benchmark para cada tamaño (cada uno en un proceso nuevo) y guarda el reporte JSON.
+    """
+    tamanos = tamanos or TAMANOS_POR_DEFECTO
+    reporte = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'repeticiones': repeticiones,
+        'resultados': {}
+    }
+
+    for n in tamanos:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            reporte['resultados'][f'{n}x{n}'] = executor.submit(medir_tamano, n, repeticiones).result()
+
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+    print(f"\nReporte guardado en {salida}")
+    return reporte
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline raster con grillas sintéticas')
+    parser.add_argument('--tamanos', default=','.join(str(n) for n in TAMANOS_POR_DEFECTO),
+                        help='lados de las grillas separados por coma (default: 1000,4000,16000)')
+    parser.add_argument('--repeticiones', type=int, default=1,
+                        help='repeticiones por etapa; se informa el mejor tiempo (default: 1)')
+    parser.add_argument('--salida', default='benchmark_report.json',
+                        help='archivo JSON del reporte (default: benchmark_report.json)')
+    args = parser.parse_args()
+
+    ejecutar_benchmark([int(n) for n in args.tamanos.split(',')], args.salida, args.repeticiones)
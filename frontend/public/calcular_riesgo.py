@@ -33,44 +33,158 @@ ESCALA DE COLORES:
 
 ARCHIVOS DE SALIDA GENERADOS:
 -----------------------------
-1. riesgo.csv - Matriz de riesgo calculada
+1. riesgo.csv - Matriz de riesgo calculada (exportación opcional, se omite con --sin-csv)
+   riesgo.npy - La misma matriz en binario compacto (float32 cuando es exacto)
+   riesgo_almacen/ - La misma matriz en chunks comprimidos con estadísticas (ver almacen.py)
 2. riesgo.jpeg - Imagen visual del mapa de riesgo
 3. riesgo_scale.json - Metadatos con información de colores y configuración
+4. build_manifest.json - Huellas de entradas/parámetros para la reconstrucción incremental
+5. teselas/riesgo/ - Pirámide de teselas XYZ 256x256 y su índice teselas.json (con --teselas)
 
 CONSIDERACIONES TÉCNICAS:
 -----------------------
 - Todas las matrices deben tener las mismas dimensiones
+- Cada CSV se convierte una sola vez a binario (.cache_capas/) y luego se abre con memory-map
+- Las capas se mantienen en su dtype compacto (uint8); la fórmula se evalúa en float32 solo
+  si da exactamente el mismo resultado que en float64 para todas las combinaciones de valores
+  posibles (ver elegir_dtype_calculo), y riesgo.npy se guarda en ese dtype
 - Los cálculos se realizan de forma vectorizada para optimización
 - Los valores NaN se convierten a 99 (sin dato) en la visualización
-- La imagen JPEG se genera con alta calidad (95%) y resolución configurable
+- La imagen JPEG se genera con alta calidad (95%) y un píxel por celda de la matriz
 
 DEPENDENCIAS:
 -------------
-- pandas: Para manejo de datos CSV
+- pandas: Para leer las capas CSV (capas.py)
+- capas.py: Caché binaria de las capas CSV (se reutiliza entre ejecuciones)
+- exportar_csv.py: Escritura de riesgo.csv en paralelo
 - numpy: Para operaciones vectorizadas
-- matplotlib: Para generación de imágenes
+- numexpr (opcional): Para evaluar la fórmula del método fusionado
+- pillow: Para codificar la imagen JPEG (ver renderizado.py)
 - json: Para exportar metadatos
 
 USO:
 ----
 python calcular_riesgo.py
+python calcular_riesgo.py [--sin-jpeg] [--sin-csv]
+python calcular_riesgo.py --por-bandas [--filas-por-banda 256] [--sin-jpeg]
+python calcular_riesgo.py --forzar
+python calcular_riesgo.py --completo
+python calcular_riesgo.py --metodo clasico
+python calcular_riesgo.py --comparar-metodos
+python calcular_riesgo.py --teselas [--workers N]
+python calcular_riesgo.py --csv-precision 2 [--csv-enteros] [--workers N]
+
+MÉTODO FUSIONADO:
+-----------------
+Por defecto la fórmula, la excepción 99, la verificación de rangos y las estadísticas se
+calculan en una sola pasada por bloques de filas que entran en caché, con buffers
+preasignados (calcular_riesgo_fusionado). Si numexpr está instalado se usa para evaluar la
+fórmula de cada bloque. --metodo clasico usa el camino original de varias pasadas y
+--comparar-metodos mide ambos y verifica que el resultado sea idéntico.
+
+RECONSTRUCCIÓN INCREMENTAL:
+---------------------------
+Cada ejecución registra en build_manifest.json los hashes de las cinco capas, del código
+y de los parámetros de la fórmula. Si nada cambió y las salidas existen, el cálculo se
+omite; --forzar recalcula de todas formas. Si solo cambiaron algunas zonas de las capas, se
+recalculan y parchean solo las teselas de 256x256 afectadas (riesgo.npy, chunks del almacén,
+estadísticas y teselas de la pirámide; ver incremental.py); --completo recalcula toda la grilla.
+
+MODO POR BANDAS:
+----------------
+Para grillas que no entran en memoria, --por-bandas recorre las capas (abiertas con
+memory-map desde la caché binaria) en bandas de filas, aplica la fórmula y la excepción 99
+por banda, acumula las estadísticas de forma incremental y escribe riesgo.csv y riesgo.npy
+banda por banda (el almacén por chunks se arma al final desde riesgo.npy). El uso de memoria queda acotado por el tamaño de la banda.
+
+PIRÁMIDE DE TESELAS:
+--------------------
+Con --teselas, además de riesgo.jpeg se genera una pirámide de vistas reducidas cortada en
+teselas de 256x256 (ver piramide.py) para que el mapa cargue primero una vista liviana y
+pida solo las teselas visibles. Los niveles se reducen promediando bloques de 2x2, salvo
+cuando 0 o 99 son mayoría en el bloque, que se conservan como tales.
+
+ALMACÉN POR CHUNKS:
+------------------
+El resultado se guarda en riesgo_almacen/: chunks de 256x256 comprimidos con zlib y un
+metadatos.json con forma, dtype, nodata=99 y estadísticas por chunk. Los lectores pueden
+leer una ventana sin descomprimir el resto (almacen.AlmacenChunks). riesgo.csv queda como
+exportación para herramientas que lo necesiten y se omite con --sin-csv. Por defecto tiene
+el mismo texto que escribía pandas; --csv-precision N fija N decimales y --csv-enteros
+escribe sin decimales los valores enteros (ver exportar_csv.py).
 
 AUTOR: NASA Space Apps Challenge - Córdoba Team
 """
 
-import pandas as pd
 import numpy as np
+import contextlib
 import os
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 import json
-
-def normalizar_valores(valores, rango_min=1, rango_max=10):
+import time
+
+try:
+    import numexpr as ne
+except ImportError:
+    # numexpr es opcional: sin él, el camino fusionado usa NumPy con buffers out=
+    ne = None
+
+from alineacion import cargar_capas
+from almacen import METADATOS_ALMACEN, escribir_almacen
+from instrumentacion import activar, etapa, medir
+from mascaras import MascaraBits, es_binaria
+from manifiesto import cargar_manifiesto, guardar_seccion, huella, huella_codigo, vigente
+
+# Directorio de los scripts: las rutas del código de la huella se arman a partir de él
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# renderizado.py y piramide.py (Pillow) se importan dentro de las funciones que generan
+# imágenes, así el cálculo sin JPEG no paga su importación
+NEON_YELLOW = '#eafe07'
+ELECTRIC_BLUE = '#0042A6'
+
+# Archivos de entrada de la fórmula de riesgo
+ARCHIVOS_CAPAS = {
+    'flood': 'flood.csv',
+    'landslide': 'landslide.csv',
+    'water': 'water.csv',
+    'urban': 'urban.csv',
+    'area_protegida': 'pixeles_areas_protegidas.csv'
+}
+
+# Parámetros de la fórmula (forman parte de la huella del manifiesto de construcción)
+PESO_AMENAZAS = 0.5
+RANGO_LANDSLIDE = (1, 10)
+VALOR_SIN_DATO = 99
+
+# Código que determina las salidas de riesgo (su hash forma parte de la huella)
+CODIGO_RIESGO = [os.path.join(DIRECTORIO, archivo)
+                 for archivo in ('calcular_riesgo.py', 'renderizado.py', 'piramide.py', 'almacen.py', 'exportar_csv.py',
+                                 'incremental.py', 'alineacion.py', 'mascaras.py', 'histograma.py')]
+
+# Formato de riesgo.csv: precision=None reproduce el texto de DataFrame.to_csv (repr de float64)
+FORMATO_CSV = {'precision': None, 'enteros': False}
+
+# Almacén por chunks comprimidos del resultado
+DIRECTORIO_ALMACEN = 'riesgo_almacen'
+SALIDA_ALMACEN = os.path.join(DIRECTORIO_ALMACEN, METADATOS_ALMACEN)
+
+# Salidas del cálculo completo
+SALIDAS_RIESGO = ['riesgo.csv', 'riesgo.npy', SALIDA_ALMACEN, 'riesgo.jpeg', 'riesgo_scale.json']
+
+# Directorio de la pirámide de teselas del riesgo (--teselas)
+DIRECTORIO_TESELAS = os.path.join('teselas', 'riesgo')
+SALIDA_TESELAS = os.path.join(DIRECTORIO_TESELAS, 'teselas.json')  # piramide.INDICE_TESELAS
+
+def normalizar_valores(valores, rango_min=1, rango_max=10, min_actual=None, max_actual=None):
     """
     Normaliza los valores al rango especificado [rango_min, rango_max]
+    Si se indican min_actual/max_actual (p. ej. los de la capa completa) se usan en lugar
+    de los de `valores`, lo que permite normalizar la capa por partes.
     """
-    min_actual = np.min(valores)
-    max_actual = np.max(valores)
+    if min_actual is None:
+        min_actual = np.min(valores)
+    if max_actual is None:
+        max_actual = np.max(valores)
 
     if max_actual == min_actual:
         # Si todos los valores son iguales, devolver el valor medio del rango
@@ -79,45 +193,424 @@ def normalizar_valores(valores, rango_min=1, rango_max=10):
     # Fórmula de normalización: nuevo = rango_min + ((valor - min_actual) / (max_actual - min_actual)) * (rango_max - rango_min)
     return rango_min + ((valores - min_actual) / (max_actual - min_actual)) * (rango_max - rango_min)
 
-def calcular_riesgo():
+def rango_por_bloques(valores, filas_por_bloque=1024):
     """
-    Calcula el riesgo aplicando la fórmula: (flood + landslide_normalizado) * (1/2) * water * (1-urban) * area_protegida
-    Con excepción: Si water * (1-urban) * area_protegida != 0 y flood = 0, entonces valor = 99
+    Primera pasada de la normalización por bloques: calcula mínimo y máximo globales
+    recorriendo la matriz (o memory-map) de a `filas_por_bloque` filas.
+    """
+    min_actual = np.inf
+    max_actual = -np.inf
+    for inicio in range(0, valores.shape[0], filas_por_bloque):
+        bloque = valores[inicio:inicio + filas_por_bloque]
+        if bloque.size:
+            min_actual = min(min_actual, np.min(bloque).item())
+            max_actual = max(max_actual, np.max(bloque).item())
+    return min_actual, max_actual
+
+def normalizar_valores_por_bloques(valores, rango_min=1, rango_max=10, min_actual=None, max_actual=None,
+                                   filas_por_bloque=1024, out=None, dtype=np.float32):
+    """
+    Versión en dos pasadas de normalizar_valores() para capas que no conviene cargar enteras.
 
-    Los valores de flood ya están en rango correcto (0-10), landslide se normaliza al rango 1-10.
+    1. Mínimo y máximo globales: se usan min_actual/max_actual si se conocen (p. ej. de los
+       metadatos de la caché de capas); si no, se obtienen con rango_por_bloques().
+    2. La transformación afín se aplica bloque a bloque directamente sobre `out`
+       (float32 por defecto), sin crear matrices temporales del tamaño de la capa.
+
+    Si `out` es la misma matriz flotante que `valores`, la normalización es in-place.
+    """
+    if min_actual is None or max_actual is None:
+        min_calc, max_calc = rango_por_bloques(valores, filas_por_bloque)
+        min_actual = min_calc if min_actual is None else min_actual
+        max_actual = max_calc if max_actual is None else max_actual
+
+    if out is None:
+        out = np.empty(valores.shape, dtype=dtype)
+
+    if max_actual == min_actual:
+        # Si todos los valores son iguales, devolver el valor medio del rango
+        out[...] = (rango_min + rango_max) / 2
+        return out
+
+    escala = (rango_max - rango_min) / (max_actual - min_actual)
+    en_sitio = out is valores
+
+    for inicio in range(0, valores.shape[0], filas_por_bloque):
+        fin = inicio + filas_por_bloque
+        bloque = out[inicio:fin]
+        if not en_sitio:
+            np.copyto(bloque, valores[inicio:fin], casting='unsafe')
+        # nuevo = rango_min + (valor - min_actual) * escala, en el mismo buffer
+        bloque -= min_actual
+        bloque *= escala
+        bloque += rango_min
+
+    return out
+
+@medir('riesgo.formula')
+def aplicar_formula(flood, landslide, water, urban, area_protegida, dtype=np.float64, peso=PESO_AMENAZAS,
+                    valido=None):
+    """
+    Aplica la fórmula de riesgo y la excepción 99 (sin dato) sobre matrices de igual forma.
+    Se usa tanto sobre la grilla completa como sobre cada banda de filas.
+    `peso` es el factor de (flood + landslide), 0.5 en la fórmula publicada.
+
+    Las capas pueden venir en su dtype compacto (uint8); el cálculo se hace en `dtype`
+    (ver elegir_dtype_calculo) sin convertir antes cada capa completa a flotante.
+    Si las tres máscaras son 0/1, `valido` (bool, ver mascaras.py) puede traer ya el factor
+    water * (1-urban) * area_protegida; en ese caso water, urban y area_protegida no se usan.
+    """
+    if valido is not None:
+        notvalid_factor = valido
+    else:
+        # Calcular water * (1-urban) * area_protegida
+        notvalid_factor = np.subtract(1, urban, dtype=dtype)
+        notvalid_factor *= water
+        notvalid_factor *= area_protegida
+
+    # Aplicar la fórmula principal
+    riesgo = np.add(flood, landslide, dtype=dtype)
+    riesgo *= peso
+    riesgo *= notvalid_factor
+
+    # Aplicar la excepción: Si water * (1-urban) * area_protegida != 0 y flood = 0, entonces 99 (sin dato)
+    # (flood = 0 indica valor mínimo/nulo)
+    mask_excepcion = (notvalid_factor != 0) & (flood == 0.0)
+    riesgo[mask_excepcion] = VALOR_SIN_DATO
+
+    return riesgo
+
+class EstadisticasRiesgo:
+    """
+    Acumula mínimo, máximo, promedio y conteos de valores especiales banda por banda,
+    sin necesidad de tener la matriz de riesgo completa en memoria.
+    """
+
+    def __init__(self):
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.suma = 0.0
+        self.cantidad = 0
+        self.count_99 = 0
+        self.count_zero = 0
+
+    def actualizar(self, banda):
+        if banda.size == 0:
+            return
+        self.acumular(float(np.min(banda)), float(np.max(banda)), float(np.sum(banda, dtype=np.float64)),
+                      banda.size, int(np.count_nonzero(banda == 99)), int(np.count_nonzero(banda == 0)))
+
+    def acumular(self, minimo, maximo, suma, cantidad, count_99, count_zero):
+        """
+        Suma un agregado parcial ya calculado (p. ej. por el kernel fusionado).
+        """
+        self.minimo = min(self.minimo, minimo)
+        self.maximo = max(self.maximo, maximo)
+        self.suma += suma
+        self.cantidad += cantidad
+        self.count_99 += count_99
+        self.count_zero += count_zero
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else float('nan')
+
+
+def mostrar_estadisticas(estadisticas):
+    """
+    Muestra las estadísticas del riesgo (todas las celdas, incluidos los 99). Las usan el cálculo
+    completo, el cálculo por bandas y el incremental, así informan lo mismo para las mismas capas.
+    """
+    print("Estadísticas del riesgo calculado:")
+    print(f"  Mínimo: {estadisticas.minimo}")
+    print(f"  Máximo: {estadisticas.maximo}")
+    print(f"  Promedio: {estadisticas.promedio:.4f}")
+
+    # Contar valores especiales
+    print(f"  Valores 99 (excepción): {estadisticas.count_99}")
+    print(f"  Valores 0: {estadisticas.count_zero}")
+
+@medir('riesgo.formula')
+def calcular_riesgo_fusionado(flood, landslide, water, urban, area_protegida, dtype=np.float64,
+                              out=None, motor='auto', elementos_por_bloque=1 << 16, peso=PESO_AMENAZAS,
+                              valido=None):
+    """
+    Camino fusionado de aplicar_formula(): calcula el riesgo, la excepción 99, el rango de
+    flood/landslide y las estadísticas del resultado en una sola pasada sobre la grilla.
+
+    La grilla se recorre en bloques de filas de ~`elementos_por_bloque` celdas que entran en
+    caché; cada bloque se evalúa en buffers preasignados (sin temporales del tamaño de la
+    grilla) y sus estadísticas se calculan mientras todavía está en caché. Con motor='numexpr'
+    (o 'auto' si numexpr está instalado) la fórmula de cada bloque se evalúa con numexpr; si no,
+    con ufuncs de NumPy y argumentos out=. El resultado es idéntico al de aplicar_formula().
+
+    Si water, urban y area_protegida son máscaras 0/1, `valido` (MascaraBits, ver mascaras.py) trae
+    el factor water * (1-urban) * area_protegida ya combinado en bits: cada bloque desempaqueta solo
+    sus filas y el factor se aplica como máscara, sin leer las tres capas ni multiplicar flotantes.
+
+    Devuelve (riesgo, estadisticas, rangos) con rangos = {'flood': (min, max), 'landslide': (min, max)}.
+    """
+    if motor == 'auto':
+        motor = 'numexpr' if ne is not None else 'numpy'
+    if motor == 'numexpr' and ne is None:
+        raise ImportError("numexpr no está instalado (pip install numexpr)")
+
+    # Vistas ndarray de las capas: evita el costo de la subclase memmap en cada bloque
+    flood, landslide = np.asarray(flood), np.asarray(landslide)
+    if valido is None:
+        water, urban, area_protegida = (np.asarray(capa) for capa in (water, urban, area_protegida))
+
+    filas, columnas = flood.shape
+    if out is None:
+        out = np.empty((filas, columnas), dtype=dtype)
+
+    filas_por_bloque = max(1, elementos_por_bloque // max(columnas, 1))
+    factor_buf = np.empty((filas_por_bloque, columnas), dtype=dtype)
+    mascara_buf = np.empty((filas_por_bloque, columnas), dtype=bool)
+    auxiliar_buf = np.empty((filas_por_bloque, columnas), dtype=bool)
+
+    estadisticas = EstadisticasRiesgo()
+    rangos = {'flood': [np.inf, -np.inf], 'landslide': [np.inf, -np.inf]}
+
+    for inicio in range(0, filas, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque, filas)
+        n = fin - inicio
+
+        flood_b = flood[inicio:fin]
+        landslide_b = landslide[inicio:fin]
+        riesgo_b = out[inicio:fin]
+        factor = factor_buf[:n]
+        mascara = mascara_buf[:n]
+        auxiliar = auxiliar_buf[:n]
+
+        if valido is not None:
+            factor = valido.desempaquetar(inicio, fin)
+            if motor == 'numexpr':
+                ne.evaluate(f'(flood + landslide) * {float(peso)!r}',
+                            local_dict={'flood': flood_b, 'landslide': landslide_b}, out=riesgo_b, casting='unsafe')
+            else:
+                np.add(flood_b, landslide_b, out=riesgo_b)
+                np.multiply(riesgo_b, peso, out=riesgo_b)
+            np.multiply(riesgo_b, factor, out=riesgo_b)
+        elif motor == 'numexpr':
+            variables = {'flood': flood_b, 'landslide': landslide_b, 'water': water[inicio:fin],
+                         'urban': urban[inicio:fin], 'area': area_protegida[inicio:fin]}
+            ne.evaluate('(1 - urban) * water * area', local_dict=variables, out=factor, casting='unsafe')
+            variables['factor'] = factor
+            ne.evaluate(f'(flood + landslide) * {float(peso)!r} * factor', local_dict=variables,
+                        out=riesgo_b, casting='unsafe')
+        else:
+            # Calcular water * (1-urban) * area_protegida
+            np.subtract(1, urban[inicio:fin], out=factor)
+            np.multiply(factor, water[inicio:fin], out=factor)
+            np.multiply(factor, area_protegida[inicio:fin], out=factor)
+
+            # Aplicar la fórmula principal
+            np.add(flood_b, landslide_b, out=riesgo_b)
+            np.multiply(riesgo_b, peso, out=riesgo_b)
+            np.multiply(riesgo_b, factor, out=riesgo_b)
+
+        # Aplicar la excepción 99 (sin dato)
+        if valido is not None:
+            np.equal(flood_b, 0, out=mascara)
+            np.logical_and(mascara, factor, out=mascara)
+        else:
+            np.not_equal(factor, 0, out=mascara)
+            np.equal(flood_b, 0, out=auxiliar)
+            np.logical_and(mascara, auxiliar, out=mascara)
+        np.copyto(riesgo_b, VALOR_SIN_DATO, where=mascara)
+
+        # Estadísticas del bloque mientras está en caché
+        np.equal(riesgo_b, 99, out=mascara)
+        np.equal(riesgo_b, 0, out=auxiliar)
+        estadisticas.acumular(float(riesgo_b.min()), float(riesgo_b.max()),
+                              float(riesgo_b.sum(dtype=np.float64)), riesgo_b.size,
+                              int(np.count_nonzero(mascara)), int(np.count_nonzero(auxiliar)))
+
+        for nombre, bloque in (('flood', flood_b), ('landslide', landslide_b)):
+            rangos[nombre][0] = min(rangos[nombre][0], float(bloque.min()))
+            rangos[nombre][1] = max(rangos[nombre][1], float(bloque.max()))
+
+    return out, estadisticas, {nombre: tuple(r) for nombre, r in rangos.items()}
+
+def _valores_enteros(meta, max_valores=1024):
+    """
+    Valores posibles (float64) de una capa entera según sus metadatos, o None si la capa
+    es flotante o tiene demasiados valores distintos.
+    """
+    if np.dtype(meta['dtype']).kind not in 'iu' or meta['max'] - meta['min'] >= max_valores:
+        return None
+    return np.arange(meta['min'], meta['max'] + 1, dtype=np.float64)
+
+def tabla_landslide(meta, rango=RANGO_LANDSLIDE):
+    """
+    Para una capa landslide entera, tabla con el valor normalizado al `rango` de cada entero entre
+    min(0, mínimo) y el máximo, de modo que landslide_normalizado = tabla[capa - base].
+    Devuelve (tabla, base), o (None, None) si la capa no es entera.
+    """
+    if _valores_enteros(meta) is None:
+        return None, None
+    base = min(0, meta['min'])
+    enteros = np.arange(base, meta['max'] + 1, dtype=np.float64)
+    tabla = normalizar_valores(enteros, *rango, min_actual=meta['min'], max_actual=meta['max'])
+    return tabla, base
+
+def normalizar_con_tabla(capa, tabla, base):
+    """
+    Normaliza una capa entera indexando la tabla de tabla_landslide() (un acceso por celda).
+    """
+    return tabla[capa] if base == 0 else tabla[capa.astype(np.int64) - base]
+
+def elegir_dtype_calculo(metas, tabla):
     """
+    Elige float32 para la fórmula si da exactamente el mismo resultado que float64 en todas
+    las combinaciones posibles de valores de entrada; si no, float64.
+
+    Con capas enteras (flood 0-10, máscaras 0-1) las combinaciones son pocas y se verifican
+    todas, así que la salida es idéntica a la del cálculo en float64.
+    """
+    flood_vals = _valores_enteros(metas['flood'])
+    mascaras = [_valores_enteros(metas[nombre]) for nombre in ('water', 'urban', 'area_protegida')]
+
+    if tabla is None or flood_vals is None or any(m is None for m in mascaras):
+        return np.dtype(np.float64)
+
+    # Todos los factores water * (1 - urban) * area_protegida posibles
+    w, u, a = np.meshgrid(*mascaras, indexing='ij')
+    factor64 = (w * (1 - u) * a).ravel()
+    factor32 = ((1 - u.astype(np.float32)) * w.astype(np.float32) * a.astype(np.float32)).ravel()
+    if not np.array_equal(factor32.astype(np.float64), factor64):
+        return np.dtype(np.float64)
+
+    f, l, k = np.meshgrid(flood_vals, tabla, np.unique(factor64), indexing='ij')
+    riesgo64 = (f + l) * PESO_AMENAZAS * k
+    riesgo32 = (f.astype(np.float32) + l.astype(np.float32)) * np.float32(PESO_AMENAZAS) * k.astype(np.float32)
+
+    if np.array_equal(riesgo32.astype(np.float64), riesgo64):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+def salidas_riesgo(generar_jpeg=True, csv=True, teselas=False):
+    """
+    Lista de salidas que debe registrar el manifiesto según las opciones pedidas.
+    """
+    salidas = [s for s in SALIDAS_RIESGO
+               if (csv or s != 'riesgo.csv') and (generar_jpeg or s not in ('riesgo.jpeg', 'riesgo_scale.json'))]
+    return salidas + [SALIDA_TESELAS] if teselas else salidas
+
+@medir('riesgo.escritura_csv')
+def escribir_csv_riesgo(riesgo, ruta='riesgo.csv', filas_por_bloque=256, modo='w', formato_csv=None, workers=None):
+    """
+    Escribe la matriz de riesgo como CSV sin índices ni encabezados con exportar_csv.py:
+    los bloques de filas se formatean en paralelo y se escriben en orden. Los valores se
+    formatean como float64, así el texto es el mismo que con el cálculo en float64 aunque
+    la matriz esté en float32. formato_csv = {'precision': N o None, 'enteros': bool}.
+    """
+    from exportar_csv import exportar_csv
+
+    formato_csv = formato_csv or FORMATO_CSV
+    return exportar_csv(riesgo, ruta, formato_csv['precision'], formato_csv['enteros'], workers,
+                        filas_por_bloque, modo)
+
+def huella_riesgo(formato_csv=None, directorio_entrada='.', grilla=None, estiramiento=None):
+    """
+    Huella del cálculo de riesgo: hashes de las cinco capas, del código y de los parámetros
+    (incluido el formato de riesgo.csv y, si se declararon, la grilla destino y el estiramiento
+    de colores).
+    """
+    parametros = {
+        'peso_amenazas': PESO_AMENAZAS,
+        'rango_landslide': list(RANGO_LANDSLIDE),
+        'valor_sin_dato': VALOR_SIN_DATO,
+        'formato_csv': formato_csv or FORMATO_CSV
+    }
+    if grilla is not None:
+        parametros['grilla'] = grilla
+    if estiramiento is not None:
+        parametros['estiramiento'] = list(estiramiento)
+    return huella(rutas_capas(directorio_entrada).values(), huella_codigo(*CODIGO_RIESGO), parametros)
+
+def riesgo_vigente(salidas, forzar=False, formato_csv=None, directorio_entrada='.', grilla=None,
+                   estiramiento=None):
+    """
+    Compara la huella actual con la registrada en build_manifest.json.
+    Devuelve None si las salidas pedidas están vigentes (no hace falta recalcular)
+    o la huella actual si hay que recalcular.
+    """
+    huella_actual = huella_riesgo(formato_csv, directorio_entrada, grilla, estiramiento)
+    registro = cargar_manifiesto('.').get('calcular_riesgo', {}).get('riesgo')
+
+    if (not forzar and vigente(registro, huella_actual)
+            and set(salidas) <= set(registro.get('salidas', []))):
+        print("Sin cambios en las capas de entrada ni en la fórmula: se conservan " + ", ".join(salidas))
+        return None
+
+    return huella_actual
+
+def registrar_riesgo(huella_actual, salidas):
+    """
+    Registra en build_manifest.json las salidas generadas con la huella actual.
+    """
+    guardar_seccion('.', 'calcular_riesgo', {'riesgo': {'huella': huella_actual, 'salidas': salidas}})
+
+def rutas_capas(directorio='.'):
+    """
+    Rutas de los CSV de entrada dentro del directorio dado.
+    """
+    return {nombre: os.path.join(directorio, archivo) for nombre, archivo in ARCHIVOS_CAPAS.items()}
+
+@medir('riesgo.preparar_entradas')
+def preparar_entradas(directorio='.', grilla=None):
+    """
+    Lee las cinco capas del directorio, normaliza landslide, elige el dtype de cálculo y recorta todas las
+    matrices a las dimensiones mínimas comunes. Con una grilla destino (ver alineacion.leer_grilla)
+    las capas se remuestrean a ella en lugar de recortarse. Devuelve un diccionario con las matrices
+    ('flood', 'landslide', 'water', 'urban', 'area_protegida') y el 'dtype', o None si falla la lectura.
+    """
+    rutas = rutas_capas(directorio)
 
     # Leer los archivos CSV
     print("Leyendo archivos CSV...")
 
     try:
-        flood_df = pd.read_csv('flood.csv', header=None)
-        landslide_df = pd.read_csv('landslide.csv', header=None)
-        water_df = pd.read_csv('water.csv', header=None)
-        urban_df = pd.read_csv('urban.csv', header=None)
-        area_protegida_df = pd.read_csv('pixeles_areas_protegidas.csv', header=None)
+        # Las capas se leen desde la caché binaria (ver capas.py); el CSV solo se parsea si cambió.
+        # Con grilla, desde la caché de capas alineadas (ver alineacion.py)
+        capas, metas = cargar_capas(rutas, grilla)
+        flood_capa = capas['flood']
+        landslide_capa = capas['landslide']
+        water_capa = capas['water']
+        urban_capa = capas['urban']
+        area_protegida_capa = capas['area_protegida']
 
         print("Archivos leídos correctamente")
-        print(f"Dimensiones flood: {flood_df.shape}")
-        print(f"Dimensiones landslide: {landslide_df.shape}")
-        print(f"Dimensiones water: {water_df.shape}")
-        print(f"Dimensiones urban: {urban_df.shape}")
-        print(f"Dimensiones area_protegida: {area_protegida_df.shape}")
+        print(f"Dimensiones flood: {flood_capa.shape}")
+        print(f"Dimensiones landslide: {landslide_capa.shape}")
+        print(f"Dimensiones water: {water_capa.shape}")
+        print(f"Dimensiones urban: {urban_capa.shape}")
+        print(f"Dimensiones area_protegida: {area_protegida_capa.shape}")
 
     except Exception as e:
         print(f"Error al leer los archivos CSV: {str(e)}")
-        return
+        return None
 
-    # Convertir a arrays numpy para operaciones vectorizadas
-    flood = flood_df.values.astype(float)
-    landslide = landslide_df.values.astype(float)
-    water = water_df.values.astype(float)
-    urban = urban_df.values.astype(float)
-    area_protegida = area_protegida_df.values.astype(float)
+    # Las capas se mantienen en su dtype compacto (uint8 para las capas categóricas)
+    flood = flood_capa
+    landslide = landslide_capa
+    water = water_capa
+    urban = urban_capa
+    area_protegida = area_protegida_capa
 
     # Flood ya está en el rango correcto (0-10), normalizar landslide al rango 1-10 para poder sumarlos
     print("Flood ya está en rango correcto (0-10), normalizando landslide al rango 1-10...")
-    landslide_normalizado = normalizar_valores(landslide, 1, 10)
+    with etapa('riesgo.normalizacion'):
+        tabla, base = tabla_landslide(metas['landslide'])
+        dtype = elegir_dtype_calculo(metas, tabla)
+
+        if tabla is not None:
+            # Capa entera: un valor normalizado por entero posible
+            landslide_normalizado = normalizar_con_tabla(landslide, tabla.astype(dtype), base)
+        else:
+            landslide_normalizado = normalizar_valores(landslide.astype(float), *RANGO_LANDSLIDE)
 
     print(f"Flood: {np.min(flood):.1f} - {np.max(flood):.1f} (sin normalizar)")
     print(f"Landslide: {np.min(landslide):.1f} - {np.max(landslide):.1f} → {np.min(landslide_normalizado):.1f} - {np.max(landslide_normalizado):.1f}")
@@ -125,9 +618,6 @@ def calcular_riesgo():
     # Usar flood sin normalizar y landslide normalizado
     landslide = landslide_normalizado
 
-    # Calcular el riesgo
-    print("Calculando riesgo...")
-
     # Verificar y ajustar dimensiones de matrices (usar la matriz más chica si hay discrepancias)
     matrices_to_check = [
         ('flood', flood),
@@ -141,7 +631,7 @@ def calcular_riesgo():
     min_rows = min(matrix.shape[0] for _, matrix in matrices_to_check)
     min_cols = min(matrix.shape[1] for _, matrix in matrices_to_check)
 
-    print(f"Dimensiones objetivo (mínimas): {min_rows} x {min_cols}")
+    print(f"Dimensiones objetivo ({'grilla' if grilla else 'mínimas'}): {min_rows} x {min_cols}")
 
     # Recortar todas las matrices a las dimensiones mínimas
     for i, (name, matrix) in enumerate(matrices_to_check):
@@ -162,25 +652,111 @@ def calcular_riesgo():
 
     print("✓ Todas las matrices ajustadas a dimensiones consistentes")
 
-    # Inicializar array de riesgo con ceros
-    riesgo = np.zeros_like(flood)
+    return {
+        'flood': flood,
+        'landslide': landslide,
+        'water': water,
+        'urban': urban,
+        'area_protegida': area_protegida,
+        'dtype': dtype,
+        'valido': factor_en_bits(metas, water, urban, area_protegida)
+    }
+
+def factor_en_bits(metas, water, urban, area_protegida):
+    """
+    Si water, urban y area_protegida son máscaras 0/1, devuelve el factor water * (1-urban) * area_protegida
+    empaquetado en bits (MascaraBits, ver mascaras.py); si alguna no es binaria, None.
+    """
+    if not all(es_binaria(metas[nombre]) for nombre in ('water', 'urban', 'area_protegida')):
+        return None
+
+    with etapa('riesgo.mascaras'):
+        valido = (MascaraBits.desde_matriz(water) & ~MascaraBits.desde_matriz(urban)
+                  & MascaraBits.desde_matriz(area_protegida))
+    print(f"Máscaras water, urban y area_protegida combinadas en bits: {valido.nbytes / 1024:.1f} KB "
+          f"(factor denso en float64: {water.size * 8 / 1024:.1f} KB)")
+    return valido
+
+@medir('riesgo.calcular_riesgo')
+def calcular_riesgo(forzar=False, metodo='fusionado', teselas=False, workers=None, csv=True, formato_csv=None,
+                    generar_jpeg=True, directorio_entrada='.', incremental=True, grilla=None, estiramiento=None):
+    """
+    Calcula el riesgo aplicando la fórmula: (flood + landslide_normalizado) * (1/2) * water * (1-urban) * area_protegida
+    Con excepción: Si water * (1-urban) * area_protegida != 0 y flood = 0, entonces valor = 99
 
-    # Calcular water * (1-urban) * area_protegida
-    notvalid_factor = water * (1 - urban) * area_protegida
+    Los valores de flood ya están en rango correcto (0-10), landslide se normaliza al rango 1-10.
 
-    # Aplicar la fórmula principal
-    riesgo = (flood + landslide) * 0.5 * notvalid_factor
+    Si ninguna de las cinco capas, ni la fórmula ni sus parámetros cambiaron desde la última
+    ejecución (según build_manifest.json) y las salidas existen, no se recalcula nada;
+    forzar=True recalcula siempre.
 
-    # Aplicar la excepción: Si water * (1-urban) * area_protegida != 0 y flood = 0, entonces 99 (sin dato)
-    # (flood = 0 indica valor mínimo/nulo)
-    mask_excepcion = (notvalid_factor != 0) & (flood == 0.0)
-    riesgo[mask_excepcion] = 99
+    metodo='fusionado' (por defecto) usa calcular_riesgo_fusionado(), que resuelve fórmula,
+    excepción y estadísticas en una pasada; metodo='clasico' usa aplicar_formula() y recorre
+    la grilla por separado para cada verificación y estadística. Ambos dan el mismo resultado.
+
+    teselas=True genera además la pirámide de teselas en teselas/riesgo/ (ver crear_teselas_riesgo).
+    El resultado se guarda siempre en riesgo.npy y riesgo_almacen/; csv=False omite riesgo.csv
+    y formato_csv elige su formato (ver escribir_csv_riesgo). workers se usa para riesgo.csv y las teselas.
+    Con csv=False y generar_jpeg=False solo se calcula y se guarda el binario (camino rápido).
+
+    Si solo cambiaron algunas zonas de las capas, incremental=True recalcula y parchea solo las
+    teselas afectadas (ver incremental.py); forzar=True o incremental=False recalculan todo.
+
+    Las capas se leen de directorio_entrada; las salidas se escriben en el directorio actual.
+    Sin grilla, las capas se recortan a las dimensiones mínimas comunes; con grilla (ver
+    alineacion.leer_grilla) se remuestrean a ella y la grilla forma parte de la huella.
+    estiramiento=(bajo, alto) estira el gradiente de riesgo.jpeg entre esos percentiles
+    (ver crear_jpeg_riesgo).
+    """
+    from incremental import calcular_riesgo_incremental, invalidar_estado, registrar_estado
+
+    salidas = salidas_riesgo(generar_jpeg, csv, teselas)
+    huella_actual = riesgo_vigente(salidas, forzar, formato_csv, directorio_entrada, grilla, estiramiento)
+    if huella_actual is None:
+        return
+
+    if (incremental and not forzar
+            and calcular_riesgo_incremental(huella_actual, salidas, workers, formato_csv, directorio_entrada,
+                                            grilla, estiramiento)):
+        return
+    invalidar_estado()
+
+    entradas = preparar_entradas(directorio_entrada, grilla)
+    if entradas is None:
+        return
+
+    flood = entradas['flood']
+    landslide = entradas['landslide']
+    water = entradas['water']
+    urban = entradas['urban']
+    area_protegida = entradas['area_protegida']
+    dtype = entradas['dtype']
+
+    # Calcular el riesgo
+    print("Calculando riesgo...")
+
+    print(f"Tipo de cálculo: {dtype} (exacto respecto de float64), método: {metodo}")
 
-    # Verificar rangos válidos
-    print("Verificando rangos de valores válidos...")
+    if metodo == 'fusionado':
+        # Fórmula, excepción 99, rangos y estadísticas en una sola pasada por bloques
+        riesgo, estadisticas, rangos = calcular_riesgo_fusionado(flood, landslide, water, urban,
+                                                                 area_protegida, dtype, valido=entradas['valido'])
 
-    flood_valid = np.all((flood >= 0) & (flood <= 10))
-    landslide_valid = np.all((landslide >= 1) & (landslide <= 10))
+        print("Verificando rangos de valores válidos...")
+        flood_valid = rangos['flood'][0] >= 0 and rangos['flood'][1] <= 10
+        landslide_valid = rangos['landslide'][0] >= 1 and rangos['landslide'][1] <= 10
+
+    else:
+        riesgo = aplicar_formula(flood, landslide, water, urban, area_protegida, dtype)
+
+        # Verificar rangos válidos
+        print("Verificando rangos de valores válidos...")
+
+        flood_valid = np.all((flood >= 0) & (flood <= 10))
+        landslide_valid = np.all((landslide >= 1) & (landslide <= 10))
+
+        estadisticas = EstadisticasRiesgo()
+        estadisticas.actualizar(riesgo)
 
     if not flood_valid:
         flood_min = np.min(flood)
@@ -193,36 +769,224 @@ def calcular_riesgo():
         print(f"Advertencia: landslide tiene valores fuera del rango válido [1-10]. Min: {landslide_min}, Max: {landslide_max}")
 
     # Estadísticas del resultado
-    riesgo_min = np.min(riesgo)
-    riesgo_max = np.max(riesgo)
-    riesgo_mean = np.mean(riesgo)
+    mostrar_estadisticas(estadisticas)
 
-    print("Estadísticas del riesgo calculado:")
-    print(f"  Mínimo: {riesgo_min}")
-    print(f"  Máximo: {riesgo_max}")
-    print(f"  Promedio: {riesgo_mean:.4f}")
+    # Guardar el resultado
+    print("Guardando resultado en riesgo.npy, riesgo_almacen/" + (" y riesgo.csv" if csv else "") + "...")
 
-    # Contar valores especiales
-    count_99 = np.sum(riesgo == 99)
-    count_zero = np.sum(riesgo == 0)
+    # Guardar sin índices ni headers
+    if csv:
+        escribir_csv_riesgo(riesgo, 'riesgo.csv', formato_csv=formato_csv, workers=workers)
 
-    print(f"  Valores 99 (excepción): {count_99}")
-    print(f"  Valores 0: {count_zero}")
+    # Copia binaria compacta (dtype del cálculo, float32 si es exacto)
+    with etapa('riesgo.escritura_npy'):
+        ruta_tmp = f'riesgo.npy.{os.getpid()}.tmp'
+        with open(ruta_tmp, 'wb') as f:
+            np.save(f, riesgo)
+        os.replace(ruta_tmp, 'riesgo.npy')
 
-    # Guardar el resultado
-    print("Guardando resultado en riesgo.csv...")
+    # Almacén por chunks comprimidos con estadísticas por chunk
+    with etapa('riesgo.almacen'):
+        escribir_almacen(riesgo, DIRECTORIO_ALMACEN, valor_sin_dato=VALOR_SIN_DATO)
 
-    # Convertir de vuelta a DataFrame para guardar como CSV
-    riesgo_df = pd.DataFrame(riesgo)
+    print("¡Cálculo completado!")
+    print(f"Dimensiones del archivo de salida: {riesgo.shape}")
 
-    # Guardar sin índices ni headers
-    riesgo_df.to_csv('riesgo.csv', index=False, header=False)
+    # Crear imagen JPEG del resultado (y la pirámide de teselas si se pidió)
+    if (not generar_jpeg or crear_jpeg_riesgo(riesgo, estiramiento=estiramiento)) and (not teselas or crear_teselas_riesgo(riesgo, workers)):
+        registrar_riesgo(huella_actual, salidas)
+        registrar_estado(directorio_entrada, grilla)
+
+def comparar_metodos(repeticiones=5):
+    """
+    Mide el método clásico (aplicar_formula + verificaciones y estadísticas por separado)
+    contra el kernel fusionado (NumPy, con el factor de máscaras en bits y, si está instalado,
+    numexpr) sobre las capas reales,
+    verificando que todos den exactamente el mismo resultado. Devuelve {método: segundos}.
+    """
+    entradas = preparar_entradas()
+    if entradas is None:
+        return None
+
+    capas = [entradas[nombre] for nombre in ('flood', 'landslide', 'water', 'urban', 'area_protegida')]
+    dtype = entradas['dtype']
+    flood, landslide = capas[0], capas[1]
+
+    def clasico():
+        riesgo = aplicar_formula(*capas, dtype)
+        np.all((flood >= 0) & (flood <= 10))
+        np.all((landslide >= 1) & (landslide <= 10))
+        np.min(riesgo), np.max(riesgo), np.mean(riesgo, dtype=np.float64)
+        np.count_nonzero(riesgo == 99), np.count_nonzero(riesgo == 0)
+        return riesgo
+
+    metodos = {'clasico': clasico,
+               'fusionado (numpy)': lambda: calcular_riesgo_fusionado(*capas, dtype, motor='numpy')[0]}
+    if ne is not None:
+        metodos['fusionado (numexpr)'] = lambda: calcular_riesgo_fusionado(*capas, dtype, motor='numexpr')[0]
+    if entradas['valido'] is not None:
+        metodos['fusionado (bits)'] = lambda: calcular_riesgo_fusionado(*capas, dtype, motor='numpy',
+                                                                        valido=entradas['valido'])[0]
+
+    referencia = clasico()
+    tiempos = {}
+
+    print(f"\nComparando métodos ({repeticiones} repeticiones, grilla {flood.shape[0]}x{flood.shape[1]}, {dtype}):")
+    for nombre, funcion in metodos.items():
+        mejor = np.inf
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            riesgo = funcion()
+            mejor = min(mejor, time.perf_counter() - inicio)
+
+        identico = np.array_equal(riesgo, referencia)
+        tiempos[nombre] = mejor
+        print(f"  {nombre:<22} {mejor * 1000:8.1f} ms  (x{tiempos['clasico'] / mejor:.2f})"
+              f"  {'✓ idéntico' if identico else '✗ DIFIERE'}")
+
+    return tiempos
+
+@medir('riesgo.por_bandas')
+def calcular_riesgo_por_bandas(filas_por_banda=256, generar_jpeg=True, forzar=False, teselas=False, workers=None,
+                               csv=True, formato_csv=None, directorio_entrada='.', incremental=True, grilla=None,
+                               estiramiento=None):
+    """
+    Variante de calcular_riesgo() con memoria acotada para grillas más grandes que la RAM.
+
+    Las capas se abren con memory-map desde la caché binaria y se procesan en bandas de
+    `filas_por_banda` filas: en cada banda se aplica la fórmula y la excepción 99, se
+    actualizan las estadísticas y se escribe la banda en riesgo.csv y riesgo.npy (al final el
+    almacén por chunks se arma leyendo riesgo.npy por bandas). La
+    normalización de landslide usa el mínimo/máximo global guardado en los metadatos de
+    la caché, por lo que no hace falta recorrer la capa completa antes de empezar. Las capas
+    enteras se normalizan con una tabla por valor; las flotantes en un buffer reutilizado
+    (normalizar_valores_por_bloques). El cálculo usa el mismo dtype compacto que calcular_riesgo().
+
+    Igual que calcular_riesgo(), no recalcula si las salidas están vigentes según el manifiesto
+    y, con incremental=True, recalcula solo las teselas cuyas capas cambiaron (el camino
+    incremental también recorre las capas por teselas con memoria acotada). Con grilla las capas
+    se alinean antes a la grilla destino (ver alineacion.py) y se abren alineadas con memory-map.
+    estiramiento funciona igual que en calcular_riesgo().
+    """
+    from incremental import calcular_riesgo_incremental, invalidar_estado, registrar_estado
+
+    salidas = salidas_riesgo(generar_jpeg, csv, teselas)
+    formato_csv = formato_csv or FORMATO_CSV
+    huella_actual = riesgo_vigente(salidas, forzar, formato_csv, directorio_entrada, grilla, estiramiento)
+    if huella_actual is None:
+        return
+
+    if incremental and not forzar:
+        estadisticas = calcular_riesgo_incremental(huella_actual, salidas, workers, formato_csv, directorio_entrada,
+                                                   grilla, estiramiento)
+        if estadisticas is not None:
+            return estadisticas
+    invalidar_estado()
+
+    print("Abriendo capas en modo por bandas...")
+
+    try:
+        rutas = rutas_capas(directorio_entrada)
+        capas, metas = cargar_capas(rutas, grilla)
+        meta_landslide = metas['landslide']
+
+        for nombre, capa in capas.items():
+            print(f"Dimensiones {nombre}: {capa.shape}")
+
+    except Exception as e:
+        print(f"Error al leer los archivos CSV: {str(e)}")
+        return
+
+    # Dimensiones mínimas comunes (mismo criterio que calcular_riesgo)
+    min_rows = min(capa.shape[0] for capa in capas.values())
+    min_cols = min(capa.shape[1] for capa in capas.values())
+    print(f"Dimensiones objetivo ({'grilla' if grilla else 'mínimas'}): {min_rows} x {min_cols}")
+
+    landslide_min = meta_landslide['min']
+    landslide_max = meta_landslide['max']
+    print(f"Landslide: {landslide_min:.1f} - {landslide_max:.1f} → normalizado por bandas al rango 1-10")
+
+    tabla, base = tabla_landslide(meta_landslide)
+    dtype = elegir_dtype_calculo(metas, tabla)
+    print(f"Tipo de cálculo: {dtype} (exacto respecto de float64)")
+
+    # Factor water * (1-urban) * area_protegida en bits si las tres capas son máscaras 0/1
+    valido = factor_en_bits(metas, *(capas[nombre][:min_rows, :min_cols]
+                                     for nombre in ('water', 'urban', 'area_protegida')))
+
+    # Buffer reutilizado en cada banda para la normalización de landslide flotante
+    landslide_buffer = None if tabla is not None else np.empty((filas_por_banda, min_cols), dtype=dtype)
+
+    estadisticas = EstadisticasRiesgo()
+    flood_min, flood_max = np.inf, -np.inf
+    landslide_valid = True
+
+    print(f"Calculando riesgo en bandas de {filas_por_banda} filas...")
+
+    if csv:
+        from exportar_csv import formatear_bloque
+
+    # Las bandas se escriben en temporales que reemplazan a las salidas al terminar
+    npy_tmp = f'riesgo.npy.{os.getpid()}.tmp'
+    csv_tmp = f'riesgo.csv.{os.getpid()}.tmp'
+    riesgo_npy = np.lib.format.open_memmap(npy_tmp, mode='w+', dtype=dtype, shape=(min_rows, min_cols))
 
-    print("¡Cálculo completado! Archivo 'riesgo.csv' generado.")
-    print(f"Dimensiones del archivo de salida: {riesgo_df.shape}")
+    with (open(csv_tmp, 'wb') if csv else contextlib.nullcontext()) as f_csv:
+        for inicio in range(0, min_rows, filas_por_banda):
+            fin = min(inicio + filas_por_banda, min_rows)
 
-    # Crear imagen JPEG del resultado
-    crear_jpeg_riesgo(riesgo)
+            flood = capas['flood'][inicio:fin, :min_cols]
+            if tabla is not None:
+                landslide = normalizar_con_tabla(capas['landslide'][inicio:fin, :min_cols], tabla.astype(dtype), base)
+            else:
+                landslide = normalizar_valores_por_bloques(capas['landslide'][inicio:fin, :min_cols], *RANGO_LANDSLIDE,
+                                                           min_actual=landslide_min, max_actual=landslide_max,
+                                                           out=landslide_buffer[:fin - inicio])
+            if valido is not None:
+                riesgo = aplicar_formula(flood, landslide, None, None, None, dtype,
+                                         valido=valido.desempaquetar(inicio, fin))
+            else:
+                water = capas['water'][inicio:fin, :min_cols]
+                urban = capas['urban'][inicio:fin, :min_cols]
+                area_protegida = capas['area_protegida'][inicio:fin, :min_cols]
+                riesgo = aplicar_formula(flood, landslide, water, urban, area_protegida, dtype)
+
+            flood_min = min(flood_min, float(np.min(flood)))
+            flood_max = max(flood_max, float(np.max(flood)))
+            landslide_valid &= bool(np.all((landslide >= 1) & (landslide <= 10)))
+            estadisticas.actualizar(riesgo)
+
+            riesgo_npy[inicio:fin] = riesgo
+            if csv:
+                f_csv.write(formatear_bloque(riesgo, formato_csv['precision'], formato_csv['enteros']))
+
+    riesgo_npy.flush()
+    del riesgo_npy
+    os.replace(npy_tmp, 'riesgo.npy')
+    if csv:
+        os.replace(csv_tmp, 'riesgo.csv')
+
+    riesgo = np.load('riesgo.npy', mmap_mode='r')
+    with etapa('riesgo.almacen'):
+        escribir_almacen(riesgo, DIRECTORIO_ALMACEN, valor_sin_dato=VALOR_SIN_DATO)
+
+    if not (flood_min >= 0 and flood_max <= 10):
+        print(f"Advertencia: flood tiene valores fuera del rango válido [0-10]. Min: {flood_min}, Max: {flood_max}")
+
+    if not landslide_valid:
+        print("Advertencia: landslide tiene valores fuera del rango válido [1-10]")
+
+    mostrar_estadisticas(estadisticas)
+
+    print("¡Cálculo completado! Resultado en riesgo.npy, riesgo_almacen/" + (" y riesgo.csv." if csv else "."))
+    print(f"Dimensiones del archivo de salida: ({min_rows}, {min_cols})")
+
+    if ((not generar_jpeg or crear_jpeg_riesgo(riesgo, estiramiento=estiramiento))
+            and (not teselas or crear_teselas_riesgo(riesgo, workers))):
+        registrar_riesgo(huella_actual, salidas)
+        registrar_estado(directorio_entrada, grilla)
+
+    return estadisticas
 
 def lighten_color(color, factor=0.5):
     """
@@ -256,11 +1020,10 @@ def darken_color(color, factor=0.5):
 
     return f'#{r_dark:02x}{g_dark:02x}{b_dark:02x}'
 
-def create_risk_colormap():
+def colores_riesgo():
     """
-    Crea un colormap personalizado para el riesgo usando Rocket Red.
+    Colores del gradiente de riesgo basado en Rocket Red: claro → base → oscuro.
     Los valores más altos tienen colores más intensos (oscuros).
-    Se usa para valores 1-10. El valor 0 es Neon Yellow, el 99 es Electric Blue.
     """
     base_color = '#E43700'  # Rocket Red
 
@@ -269,54 +1032,53 @@ def create_risk_colormap():
     dark_color = darken_color(base_color, 0.3)    # 30% negro para valores altos
 
     # El gradiente irá de claro (valores bajos) a oscuro (valores altos)
-    colors = [light_color, base_color, dark_color]
-
-    return mcolors.LinearSegmentedColormap.from_list('risk_cmap', colors)
+    return [light_color, base_color, dark_color]
 
-def crear_jpeg_riesgo(riesgo_matrix, dpi=100):
+def create_risk_colormap():
     """
-    Crea una imagen JPEG del mapa de riesgo y guarda información de la escala de colores.
+    Crea un colormap personalizado para el riesgo usando Rocket Red, como tabla de 256 colores.
+    Se usa para valores 1-10. El valor 0 es Neon Yellow, el 99 es Electric Blue.
     """
-    try:
-        print("Creando imagen JPEG del mapa de riesgo...")
-
-        # Crear figura sin márgenes
-        fig, ax = plt.subplots(figsize=(riesgo_matrix.shape[1]/dpi, riesgo_matrix.shape[0]/dpi), dpi=dpi)
-        ax.axis('off')
+    from renderizado import lut_gradiente
 
-        # Usar colormap personalizado
-        cmap = create_risk_colormap()
+    return lut_gradiente(colores_riesgo())
 
-        # Crear una copia de la matriz para modificar
-        display_matrix = riesgo_matrix.copy().astype(float)
-
-        # Reemplazar valores 99 con NaN para que aparezcan transparentes
-        display_matrix[display_matrix == 99] = np.nan
+@medir('riesgo.render_jpeg')
+def crear_jpeg_riesgo(riesgo_matrix, dpi=100, estiramiento=None):
+    """
+    Crea una imagen JPEG del mapa de riesgo y guarda información de la escala de colores.
 
-        # Crear la imagen con el colormap (NaN aparecerá transparente)
-        # Usar vmin=0, vmax=10 para que la escala cubra todo el rango posible 0-10
-        im = ax.imshow(display_matrix, cmap=cmap, interpolation='nearest', aspect='equal', vmin=0, vmax=10)
+    La imagen se genera con renderizado.py: la matriz se cuantiza a códigos uint8 y se
+    traduce a RGB con una LUT que incluye Neon Yellow (0) y Electric Blue (99), por lo que
+    tiene exactamente un píxel por celda. `dpi` se conserva por compatibilidad y no se usa.
 
-        # Dibujar Neon Yellow donde había valores 0
-        yellow_bg = np.zeros_like(riesgo_matrix)
-        yellow_bg[riesgo_matrix == 0] = 1  # 1 para Neon Yellow, 0 para transparente
-        ax.imshow(yellow_bg, cmap=mcolors.ListedColormap(['none', '#eafe07']), interpolation='nearest', aspect='equal')
+    Las estadísticas de los valores válidos de riesgo_scale.json (mínimo, máximo, promedio,
+    percentiles e histograma de clases) salen de un histograma.HistogramaRiesgo que se acumula
+    en la misma pasada que la cuantización. Con estiramiento=(bajo, alto) el gradiente va del
+    percentil bajo al alto (el histograma se acumula antes, en una pasada previa).
+    """
+    from histograma import HistogramaRiesgo, rango_estirado
+    from renderizado import color_en_lut, cuantizar_riesgo, guardar_jpeg, lut_riesgo
 
-        # Dibujar Electric Blue donde había valores 99
-        electric_blue_bg = np.zeros_like(riesgo_matrix)
-        electric_blue_bg[riesgo_matrix == 99] = 1  # 1 para Electric Blue (#0042A6), 0 para transparente
-        ax.imshow(electric_blue_bg, cmap=mcolors.ListedColormap(['none', '#0042A6']), interpolation='nearest', aspect='equal')
+    try:
+        print("Creando imagen JPEG del mapa de riesgo...")
 
-        # Ajustar layout para eliminar márgenes
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-        plt.margins(0, 0)
+        # Cuantizar (0 → Neon Yellow, 1-10 → gradiente con escala fija 0-10, 99 → Electric Blue)
+        histograma = HistogramaRiesgo(valor_sin_dato=VALOR_SIN_DATO)
+        rango = None
+        if estiramiento:
+            rango = rango_estirado(histograma.actualizar_por_bloques(riesgo_matrix), estiramiento)
+        if rango is not None:
+            print(f"Estiramiento de colores: percentiles {estiramiento[0]:g}-{estiramiento[1]:g} "
+                  f"→ {rango[0]:g} a {rango[1]:g}")
+            codigos = cuantizar_riesgo(riesgo_matrix, vmax=rango[1], valor_sin_dato=99, vmin=rango[0])
+        else:
+            codigos = cuantizar_riesgo(riesgo_matrix, vmax=10, valor_sin_dato=99,
+                                       histograma=None if estiramiento else histograma)
 
         # Guardar como JPEG con calidad alta
         jpeg_path = 'riesgo.jpeg'
-        plt.savefig(jpeg_path, format='jpeg', dpi=dpi, bbox_inches='tight',
-                   pad_inches=0, pil_kwargs={'quality': 95, 'optimize': True})
-
-        plt.close(fig)
+        guardar_jpeg(codigos, lut_riesgo(colores_riesgo()), jpeg_path, calidad=95)
 
         # Verificar tamaño del archivo
         file_size = os.path.getsize(jpeg_path) / 1024  # KB
@@ -330,22 +1092,19 @@ def crear_jpeg_riesgo(riesgo_matrix, dpi=100):
         for value in range(11):  # 0, 1, 2, ..., 10
             if value == 0:
                 # Valor 0: usar Neon Yellow
-                hex_color = '#eafe07'
+                hex_color = NEON_YELLOW
             else:
                 # Valores 1-10: usar gradiente rojo
                 # Para valores 1-10, normalizar al rango [0, 1]
                 normalized_value = (value - 1) / 9.0  # 1->0, 10->1
-                rgba = color_map(normalized_value)
-                # Convertir RGBA a hex
-                hex_color = '#{:02x}{:02x}{:02x}'.format(
-                    int(rgba[0] * 255),
-                    int(rgba[1] * 255),
-                    int(rgba[2] * 255)
-                )
+                if rango is not None:
+                    # Con estiramiento: posición del valor entre los dos percentiles
+                    normalized_value = min(max((value - rango[0]) / (rango[1] - rango[0]), 0.0), 1.0)
+                hex_color = color_en_lut(color_map, normalized_value)
             value_colors[str(value)] = hex_color
 
         # Agregar color especial para 99 (Electric Blue)
-        value_colors['99'] = '#0042A6'
+        value_colors['99'] = ELECTRIC_BLUE
 
         # Crear información de la escala de colores
         color_scale_info = {
@@ -363,10 +1122,7 @@ def crear_jpeg_riesgo(riesgo_matrix, dpi=100):
                 },
                 'value_range': {
                     'conceptual': '0-10 (escala completa del riesgo)',
-                    'actual_data': {
-                        'min': float(np.min(riesgo_matrix[riesgo_matrix != 99])),
-                        'max': float(np.max(riesgo_matrix[riesgo_matrix != 99]))
-                    }
+                    'actual_data': histograma.resumen()
                 }
             },
             'dimensions': f"{riesgo_matrix.shape[0]}x{riesgo_matrix.shape[1]}",
@@ -376,10 +1132,19 @@ def crear_jpeg_riesgo(riesgo_matrix, dpi=100):
             }
         }
 
+        if rango is not None:
+            color_scale_info['color_scheme']['stretch'] = {
+                'percentiles': list(estiramiento),
+                'min': rango[0],
+                'max': rango[1]
+            }
+
         # Guardar información de escala en JSON
         json_path = 'riesgo_scale.json'
-        with open(json_path, 'w', encoding='utf-8') as f:
+        ruta_tmp = f'{json_path}.{os.getpid()}.tmp'
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
             json.dump(color_scale_info, f, indent=2, ensure_ascii=False)
+        os.replace(ruta_tmp, json_path)
 
         print(f"✓ Información de escala guardada: {json_path}")
 
@@ -389,5 +1154,113 @@ def crear_jpeg_riesgo(riesgo_matrix, dpi=100):
         print(f"✗ Error creando imagen JPEG: {str(e)}")
         return False
 
+@medir('riesgo.teselas')
+def crear_teselas_riesgo(riesgo_matrix, workers=None):
+    """
+    Genera la pirámide de teselas XYZ del mapa de riesgo en teselas/riesgo/ con la misma
+    LUT que riesgo.jpeg. Los bloques donde 0 o 99 son mayoría conservan su color especial.
+    """
+    from piramide import generar_piramide
+    from renderizado import CODIGO_SIN_DATO, cuantizar_riesgo, lut_riesgo
+
+    try:
+        print("Generando pirámide de teselas del mapa de riesgo...")
+        inicio = time.perf_counter()
+
+        indice = generar_piramide(riesgo_matrix,
+                                  lambda nivel: cuantizar_riesgo(nivel, vmax=10, valor_sin_dato=VALOR_SIN_DATO),
+                                  lut_riesgo(colores_riesgo()), DIRECTORIO_TESELAS, metodo='media',
+                                  especiales=(0, VALOR_SIN_DATO), relleno=CODIGO_SIN_DATO, workers=workers)
+
+        print(f"✓ {indice['teselas']} teselas en {indice['zoom_max'] + 1} niveles "
+              f"({time.perf_counter() - inicio:.2f} s): {SALIDA_TESELAS}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error generando teselas: {str(e)}")
+        return False
+
+@medir('riesgo.teselas')
+def actualizar_teselas_riesgo(riesgo_matrix, ventanas, workers=None):
+    """
+    Regenera en teselas/riesgo/ solo las teselas de cada nivel que cubren las ventanas
+    (fila_inicio, fila_fin, columna_inicio, columna_fin) que cambiaron. Si no hay una pirámide
+    compatible la genera completa con crear_teselas_riesgo().
+    """
+    from piramide import actualizar_piramide
+    from renderizado import CODIGO_SIN_DATO, cuantizar_riesgo, lut_riesgo
+
+    try:
+        inicio = time.perf_counter()
+        indice = actualizar_piramide(riesgo_matrix, ventanas,
+                                     lambda nivel: cuantizar_riesgo(nivel, vmax=10, valor_sin_dato=VALOR_SIN_DATO),
+                                     lut_riesgo(colores_riesgo()), DIRECTORIO_TESELAS, metodo='media',
+                                     especiales=(0, VALOR_SIN_DATO), relleno=CODIGO_SIN_DATO, workers=workers)
+        if indice is None:
+            return crear_teselas_riesgo(riesgo_matrix, workers)
+
+        print(f"✓ {indice['actualizadas']} de {indice['teselas']} teselas regeneradas "
+              f"({time.perf_counter() - inicio:.2f} s): {SALIDA_TESELAS}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error actualizando teselas: {str(e)}")
+        return False
+
 if __name__ == "__main__":
-    calcular_riesgo()
+    import argparse
+
+    from alineacion import leer_grilla
+    from histograma import leer_estiramiento
+
+    parser = argparse.ArgumentParser(description='Cálculo del mapa de riesgo de desastres naturales')
+    parser.add_argument('--por-bandas', action='store_true',
+                        help='procesar la grilla por bandas de filas con memoria acotada')
+    parser.add_argument('--filas-por-banda', type=int, default=256,
+                        help='cantidad de filas por banda en el modo por bandas (default: 256)')
+    parser.add_argument('--sin-jpeg', action='store_true',
+                        help='no generar riesgo.jpeg ni riesgo_scale.json')
+    parser.add_argument('--forzar', action='store_true',
+                        help='recalcular aunque las entradas y la fórmula no hayan cambiado')
+    parser.add_argument('--completo', action='store_true',
+                        help='recalcular toda la grilla aunque solo hayan cambiado algunas teselas de las capas')
+    parser.add_argument('--metodo', choices=['fusionado', 'clasico'], default='fusionado',
+                        help='camino de cálculo en memoria (default: fusionado)')
+    parser.add_argument('--comparar-metodos', action='store_true',
+                        help='medir el método clásico contra el fusionado y salir')
+    parser.add_argument('--sin-csv', action='store_true',
+                        help='no exportar riesgo.csv (el resultado queda en riesgo.npy y riesgo_almacen/)')
+    parser.add_argument('--csv-precision', type=int, default=None,
+                        help='decimales fijos en riesgo.csv (default: mismo texto que pandas)')
+    parser.add_argument('--csv-enteros', action='store_true',
+                        help='escribir sin decimales los valores enteros de riesgo.csv (p. ej. 99 en lugar de 99.0)')
+    parser.add_argument('--teselas', action='store_true',
+                        help='generar también la pirámide de teselas XYZ en teselas/riesgo/')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='procesos para escribir riesgo.csv y codificar las teselas (default: uno por núcleo)')
+    parser.add_argument('--grilla', default=None,
+                        help="grilla destino 'FILASxCOLUMNAS' o JSON: remuestrear las capas en lugar de recortarlas "
+                             "a las dimensiones mínimas (ver alineacion.py)")
+    parser.add_argument('--estiramiento', metavar='BAJO,ALTO', default=None,
+                        help='estirar el gradiente de riesgo.jpeg entre dos percentiles de los valores válidos '
+                             '(p. ej. 2,98; default: escala fija 0-10)')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por etapa y guardarlos en DIR (ver instrumentacion.py)')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+    formato_csv = {'precision': args.csv_precision, 'enteros': args.csv_enteros}
+    grilla = leer_grilla(args.grilla) if args.grilla else None
+    estiramiento = leer_estiramiento(args.estiramiento) if args.estiramiento else None
+
+    if args.comparar_metodos:
+        comparar_metodos()
+    elif args.por_bandas:
+        calcular_riesgo_por_bandas(args.filas_por_banda, generar_jpeg=not args.sin_jpeg, forzar=args.forzar,
+                                   teselas=args.teselas, workers=args.workers, csv=not args.sin_csv,
+                                   formato_csv=formato_csv, incremental=not args.completo, grilla=grilla,
+                                   estiramiento=estiramiento)
+    else:
+        calcular_riesgo(forzar=args.forzar, metodo=args.metodo, teselas=args.teselas, workers=args.workers,
+                        csv=not args.sin_csv, formato_csv=formato_csv, generar_jpeg=not args.sin_jpeg,
+                        incremental=not args.completo, grilla=grilla, estiramiento=estiramiento)
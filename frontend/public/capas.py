@@ -0,0 +1,254 @@
+"""
+Cargador compartido de capas raster almacenadas como CSV.
+
+Cada CSV se convierte una sola vez a un binario tipado (.npy) con el dtype
+más compacto que representa sus valores sin pérdida (uint8 para las capas
+categóricas) y un archivo de metadatos (.json) con el tamaño, la fecha de
+modificación y el hash SHA-256 del CSV de origen. En las ejecuciones
+siguientes la capa se abre con memory-map y el CSV solo se vuelve a leer
+cuando el archivo de origen cambió.
+
+Uso:
+    from capas import cargar_capa
+    flood = cargar_capa('flood.csv')
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from instrumentacion import medir
+
+# Directorio (relativo al CSV) donde se guardan los binarios cacheados
+CACHE_DIR = '.cache_capas'
+
+# Incrementar si cambia el formato del binario o de los metadatos
+CACHE_VERSION = 2
+
+
+def hash_archivo(ruta, tamano_bloque=1 << 20):
+    """
+    Calcula el hash SHA-256 de un archivo leyéndolo por bloques.
+    """
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _es_numero(campo):
+    try:
+        float(campo)
+        return True
+    except ValueError:
+        return False
+
+
+def detectar_formato(ruta):
+    """
+    Detecta si el CSV tiene fila de encabezado y/o columna de etiquetas (Y_0, Y_1, etc.).
+    Devuelve la tupla (tiene_encabezado, tiene_etiquetas).
+    """
+    with open(ruta, 'r', encoding='utf-8') as f:
+        primera = f.readline().strip().split(',')
+        segunda = f.readline().strip().split(',')
+
+    tiene_encabezado = not all(_es_numero(c) for c in primera if c != '')
+    fila_datos = segunda if tiene_encabezado else primera
+    tiene_etiquetas = len(fila_datos) > 1 and not _es_numero(fila_datos[0])
+
+    return tiene_encabezado, tiene_etiquetas
+
+
+def dtype_compacto(matriz):
+    """
+    Devuelve el dtype más chico que representa exactamente todos los valores de la matriz.
+    Enteros → uint8/int8/.../int64 según el rango; flotantes → float32 si es exacto, si no float64.
+    """
+    if matriz.size == 0:
+        return np.dtype(np.uint8)
+
+    if matriz.dtype.kind == 'b':
+        return np.dtype(np.uint8)
+
+    if matriz.dtype.kind == 'f':
+        if np.all(np.isfinite(matriz)) and np.all(matriz == np.round(matriz)):
+            # Flotantes con valores enteros: tratarlos como enteros
+            matriz = matriz.astype(np.int64)
+        elif np.array_equal(matriz.astype(np.float32).astype(matriz.dtype), matriz, equal_nan=True):
+            return np.dtype(np.float32)
+        else:
+            return np.dtype(np.float64)
+
+    minimo = int(np.min(matriz))
+    maximo = int(np.max(matriz))
+    return np.promote_types(np.min_scalar_type(minimo), np.min_scalar_type(maximo))
+
+
+def leer_csv(ruta):
+    """
+    Lee una capa CSV completa como matriz numpy, omitiendo encabezado y columna de etiquetas si existen.
+    """
+    import pandas as pd
+
+    tiene_encabezado, tiene_etiquetas = detectar_formato(ruta)
+    df = pd.read_csv(ruta, header=0 if tiene_encabezado else None)
+
+    if tiene_etiquetas:
+        df = df.iloc[:, 1:]
+
+    return df.values, tiene_encabezado, tiene_etiquetas
+
+
+def _rutas_cache(ruta_csv, directorio_cache=None):
+    if directorio_cache is None:
+        directorio_cache = os.path.join(os.path.dirname(os.path.abspath(ruta_csv)), CACHE_DIR)
+    nombre = os.path.splitext(os.path.basename(ruta_csv))[0]
+    return (os.path.join(directorio_cache, f'{nombre}.npy'),
+            os.path.join(directorio_cache, f'{nombre}.json'))
+
+
+def _leer_metadatos(ruta_meta):
+    try:
+        with open(ruta_meta, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _guardar_json(ruta, datos):
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+
+
+def _cache_vigente(meta, ruta_csv, ruta_npy, ruta_meta, stat):
+    """
+    Indica si el binario cacheado corresponde al CSV actual.
+    Si solo cambió la fecha de modificación pero no el contenido, actualiza los metadatos.
+    """
+    if meta is None or meta.get('version') != CACHE_VERSION or not os.path.exists(ruta_npy):
+        return False
+
+    if meta.get('tamano') != stat.st_size:
+        return False
+
+    if meta.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+
+    # La fecha cambió (p. ej. checkout de git): comparar el contenido
+    if meta.get('sha256') == hash_archivo(ruta_csv):
+        meta['mtime_ns'] = stat.st_mtime_ns
+        _guardar_json(ruta_meta, meta)
+        return True
+
+    return False
+
+
+def metadatos_vigentes(ruta_csv, directorio_cache=None):
+    """
+    Devuelve los metadatos cacheados si el tamaño y la fecha de modificación del CSV
+    coinciden con los registrados, o None. No lee el CSV ni convierte la capa.
+    """
+    ruta_npy, ruta_meta = _rutas_cache(ruta_csv, directorio_cache)
+    stat = os.stat(ruta_csv)
+    meta = _leer_metadatos(ruta_meta)
+
+    if (meta is not None and meta.get('version') == CACHE_VERSION and os.path.exists(ruta_npy)
+            and meta.get('tamano') == stat.st_size and meta.get('mtime_ns') == stat.st_mtime_ns):
+        return meta
+
+    return None
+
+
+def hash_capa(ruta_csv, directorio_cache=None):
+    """
+    Devuelve el SHA-256 del CSV reutilizando el de los metadatos de la caché cuando el
+    tamaño y la fecha de modificación coinciden; si no, lo calcula (sin convertir la capa).
+    """
+    meta = metadatos_vigentes(ruta_csv, directorio_cache)
+    if meta is not None:
+        return meta['sha256']
+
+    return hash_archivo(ruta_csv)
+
+
+def convertir_capa(ruta_csv, directorio_cache=None):
+    """
+    Convierte un CSV al binario tipado cacheado y guarda sus metadatos.
+    Devuelve el diccionario de metadatos.
+    """
+    ruta_npy, ruta_meta = _rutas_cache(ruta_csv, directorio_cache)
+    os.makedirs(os.path.dirname(ruta_npy), exist_ok=True)
+
+    stat = os.stat(ruta_csv)
+    matriz, tiene_encabezado, tiene_etiquetas = leer_csv(ruta_csv)
+    # pandas devuelve matrices en orden Fortran; el binario se guarda en orden C para que
+    # las lecturas por bandas de filas sean contiguas
+    matriz = np.ascontiguousarray(matriz, dtype=dtype_compacto(matriz))
+
+    # Escribir primero a un temporal para no dejar binarios a medio escribir (uno por proceso:
+    # en el modo de ingesta dos procesos pueden convertir la misma capa a la vez)
+    ruta_tmp = f'{ruta_npy}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'wb') as f:
+        np.save(f, matriz)
+    os.replace(ruta_tmp, ruta_npy)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'origen': os.path.basename(ruta_csv),
+        'tamano': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': hash_archivo(ruta_csv),
+        'encabezado': tiene_encabezado,
+        'etiquetas': tiene_etiquetas,
+        'dtype': matriz.dtype.str,
+        'shape': list(matriz.shape),
+        'min': matriz.min().item() if matriz.size else None,
+        'max': matriz.max().item() if matriz.size else None
+    }
+    _guardar_json(ruta_meta, meta)
+
+    return meta
+
+
+def metadatos_capa(ruta_csv, directorio_cache=None):
+    """
+    Devuelve los metadatos de la capa (forma, dtype, hash, mínimo y máximo),
+    regenerando el binario cacheado si el CSV cambió.
+    """
+    ruta_npy, ruta_meta = _rutas_cache(ruta_csv, directorio_cache)
+    stat = os.stat(ruta_csv)
+    meta = _leer_metadatos(ruta_meta)
+
+    if _cache_vigente(meta, ruta_csv, ruta_npy, ruta_meta, stat):
+        return meta
+
+    return convertir_capa(ruta_csv, directorio_cache)
+
+
+@medir('capas.cargar_capa', argumento_archivo=0)
+def cargar_capa(ruta_csv, usar_cache=True, mmap=True, directorio_cache=None):
+    """
+    Carga una capa raster desde CSV usando el binario cacheado cuando está vigente.
+
+    Con mmap=True el binario se abre en modo memory-map de solo lectura, por lo que
+    las filas se leen del disco recién cuando se usan.
+    """
+    if not usar_cache:
+        matriz, _, _ = leer_csv(ruta_csv)
+        return np.ascontiguousarray(matriz, dtype=dtype_compacto(matriz))
+
+    try:
+        metadatos_capa(ruta_csv, directorio_cache)
+    except OSError as e:
+        # Directorio de caché no escribible: leer directamente el CSV
+        print(f"Advertencia: no se pudo usar la caché para {ruta_csv}: {str(e)}")
+        return cargar_capa(ruta_csv, usar_cache=False)
+
+    ruta_npy, _ = _rutas_cache(ruta_csv, directorio_cache)
+    return np.load(ruta_npy, mmap_mode='r' if mmap else None)
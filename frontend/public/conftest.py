@@ -0,0 +1,57 @@
+"""
+Fixtures compartidas por las pruebas de los scripts de frontend/public.
+
+Ejecutar desde frontend/public con: python -m pytest -q
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import calcular_riesgo as cr
+from region import pixel_a_geo
+
+
+@pytest.fixture
+def capas_aleatorias():
+    """
+    Genera las cinco capas de la fórmula (uint8): flood 0-10, landslide 0-4 y máscaras 0/1.
+    """
+    def generar(forma, semilla):
+        generador = np.random.default_rng(semilla)
+        return {
+            'flood': generador.integers(0, 11, forma, dtype=np.uint8),
+            'landslide': generador.integers(0, 5, forma, dtype=np.uint8),
+            'water': generador.integers(0, 2, forma, dtype=np.uint8),
+            'urban': generador.integers(0, 2, forma, dtype=np.uint8),
+            'area_protegida': generador.integers(0, 2, forma, dtype=np.uint8)
+        }
+    return generar
+
+
+@pytest.fixture
+def escribir_capas():
+    """
+    Escribe las capas {nombre: matriz} como CSV enteros con los nombres de ARCHIVOS_CAPAS.
+    Devuelve el directorio como texto.
+    """
+    def escribir(directorio, capas):
+        os.makedirs(directorio, exist_ok=True)
+        for nombre, archivo in cr.ARCHIVOS_CAPAS.items():
+            np.savetxt(os.path.join(directorio, archivo), capas[nombre], fmt='%d', delimiter=',')
+        return str(directorio)
+    return escribir
+
+
+@pytest.fixture
+def poligono():
+    """
+    Anillo rectangular [lon, lat] con esquinas en bordes de celda de una grilla de la forma dada.
+    """
+    def anillo(forma, columna_inicio, columna_fin, fila_inicio, fila_fin):
+        columnas = [columna_inicio, columna_fin, columna_fin, columna_inicio, columna_inicio]
+        filas = [fila_inicio, fila_inicio, fila_fin, fila_fin, fila_inicio]
+        lon, lat = pixel_a_geo(columnas, filas, forma)
+        return np.stack([lon, lat], axis=1).tolist()
+    return anillo
@@ -1,45 +1,130 @@
-import pandas as pd
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-def get_csv_dimensions(directory):
+from capas import detectar_formato, leer_csv, metadatos_vigentes
+from instrumentacion import activar, etapa, medir
+
+def contar_filas_columnas(file_path, tamano_bloque=1 << 20):
+    """
+    Cuenta filas y columnas de un CSV directamente sobre los bytes, sin construir un DataFrame.
+    Las columnas se cuentan en la primera línea; las líneas vacías al final del archivo se ignoran.
+    """
+    filas = 0
+    primera_linea = b''
+    primera_completa = False
+    cola = b''
+
+    with open(file_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            if not primera_completa:
+                # La primera línea puede ocupar más de un bloque
+                primera_linea += bloque.split(b'\n', 1)[0]
+                primera_completa = b'\n' in bloque
+            filas += bloque.count(b'\n')
+            cola = (cola + bloque)[-64:]
+
+    if not primera_linea or not primera_linea.strip():
+        return 0, 0
+
+    # Saltos de línea finales: el último cierra la última fila, los demás son líneas vacías
+    contenido = cola.rstrip()
+    saltos_finales = cola[len(contenido):].count(b'\n')
+    filas = filas - saltos_finales + 1
+
+    columnas = primera_linea.rstrip(b'\r').count(b',') + 1
+
+    return filas, columnas
+
+def probar_dimensiones(file_path):
+    """
+    Devuelve (filas, columnas) de la matriz de datos de un CSV lo más rápido posible:
+    desde los metadatos de la caché de capas si están vigentes, o contando bytes.
+    El encabezado y la columna de etiquetas (Y_0, Y_1, ...) se descuentan si existen.
+    """
+    meta = metadatos_vigentes(file_path)
+    if meta is not None:
+        rows, cols = meta['shape']
+        return rows, cols
+
+    rows, cols = contar_filas_columnas(file_path)
+    tiene_encabezado, tiene_etiquetas = detectar_formato(file_path)
+
+    return rows - int(tiene_encabezado), cols - int(tiene_etiquetas)
+
+def dimensiones_pandas(file_path):
+    """
+    Obtiene las dimensiones parseando el CSV completo (modo lento, para verificación).
+    """
+    matriz, _, _ = leer_csv(file_path)
+    return matriz.shape
+
+@medir('dimensiones.get_csv_dimensions')
+def get_csv_dimensions(directory, rapido=True, workers=None, json_filename="csv_dimensions.json"):
     """
     Obtiene las dimensiones (filas, columnas) de todos los archivos CSV en un directorio.
+
+    Con rapido=True (por defecto) las dimensiones se sondean sobre los bytes crudos o desde
+    la caché de capas, y los archivos se revisan en paralelo con `workers` hilos.
+    Con rapido=False se parsea cada CSV completo. El resultado se guarda en json_filename.
     """
-    csv_files = [f for f in os.listdir(directory) if f.endswith('.csv')]
+    csv_files = sorted(f for f in os.listdir(directory) if f.endswith('.csv'))
 
     if not csv_files:
         print("No se encontraron archivos CSV en el directorio.")
         return
 
-    dimensions = {}
+    obtener = probar_dimensiones if rapido else dimensiones_pandas
 
-    for csv_file in csv_files:
+    def procesar(csv_file):
         file_path = os.path.join(directory, csv_file)
         try:
-            # Leer el CSV con pandas
-            df = pd.read_csv(file_path)
-
             # Obtener dimensiones
-            rows, cols = df.shape
+            with etapa('dimensiones.archivo', archivo=csv_file):
+                rows, cols = obtener(file_path)
 
             # Formato: filasxcolumnas (ej: 1286x978)
-            dimensions[csv_file] = f"{rows}x{cols}"
-
-            print(f"{csv_file}: {rows}x{cols}")
+            return csv_file, f"{rows}x{cols}", None
 
         except Exception as e:
-            print(f"Error al procesar {csv_file}: {str(e)}")
-            dimensions[csv_file] = f"Error: {str(e)}"
+            return csv_file, f"Error: {str(e)}", e
 
-    # Guardar en archivo JSON
-    json_filename = "csv_dimensions.json"
-    with open(json_filename, 'w', encoding='utf-8') as f:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resultados = list(executor.map(procesar, csv_files))
+
+    dimensions = {}
+
+    for csv_file, dimension, error in resultados:
+        if error is None:
+            print(f"{csv_file}: {dimension}")
+        else:
+            print(f"Error al procesar {csv_file}: {str(error)}")
+        dimensions[csv_file] = dimension
+
+    # Guardar en archivo JSON (temporal + rename: el frontend nunca lee un JSON a medio escribir)
+    ruta_tmp = f'{json_filename}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
         json.dump(dimensions, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, json_filename)
 
     print(f"\nDimensiones guardadas en {json_filename}")
 
+    return dimensions
+
 if __name__ == "__main__":
-    # Usar el directorio actual
-    current_directory = "."
-    get_csv_dimensions(current_directory)
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Dimensiones de los archivos CSV de un directorio')
+    parser.add_argument('directorio', nargs='?', default='.',
+                        help='directorio con los CSV (default: directorio actual)')
+    parser.add_argument('--pandas', action='store_true',
+                        help='parsear cada CSV completo en lugar de sondear los bytes')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='hilos para revisar archivos en paralelo')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por archivo y guardarlos en DIR')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+
+    get_csv_dimensions(args.directorio, rapido=not args.pandas, workers=args.workers)
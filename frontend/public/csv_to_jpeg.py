@@ -2,36 +2,46 @@
 Script para convertir archivos CSV geoespaciales en imágenes JPEG
 con escalas de colores específicas para cada tipo de dato.
 
-Uso: python csv_to_jpeg.py
+Con --teselas genera además, por capa, una pirámide de teselas XYZ de 256x256
+en teselas/<capa>/ (ver piramide.py).
+
+Uso: python csv_to_jpeg.py [--workers N] [--forzar] [--teselas]
 """
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 import os
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from capas import cargar_capa
+from formulas import CONFIG_AMENAZAS, esquema_capa, gradiente_colores
+from instrumentacion import activar, medir
+from manifiesto import cargar_manifiesto, guardar_seccion, huella, huella_codigo, vigente
+from piramide import INDICE_TESELAS, generar_piramide
+from renderizado import cuantizar_lineal, guardar_jpeg, lut_a_uint8, lut_gradiente
+
+# Directorio del script: las rutas del código de la huella se arman a partir de él
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Código que determina el contenido de los JPEG (su hash forma parte de la huella del manifiesto)
+CODIGO_RENDER = [os.path.join(DIRECTORIO, archivo)
+                 for archivo in ('csv_to_jpeg.py', 'renderizado.py', 'piramide.py')] + [CONFIG_AMENAZAS]
+
 def load_csv_data(csv_path):
     """
     Carga datos CSV y los convierte en una matriz numpy.
     Maneja el formato especial donde la primera columna son etiquetas Y_0, Y_1, etc.
+    El encabezado y las etiquetas se detectan automáticamente y la matriz se lee
+    desde la caché binaria compartida con calcular_riesgo.py (ver capas.py), conservando
+    el dtype compacto de la capa (uint8 para las capas categóricas) en lugar de float64.
     """
     try:
-        # Leer el CSV
-        df = pd.read_csv(csv_path)
-
-        # Convertir a numpy array, omitiendo la primera columna (etiquetas Y_0, Y_1, etc.)
-        if df.shape[1] > 1:
-            # Tomar todas las columnas excepto la primera
-            matrix = df.iloc[:, 1:].values
-        else:
-            # Si solo hay una columna, usar toda la matriz
-            matrix = df.values
+        matrix = cargar_capa(csv_path)
 
         print(f"✓ {os.path.basename(csv_path)}: {matrix.shape[0]}x{matrix.shape[1]}")
-        return matrix.astype(float)
+        return matrix
 
     except Exception as e:
         print(f"✗ Error cargando {csv_path}: {str(e)}")
@@ -39,126 +49,56 @@ def load_csv_data(csv_path):
 
 def get_color_scheme(data_type):
     """
-    Define esquemas de colores apropiados para cada tipo de dato geoespacial.
-    Ahora usa gradientes de claro a oscuro con el color base específico.
+    Esquema de colores de la capa según la configuración de capas (amenazas.json, ver formulas.py):
+    gradiente de claro a oscuro con el color base de la capa. Las capas sin colores declarados
+    usan viridis.
     """
-    schemes = {
-        'expansion': {
-            'cmap': 'custom',
-            'title': 'Expansión Urbana',
-            'description': 'Gradiente Electric Blue: claro → base → oscuro'
-        },
-        'flood': {
-            'cmap': 'custom',
-            'title': 'Inundaciones',
-            'description': 'Gradiente Rocket Red: claro → base → oscuro'
-        },
-        'landslide': {
-            'cmap': 'custom',
-            'title': 'Deslizamientos',
-            'description': 'Gradiente Orange: claro → base → oscuro'
-        },
-        'urban': {
-            'cmap': 'custom',
-            'title': 'Área Urbana',
-            'description': 'Gradiente Gris: claro → base → oscuro'
-        },
-        'water': {
-            'cmap': 'custom',
-            'title': 'Cuerpos de Agua',
-            'description': 'Gradiente Electric Blue: claro → base → oscuro'
+    capa = esquema_capa(data_type)
+    if capa is None:
+        return {
+            'cmap': 'viridis',
+            'title': f'Datos {data_type}',
+            'description': 'Escala de colores por defecto'
         }
-    }
-
-    return schemes.get(data_type, {
-        'cmap': 'viridis',
-        'title': f'Datos {data_type}',
-        'description': 'Escala de colores por defecto'
-    })
-
-def lighten_color(color, factor=0.5):
-    """
-    Aclara un color mezclándolo con blanco.
-    factor=0.5 significa 50% blanco + 50% color original
-    """
-    # Convertir hex a RGB
-    color = color.lstrip('#')
-    r, g, b = tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
-
-    # Mezclar con blanco
-    r_light = int(r + (255 - r) * factor)
-    g_light = int(g + (255 - g) * factor)
-    b_light = int(b + (255 - b) * factor)
 
-    return f'#{r_light:02x}{g_light:02x}{b_light:02x}'
-
-def darken_color(color, factor=0.5):
-    """
-    Oscurece un color mezclándolo con negro.
-    factor=0.5 significa 50% negro + 50% color original
-    """
-    # Convertir hex a RGB
-    color = color.lstrip('#')
-    r, g, b = tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
-
-    # Mezclar con negro
-    r_dark = int(r * (1 - factor))
-    g_dark = int(g * (1 - factor))
-    b_dark = int(b * (1 - factor))
-
-    return f'#{r_dark:02x}{g_dark:02x}{b_dark:02x}'
+    return {
+        'cmap': 'custom',
+        'title': capa.get('titulo', data_type),
+        'description': f"Gradiente {capa['colores'].get('nombre', capa['colores'].get('base'))}: claro → base → oscuro"
+    }
 
 def create_custom_colormap(data_type):
     """
-    Crea gradientes de claro a oscuro usando solo el color base de cada tipo de dato.
+    Crea gradientes de claro a oscuro usando solo el color base de cada tipo de dato
+    (declarado en la configuración de capas; 70% blanco → base → 60% negro por defecto).
+    Devuelve la tabla de 256 colores (float 0-1) que usa save_as_jpeg.
     """
-    # Colores base para cada tipo de dato
-    base_colors = {
-        'expansion': '#0042A6',   # Electric Blue
-        'flood': '#E43700',       # Rocket Red
-        'landslide': '#FF6B35',   # Orange
-        'urban': '#666666',       # Gris medio
-        'water': '#0042A6'        # Electric Blue (mismo que expansion)
-    }
-
-    base_color = base_colors.get(data_type, '#0042A6')
-
-    if data_type in base_colors:
-        # Crear gradiente: versión clara → color base → versión oscura
-        light_color = lighten_color(base_color, 0.7)  # 70% blanco
-        dark_color = darken_color(base_color, 0.6)    # 60% negro
+    capa = esquema_capa(data_type)
 
-        colors = [light_color, base_color, dark_color]
-        return mcolors.LinearSegmentedColormap.from_list(f'{data_type}_cmap', colors)
+    if capa is not None:
+        return lut_gradiente(gradiente_colores(capa['colores']))
 
     else:
-        # Colormap por defecto para tipos no reconocidos
-        return plt.cm.viridis
+        # Colormap por defecto para tipos no reconocidos (matplotlib solo se importa en este caso)
+        from matplotlib import colormaps
+        return colormaps['viridis'](np.linspace(0, 1, 256))[:, :3]
 
+@medir('render.jpeg', argumento_archivo=1)
 def save_as_jpeg(matrix, output_path, data_type, dpi=100):
     """
     Convierte una matriz en una imagen JPEG y la guarda.
+    La escala va del mínimo al máximo de la matriz y la imagen tiene un píxel por celda
+    (ver renderizado.py). `dpi` se conserva por compatibilidad y no se usa.
     """
     try:
-        # Crear figura sin márgenes
-        fig, ax = plt.subplots(figsize=(matrix.shape[1]/dpi, matrix.shape[0]/dpi), dpi=dpi)
-        ax.axis('off')
-
         # Usar colormap personalizado
-        cmap = create_custom_colormap(data_type)
-
-        # Crear la imagen con el colormap
-        im = ax.imshow(matrix, cmap=cmap, interpolation='nearest', aspect='equal')
+        lut = create_custom_colormap(data_type)
 
-        # Ajustar layout para eliminar márgenes
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-        plt.margins(0, 0)
-
-        # Guardar como JPEG con calidad alta
-        plt.savefig(output_path, format='jpeg', dpi=dpi, bbox_inches='tight',
-                   pad_inches=0, pil_kwargs={'quality': 95, 'optimize': True})
-
-        plt.close(fig)
+        # Cuantizar con la escala min-max de los datos y guardar como JPEG con calidad alta
+        vmin = float(np.nanmin(matrix))
+        vmax = float(np.nanmax(matrix))
+        codigos = cuantizar_lineal(matrix, vmin, vmax, n=len(lut))
+        guardar_jpeg(codigos, lut_a_uint8(lut), output_path, calidad=95)
 
         # Verificar tamaño del archivo
         file_size = os.path.getsize(output_path) / 1024  # KB
@@ -170,9 +110,139 @@ def save_as_jpeg(matrix, output_path, data_type, dpi=100):
         print(f"✗ Error guardando {output_path}: {str(e)}")
         return False
 
-def process_csv_files(directory=".", output_dir="."):
+@medir('render.teselas', argumento_archivo=1)
+def save_as_tiles(matrix, output_dir, data_type):
+    """
+    Genera la pirámide de teselas XYZ de la capa en output_dir con la misma escala min-max
+    y colormap que save_as_jpeg. Las capas enteras (categóricas) se reducen por moda y las
+    flotantes por promedio. Devuelve el índice de teselas o None si falló.
+    """
+    try:
+        lut = create_custom_colormap(data_type)
+        vmin = float(np.nanmin(matrix))
+        vmax = float(np.nanmax(matrix))
+        metodo = 'moda' if np.issubdtype(matrix.dtype, np.integer) else 'media'
+
+        # Las capas ya se convierten en paralelo entre sí: las teselas de cada una en secuencia
+        indice = generar_piramide(matrix, lambda nivel: cuantizar_lineal(nivel, vmin, vmax, n=len(lut)),
+                                  lut_a_uint8(lut), output_dir, metodo=metodo, workers=1)
+
+        print(f"✓ Teselas: {indice['teselas']} en {indice['zoom_max'] + 1} niveles ({metodo})")
+        return indice
+
+    except Exception as e:
+        print(f"✗ Error generando teselas en {output_dir}: {str(e)}")
+        return None
+
+@medir('render.archivo', argumento_archivo=0)
+def convert_csv_file(csv_file, directory=".", output_dir=".", tiles=False):
+    """
+    Convierte un único CSV a JPEG (carga, colormap y codificación) y, con tiles=True,
+    a una pirámide de teselas en output_dir/teselas/<tipo>/.
+    Devuelve (csv_file, info, segundos); info es None si la conversión falló.
+    Es independiente del resto de los archivos, por lo que puede ejecutarse en otro proceso.
+    """
+    inicio = time.perf_counter()
+    csv_path = os.path.join(directory, csv_file)
+
+    # Determinar tipo de dato del nombre del archivo
+    data_type = csv_file.replace('.csv', '').lower()
+
+    print(f"\n📊 Procesando: {csv_file}")
+    print(f"🎨 Tipo de dato: {data_type}")
+
+    # Cargar datos
+    matrix = load_csv_data(csv_path)
+    if matrix is None:
+        return csv_file, None, time.perf_counter() - inicio
+
+    # Crear nombre de archivo JPEG
+    jpeg_filename = f"{data_type}.jpeg"
+    jpeg_path = os.path.join(output_dir, jpeg_filename)
+
+    # Obtener esquema de colores
+    color_scheme = get_color_scheme(data_type)
+    print(f"🎨 Colormap: {color_scheme['description']}")
+
+    # Convertir y guardar como JPEG
+    info = None
+    if save_as_jpeg(matrix, jpeg_path, data_type):
+        info = {
+            'jpeg_path': jpeg_path,
+            'dimensions': f"{matrix.shape[0]}x{matrix.shape[1]}",
+            'data_type': data_type,
+            'color_scheme': color_scheme['title']
+        }
+
+        # La pirámide del riesgo la genera calcular_riesgo.py --teselas (respeta los valores 0 y 99)
+        if tiles and data_type != 'riesgo':
+            tiles_dir = os.path.join(output_dir, 'teselas', data_type)
+            if save_as_tiles(matrix, tiles_dir, data_type) is None:
+                info = None
+            else:
+                info['tiles_index'] = os.path.join(tiles_dir, INDICE_TESELAS)
+
+    return csv_file, info, time.perf_counter() - inicio
+
+def huella_capa(csv_path, tiles=False, codigo=None):
+    """
+    Huella de la imagen (y las teselas) de un CSV: hash del CSV, del código de renderizado y parámetros.
+    """
+    data_type = os.path.basename(csv_path).replace('.csv', '').lower()
+    return huella([csv_path], codigo or huella_codigo(*CODIGO_RENDER),
+                  {'data_type': data_type, 'calidad': 95, 'teselas': tiles})
+
+def registro_capa(huella_actual, info, output_dir="."):
+    """
+    Entrada del manifiesto de una capa convertida: huella, salidas y resultado.
+    """
+    return {
+        'huella': huella_actual,
+        'salidas': [os.path.relpath(ruta, output_dir)
+                    for ruta in (info['jpeg_path'], info.get('tiles_index')) if ruta],
+        'resultado': info
+    }
+
+def guardar_resumen(output_dir, results):
+    """
+    Guarda conversion_summary.json (temporal + rename: el frontend nunca lee un JSON a medio escribir).
+    """
+    summary_path = os.path.join(output_dir, 'conversion_summary.json')
+    ruta_tmp = f'{summary_path}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, summary_path)
+    return summary_path
+
+def registrar_conversion(output_dir, csv_file, huella_actual, info):
+    """
+    Agrega una capa convertida al manifiesto y a conversion_summary.json sin tocar las demás
+    (lo usa el modo de ingesta, que convierte los CSV de a uno a medida que cambian).
+    """
+    guardar_seccion(output_dir, 'csv_to_jpeg', {csv_file: registro_capa(huella_actual, info, output_dir)},
+                    combinar=True)
+
+    try:
+        with open(os.path.join(output_dir, 'conversion_summary.json'), 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        results = {}
+    results[csv_file] = info
+    return guardar_resumen(output_dir, dict(sorted(results.items())))
+
+@medir('render.process_csv_files')
+def process_csv_files(directory=".", output_dir=".", workers=None, force=False, tiles=False):
     """
     Procesa todos los archivos CSV en el directorio y los convierte a JPEG.
+
+    Cada archivo se convierte de forma independiente. Con workers > 1 las conversiones se
+    reparten en un pool de procesos (None usa un proceso por núcleo, hasta la cantidad de
+    archivos); con workers=1 se procesan en secuencia en el proceso actual. El resumen se
+    arma siempre en orden alfabético, sin importar el orden en que terminan los procesos.
+
+    Las capas cuyo CSV, código de renderizado y parámetros no cambiaron desde la ejecución
+    anterior (según build_manifest.json) no se vuelven a convertir; force=True las regenera todas.
+    tiles=True genera también la pirámide de teselas de cada capa (ver save_as_tiles).
     """
     # Crear directorio de salida
     Path(output_dir).mkdir(exist_ok=True)
@@ -188,56 +258,76 @@ def process_csv_files(directory=".", output_dir="."):
         return
 
     print(f"🔍 Encontrados {len(csv_files)} archivos CSV:")
-    print("=" * 50)
-
-    processed = 0
-    results = {}
 
+    # Comparar con el manifiesto de la ejecución anterior para saltear capas sin cambios
+    registros_previos = {} if force else cargar_manifiesto(output_dir).get('csv_to_jpeg', {})
+    codigo = huella_codigo(*CODIGO_RENDER)
+    huellas = {}
+    pending = []
     for csv_file in csv_files:
-        csv_path = os.path.join(directory, csv_file)
+        huellas[csv_file] = huella_capa(os.path.join(directory, csv_file), tiles, codigo)
+        if not vigente(registros_previos.get(csv_file), huellas[csv_file], output_dir):
+            pending.append(csv_file)
 
-        # Determinar tipo de dato del nombre del archivo
-        data_type = csv_file.replace('.csv', '').lower()
+    skipped = [f for f in csv_files if f not in pending]
+    for csv_file in skipped:
+        print(f"⏭️  Sin cambios: {csv_file}")
 
-        print(f"\n📊 Procesando: {csv_file}")
-        print(f"🎨 Tipo de dato: {data_type}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(pending) or 1))
 
-        # Cargar datos
-        matrix = load_csv_data(csv_path)
-        if matrix is None:
-            continue
+    print(f"⚙️  Procesos: {workers}")
+    print("=" * 50)
+
+    inicio = time.perf_counter()
 
-        # Crear nombre de archivo JPEG
-        jpeg_filename = f"{data_type}.jpeg"
-        jpeg_path = os.path.join(output_dir, jpeg_filename)
+    if workers == 1:
+        conversions = [convert_csv_file(csv_file, directory, output_dir, tiles) for csv_file in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map conserva el orden de pending
+            conversions = list(executor.map(convert_csv_file, pending,
+                                            [directory] * len(pending),
+                                            [output_dir] * len(pending),
+                                            [tiles] * len(pending)))
 
-        # Obtener esquema de colores
-        color_scheme = get_color_scheme(data_type)
-        print(f"🎨 Colormap: {color_scheme['description']}")
+    total_time = time.perf_counter() - inicio
 
-        # Convertir y guardar como JPEG
-        if save_as_jpeg(matrix, jpeg_path, data_type):
-            results[csv_file] = {
-                'jpeg_path': jpeg_path,
-                'dimensions': f"{matrix.shape[0]}x{matrix.shape[1]}",
-                'data_type': data_type,
-                'color_scheme': color_scheme['title']
-            }
-            processed += 1
+    # Resumen en orden alfabético: capas convertidas ahora + capas sin cambios
+    converted = {csv_file: info for csv_file, info, _ in conversions if info is not None}
+    results = {}
+    for csv_file in csv_files:
+        if csv_file in converted:
+            results[csv_file] = converted[csv_file]
+        elif csv_file in skipped:
+            results[csv_file] = registros_previos[csv_file]['resultado']
+    processed = len(converted)
 
     print("\n" + "=" * 50)
-    print(f"✅ Procesamiento completado: {processed}/{len(csv_files)} archivos convertidos")
+    print("⏱️  Tiempo por archivo:")
+    for csv_file, info, seconds in conversions:
+        estado = "✓" if info is not None else "✗"
+        print(f"  {estado} {csv_file}: {seconds:.2f} s")
+    print(f"  Total: {total_time:.2f} s")
+
+    print(f"✅ Procesamiento completado: {processed}/{len(pending)} archivos convertidos, "
+          f"{len(skipped)} sin cambios")
+
+    # Actualizar el manifiesto con las capas vigentes
+    guardar_seccion(output_dir, 'csv_to_jpeg', {
+        csv_file: registro_capa(huellas[csv_file], info, output_dir)
+        for csv_file, info in results.items()
+    })
 
     # Guardar resumen en JSON
-    summary_path = os.path.join(output_dir, 'conversion_summary.json')
-    with open(summary_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    summary_path = guardar_resumen(output_dir, results)
 
     print(f"📋 Resumen guardado en: {os.path.basename(summary_path)}")
 
     return results
 
-def main():
+def main(workers=None, force=False, tiles=False):
     """
     Función principal del script.
     """
@@ -246,13 +336,13 @@ def main():
     print("=" * 50)
 
     # Intentar procesar archivos CSV en el directorio actual
-    results = process_csv_files(".", ".")
+    results = process_csv_files(".", ".", workers, force, tiles)
 
     # Si no se encontraron CSVs, intentar en el directorio del script
     if not results:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         print(f"\n🔄 Reintentando en el directorio del script: {script_dir}")
-        results = process_csv_files(script_dir, script_dir)
+        results = process_csv_files(script_dir, script_dir, workers, force, tiles)
 
     if results:
         print("\n📁 Archivos JPEG generados:")
@@ -271,4 +361,19 @@ def main():
         return 1
 
 if __name__ == "__main__":
-    exit(main())
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Conversor CSV → JPEG para datos geoespaciales')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='procesos para convertir archivos en paralelo (default: uno por núcleo; 1 = secuencial)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='regenerar todas las imágenes aunque sus CSV no hayan cambiado')
+    parser.add_argument('--teselas', action='store_true',
+                        help='generar también la pirámide de teselas XYZ de cada capa en teselas/<capa>/')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por etapa y archivo y guardarlos en DIR')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+
+    exit(main(args.workers, args.forzar, args.teselas))
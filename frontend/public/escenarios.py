@@ -0,0 +1,479 @@
+"""
+Barrido de escenarios de la fórmula de riesgo.
+
+Evalúa muchas combinaciones de parámetros de la fórmula de calcular_riesgo.py
+(peso de las amenazas y rango de normalización de landslide) sobre las mismas capas,
+en lugar de ejecutar el script una vez por combinación:
+
+    Riesgo = (flood + landslide normalizado a [landslide_min, landslide_max]) × peso × water × (1 - urban) × area_protegida
+
+Las capas se abren una sola vez desde la caché binaria (capas.py). Como son enteras y de
+pocos valores (flood 0-10, landslide 0-4, máscaras 0/1), en una pasada se cuenta cuántas
+celdas tiene cada combinación de valores de las cinco capas (unas 440 combinaciones). La
+fórmula se evalúa luego para todo un lote de escenarios a la vez por broadcast sobre la
+matriz (escenarios, combinaciones): las estadísticas salen de los conteos y el raster de
+un escenario es un único acceso por celda a su tabla de valores. Con capas flotantes (o
+demasiadas combinaciones) se usa el camino general por bloques de filas, que evalúa el
+lote por broadcast sobre una matriz (escenarios, filas, columnas) preasignada. En ambos
+casos la normalización de landslide de cada escenario es una tabla por valor entero (ver
+tabla_landslide) y el resultado es idéntico al de calcular_riesgo_fusionado con los mismos
+parámetros.
+
+Los lotes de escenarios pueden repartirse entre procesos (--workers); en el camino por
+bloques cada proceso abre las capas con memory-map, por lo que comparten la caché de
+páginas del sistema.
+
+Tabla de escenarios (CSV con encabezado o JSON con una lista de objetos):
+
+    nombre,peso,landslide_min,landslide_max
+    base,0.5,1,10
+    inundacion,0.7,1,10
+
+Las columnas faltantes toman los valores de la fórmula publicada (peso 0.5, rango 1-10)
+y el nombre por defecto es escenario_<n>. Los nombres deben ser únicos y usar solo letras,
+dígitos, '_', '.' y '-' (dan nombre a los rasters de --rasters). También se puede armar la grilla de
+combinaciones con --pesos y --rangos.
+
+Salidas:
+- escenarios.json (o .csv según la extensión de --salida): por escenario, mínimo, máximo,
+  promedio, count_99 y count_zero (como riesgo_scale.json) y promedio_validos y
+  max_validos sin las celdas sin dato.
+- Con --rasters DIR, la matriz de cada escenario en DIR/<nombre>.npy (float64).
+
+Uso:
+    python escenarios.py --tabla escenarios.csv [--salida escenarios.json] [--rasters DIR] [--workers N]
+    python escenarios.py --pesos 0.3,0.5,0.7 --rangos 1:10,0:10 [--entrada DIR]
+"""
+
+import csv
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calcular_riesgo import (PESO_AMENAZAS, RANGO_LANDSLIDE, VALOR_SIN_DATO, normalizar_valores, rutas_capas,
+                             tabla_landslide)
+from capas import cargar_capa, metadatos_capa
+
+# Celdas de la matriz (escenarios, filas, columnas) de cada bloque: acota la memoria del lote
+ELEMENTOS_POR_BLOQUE = 1 << 21
+
+# Escenarios evaluados juntos en un mismo broadcast
+ESCENARIOS_POR_LOTE = 32
+
+# Combinaciones de valores de las capas hasta las que se usa el histograma de combinaciones
+MAX_COMBINACIONES = 1 << 16
+
+ORDEN_CAPAS = ('flood', 'landslide', 'water', 'urban', 'area_protegida')
+
+COLUMNAS_ESTADISTICAS = ['nombre', 'peso', 'landslide_min', 'landslide_max', 'min', 'max', 'promedio',
+                         'count_99', 'count_zero', 'promedio_validos', 'max_validos']
+
+
+def normalizar_escenario(escenario, numero=0):
+    """
+    Completa un escenario (diccionario) con los valores por defecto y convierte sus campos.
+    """
+    return {
+        'nombre': str(escenario.get('nombre') or f'escenario_{numero}'),
+        'peso': float(escenario.get('peso') if escenario.get('peso') not in (None, '') else PESO_AMENAZAS),
+        'landslide_min': float(escenario.get('landslide_min') if escenario.get('landslide_min') not in (None, '')
+                               else RANGO_LANDSLIDE[0]),
+        'landslide_max': float(escenario.get('landslide_max') if escenario.get('landslide_max') not in (None, '')
+                               else RANGO_LANDSLIDE[1])
+    }
+
+
+def validar_nombres(escenarios):
+    """
+    Verifica que los nombres sean únicos y sirvan como nombre de archivo dentro del directorio
+    de rasters (sin separadores de ruta, '.' ni '..'); si no, ValueError.
+    """
+    nombres = [e['nombre'] for e in escenarios]
+    for nombre in nombres:
+        if not re.fullmatch(r'[\w.-]+', nombre) or nombre in ('.', '..'):
+            raise ValueError(f"Nombre de escenario inválido '{nombre}': se admiten letras, dígitos, '_', '.' "
+                             "y '-' (salvo '.' y '..')")
+    if len(set(nombres)) != len(nombres):
+        raise ValueError("Los nombres de los escenarios deben ser únicos")
+    return escenarios
+
+
+def leer_escenarios(ruta):
+    """
+    Lee la tabla de escenarios desde un CSV con encabezado o un JSON (lista de objetos).
+    """
+    with open(ruta, 'r', encoding='utf-8', newline='') as f:
+        if ruta.lower().endswith('.json'):
+            filas = json.load(f)
+        else:
+            filas = list(csv.DictReader(f))
+
+    return validar_nombres([normalizar_escenario(fila, numero) for numero, fila in enumerate(filas)])
+
+
+def grilla_escenarios(pesos, rangos):
+    """
+    Todas las combinaciones de `pesos` y `rangos` (tuplas (landslide_min, landslide_max)).
+    """
+    return validar_nombres([normalizar_escenario({'nombre': f'peso_{peso:g}_landslide_{minimo:g}_{maximo:g}',
+                                                  'peso': peso, 'landslide_min': minimo, 'landslide_max': maximo})
+                            for peso, (minimo, maximo) in itertools.product(pesos, rangos)])
+
+
+def abrir_capas(directorio='.'):
+    """
+    Abre las cinco capas (memory-map de la caché binaria) recortadas a las dimensiones mínimas
+    comunes. Devuelve (capas, metas) con los metadatos de cada capa (capas.metadatos_capa).
+    """
+    rutas = rutas_capas(directorio)
+    capas = {nombre: cargar_capa(ruta) for nombre, ruta in rutas.items()}
+    filas = min(capa.shape[0] for capa in capas.values())
+    columnas = min(capa.shape[1] for capa in capas.values())
+    capas = {nombre: np.asarray(capa)[:filas, :columnas] for nombre, capa in capas.items()}
+    return capas, {nombre: metadatos_capa(ruta) for nombre, ruta in rutas.items()}
+
+
+def combinaciones_capas(capas, metas, codigos=False, filas_por_bloque=1024):
+    """
+    Histograma de las combinaciones de valores de las cinco capas, calculado en una pasada.
+
+    Con capas enteras de pocos valores (flood 0-10, landslide 0-4, máscaras 0/1) cada celda
+    se codifica como un índice de combinación en base mixta y se cuentan las celdas por
+    combinación. Devuelve {'valores': {capa: valor de cada combinación}, 'conteos': celdas
+    por combinación, 'codigos': índice de combinación de cada celda (solo con codigos=True)},
+    o None si alguna capa no es entera o hay más de MAX_COMBINACIONES combinaciones.
+    """
+    rangos = []
+    for nombre in ORDEN_CAPAS:
+        meta = metas[nombre]
+        if np.dtype(meta['dtype']).kind not in 'iu':
+            return None
+        rangos.append((int(meta['min']), int(meta['max']) - int(meta['min']) + 1))
+
+    total = int(np.prod([tamano for _, tamano in rangos]))
+    if total > MAX_COMBINACIONES:
+        return None
+
+    filas, columnas = capas['flood'].shape
+    conteos = np.zeros(total, dtype=np.int64)
+    raster_codigos = np.empty((filas, columnas), dtype=np.uint16) if codigos else None
+    codigo_buf = np.empty((filas_por_bloque, columnas), dtype=np.int32)
+
+    for inicio in range(0, filas, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque, filas)
+        codigo = codigo_buf[:fin - inicio]
+        codigo.fill(0)
+        for nombre, (minimo, tamano) in zip(ORDEN_CAPAS, rangos):
+            codigo *= tamano
+            codigo += capas[nombre][inicio:fin]
+            codigo -= minimo
+        conteos += np.bincount(codigo.ravel(), minlength=total)
+        if codigos:
+            raster_codigos[inicio:fin] = codigo
+
+    mallas = np.meshgrid(*(np.arange(minimo, minimo + tamano) for minimo, tamano in rangos), indexing='ij')
+    return {
+        'valores': {nombre: malla.ravel() for nombre, malla in zip(ORDEN_CAPAS, mallas)},
+        'conteos': conteos,
+        'codigos': raster_codigos
+    }
+
+
+def tablas_escenarios(meta, escenarios):
+    """
+    Tablas de normalización de landslide de todos los escenarios apiladas en una matriz
+    (escenarios, valores) y su base común, o (None, None) si la capa no es entera.
+    """
+    tablas = []
+    base = None
+    for escenario in escenarios:
+        tabla, base = tabla_landslide(meta, (escenario['landslide_min'], escenario['landslide_max']))
+        if tabla is None:
+            return None, None
+        tablas.append(tabla)
+    return np.stack(tablas), base
+
+
+def _ruta_raster(directorio, escenario):
+    return os.path.join(directorio, f"{escenario['nombre']}.npy")
+
+
+def _resultados(escenarios, minimo, maximo, suma, count_99, count_zero, suma_validos, maximo_validos, total,
+                validos_total, directorio_rasters=None):
+    """
+    Arma la lista de estadísticas por escenario a partir de los agregados del lote.
+    """
+    resultados = []
+    for k, escenario in enumerate(escenarios):
+        resultado = dict(escenario)
+        resultado.update({
+            'min': float(minimo[k]),
+            'max': float(maximo[k]),
+            'promedio': float(suma[k] / total) if total else None,
+            'count_99': int(count_99[k]),
+            'count_zero': int(count_zero[k]),
+            'promedio_validos': float(suma_validos[k] / validos_total) if validos_total else None,
+            'max_validos': float(maximo_validos[k]) if validos_total else None
+        })
+        if directorio_rasters:
+            resultado['raster'] = _ruta_raster(directorio_rasters, escenario)
+        resultados.append(resultado)
+    return resultados
+
+
+def _abrir_rasters(directorio, escenarios, forma):
+    os.makedirs(directorio, exist_ok=True)
+    return [np.lib.format.open_memmap(_ruta_raster(directorio, e), mode='w+', dtype=np.float64, shape=forma)
+            for e in escenarios]
+
+
+def calcular_lote_combinaciones(combinaciones, meta_landslide, escenarios, directorio_rasters=None,
+                                filas_por_bloque=1024):
+    """
+    Evalúa un lote de escenarios sobre el histograma de combinaciones (combinaciones_capas).
+
+    La fórmula se evalúa por broadcast sobre una matriz (escenarios, combinaciones), con el
+    mismo orden de operaciones que calcular_riesgo_fusionado, así que el valor de cada
+    combinación es exactamente el de las celdas que la tienen. Las estadísticas salen de los
+    conteos sin recorrer la grilla; cada raster es un único np.take de los códigos de celda.
+    """
+    valores = combinaciones['valores']
+    conteos = combinaciones['conteos']
+    pesos = np.array([e['peso'] for e in escenarios], dtype=np.float64)[:, None]
+    tablas, base = tablas_escenarios(meta_landslide, escenarios)
+
+    # Parte común a todos los escenarios: water * (1-urban) * area_protegida y la excepción 99
+    factor = np.subtract(1, valores['urban'], dtype=np.float64)
+    factor *= valores['water']
+    factor *= valores['area_protegida']
+    excepcion = (factor != 0) & (valores['flood'] == 0)
+
+    riesgo = tablas[:, valores['landslide'] - base]
+    riesgo += valores['flood']
+    riesgo *= pesos
+    riesgo *= factor
+    riesgo[:, excepcion] = VALOR_SIN_DATO
+
+    presentes = conteos > 0
+    validos = presentes & ~excepcion
+    resultados = _resultados(
+        escenarios,
+        riesgo.min(axis=1, where=presentes, initial=np.inf),
+        riesgo.max(axis=1, where=presentes, initial=-np.inf),
+        riesgo @ conteos,
+        (riesgo == VALOR_SIN_DATO) @ conteos,
+        (riesgo == 0) @ conteos,
+        np.where(validos, riesgo, 0) @ conteos,
+        riesgo.max(axis=1, where=validos, initial=-np.inf),
+        int(conteos.sum()), int(conteos[validos].sum()), directorio_rasters)
+
+    if directorio_rasters:
+        codigos = combinaciones['codigos']
+        for k, raster in enumerate(_abrir_rasters(directorio_rasters, escenarios, codigos.shape)):
+            for inicio in range(0, codigos.shape[0], filas_por_bloque):
+                np.take(riesgo[k], codigos[inicio:inicio + filas_por_bloque], out=raster[inicio:inicio + filas_por_bloque])
+            raster.flush()
+
+    return resultados
+
+
+def calcular_lote_por_bloques(capas, meta_landslide, escenarios, elementos_por_bloque=ELEMENTOS_POR_BLOQUE,
+                              directorio_rasters=None):
+    """
+    Evalúa la fórmula para un lote de escenarios en una sola pasada por bloques de filas,
+    por broadcast sobre una matriz (escenarios, filas, columnas) preasignada. Es el camino
+    general, para capas flotantes o con demasiadas combinaciones de valores.
+    """
+    flood, landslide = capas['flood'], capas['landslide']
+    water, urban, area_protegida = capas['water'], capas['urban'], capas['area_protegida']
+    filas, columnas = flood.shape
+    cantidad = len(escenarios)
+
+    pesos = np.array([e['peso'] for e in escenarios], dtype=np.float64)[:, None, None]
+    tablas, base = tablas_escenarios(meta_landslide, escenarios)
+
+    filas_por_bloque = max(1, elementos_por_bloque // max(cantidad * columnas, 1))
+    riesgo_buf = np.empty((cantidad, filas_por_bloque, columnas), dtype=np.float64)
+    factor_buf = np.empty((filas_por_bloque, columnas), dtype=np.float64)
+    excepcion_buf = np.empty((filas_por_bloque, columnas), dtype=bool)
+
+    minimo = np.full(cantidad, np.inf)
+    maximo = np.full(cantidad, -np.inf)
+    suma = np.zeros(cantidad)
+    count_99 = np.zeros(cantidad, dtype=np.int64)
+    count_zero = np.zeros(cantidad, dtype=np.int64)
+    suma_validos = np.zeros(cantidad)
+    maximo_validos = np.full(cantidad, -np.inf)
+    sin_dato = 0
+
+    rasters = _abrir_rasters(directorio_rasters, escenarios, (filas, columnas)) if directorio_rasters else None
+
+    for inicio in range(0, filas, filas_por_bloque):
+        fin = min(inicio + filas_por_bloque, filas)
+        n = fin - inicio
+        riesgo = riesgo_buf[:, :n]
+        factor = factor_buf[:n]
+        excepcion = excepcion_buf[:n]
+        flood_b = flood[inicio:fin]
+
+        # Parte común a todos los escenarios: water * (1-urban) * area_protegida y la excepción 99
+        np.subtract(1, urban[inicio:fin], out=factor)
+        np.multiply(factor, water[inicio:fin], out=factor)
+        np.multiply(factor, area_protegida[inicio:fin], out=factor)
+        np.logical_and(factor != 0, flood_b == 0, out=excepcion)
+
+        # Landslide normalizado de cada escenario: (escenarios, n, columnas)
+        landslide_b = landslide[inicio:fin]
+        if tablas is not None:
+            indices = landslide_b if base == 0 else landslide_b.astype(np.int64) - base
+            np.take(tablas, indices, axis=1, out=riesgo)
+        else:
+            for k, escenario in enumerate(escenarios):
+                riesgo[k] = normalizar_valores(landslide_b.astype(np.float64), escenario['landslide_min'],
+                                               escenario['landslide_max'], min_actual=meta_landslide['min'],
+                                               max_actual=meta_landslide['max'])
+
+        # Mismo orden de operaciones que calcular_riesgo_fusionado: (flood + landslide) * peso * factor
+        np.add(riesgo, flood_b, out=riesgo)
+        np.multiply(riesgo, pesos, out=riesgo)
+        np.multiply(riesgo, factor, out=riesgo)
+        np.copyto(riesgo, VALOR_SIN_DATO, where=excepcion)
+
+        # Estadísticas por escenario del bloque
+        np.minimum(minimo, riesgo.min(axis=(1, 2)), out=minimo)
+        np.maximum(maximo, riesgo.max(axis=(1, 2)), out=maximo)
+        suma += riesgo.sum(axis=(1, 2))
+        count_99 += np.count_nonzero(riesgo == VALOR_SIN_DATO, axis=(1, 2))
+        count_zero += np.count_nonzero(riesgo == 0, axis=(1, 2))
+
+        validos = ~excepcion
+        sin_dato += n * columnas - int(np.count_nonzero(validos))
+        suma_validos += riesgo.sum(axis=(1, 2), where=validos)
+        np.maximum(maximo_validos, riesgo.max(axis=(1, 2), where=validos, initial=-np.inf), out=maximo_validos)
+
+        if rasters is not None:
+            for k, raster in enumerate(rasters):
+                raster[inicio:fin] = riesgo[k]
+
+    if rasters is not None:
+        for raster in rasters:
+            raster.flush()
+        del rasters
+
+    total = filas * columnas
+    return _resultados(escenarios, minimo, maximo, suma, count_99, count_zero, suma_validos, maximo_validos,
+                       total, total - sin_dato, directorio_rasters)
+
+
+def _calcular_lote(directorio, metas, combinaciones, escenarios, elementos_por_bloque, directorio_rasters):
+    """
+    Evalúa un lote con el histograma de combinaciones o, si no hay, abriendo las capas y
+    recorriéndolas por bloques. Se ejecuta en los procesos del pool.
+    """
+    if combinaciones is not None:
+        return calcular_lote_combinaciones(combinaciones, metas['landslide'], escenarios, directorio_rasters)
+    capas, metas = abrir_capas(directorio)
+    return calcular_lote_por_bloques(capas, metas['landslide'], escenarios, elementos_por_bloque, directorio_rasters)
+
+
+def barrer_escenarios(escenarios, directorio_entrada='.', workers=None, escenarios_por_lote=ESCENARIOS_POR_LOTE,
+                      elementos_por_bloque=ELEMENTOS_POR_BLOQUE, directorio_rasters=None):
+    """
+    Evalúa todos los escenarios y devuelve sus estadísticas en el mismo orden.
+
+    Con capas enteras se arma una vez el histograma de combinaciones de valores
+    (combinaciones_capas) y cada lote se evalúa sobre él; si no, cada lote es una pasada por
+    bloques sobre las capas. Los escenarios se agrupan en lotes de `escenarios_por_lote` que
+    se reparten en un pool de procesos (workers=None usa uno por núcleo; workers=1 los evalúa
+    en el proceso actual).
+    """
+    if directorio_rasters:
+        # Los nombres dan nombre a los rasters: se validan también si no vienen de leer_escenarios
+        validar_nombres(escenarios)
+
+    # Abrir las capas una vez en este proceso crea la caché binaria antes de lanzar el pool
+    capas, metas = abrir_capas(directorio_entrada)
+    combinaciones = combinaciones_capas(capas, metas, codigos=bool(directorio_rasters))
+
+    lotes = [escenarios[inicio:inicio + escenarios_por_lote]
+             for inicio in range(0, len(escenarios), escenarios_por_lote)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(lotes) or 1))
+
+    argumentos = ([directorio_entrada] * len(lotes), [metas] * len(lotes), [combinaciones] * len(lotes), lotes,
+                  [elementos_por_bloque] * len(lotes), [directorio_rasters] * len(lotes))
+    if workers == 1:
+        por_lote = list(map(_calcular_lote, *argumentos))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            por_lote = list(executor.map(_calcular_lote, *argumentos))
+
+    return [resultado for resultados in por_lote for resultado in resultados]
+
+
+def guardar_resultados(resultados, ruta):
+    """
+    Guarda las estadísticas de los escenarios como CSV o JSON según la extensión de `ruta`.
+    """
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8', newline='') as f:
+        if ruta.lower().endswith('.csv'):
+            columnas = COLUMNAS_ESTADISTICAS + (['raster'] if resultados and 'raster' in resultados[0] else [])
+            escritor = csv.DictWriter(f, fieldnames=columnas)
+            escritor.writeheader()
+            escritor.writerows(resultados)
+        else:
+            json.dump({'escenarios': resultados}, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+
+
+def leer_pesos(texto):
+    """
+    Lista de pesos desde un texto separado por comas (p. ej. '0.3,0.5,0.7').
+    """
+    return [float(valor) for valor in texto.split(',') if valor.strip()]
+
+
+def leer_rangos(texto):
+    """
+    Lista de rangos (min, max) desde un texto 'min:max' separado por comas (p. ej. '1:10,0:10').
+    """
+    return [tuple(float(valor) for valor in rango.split(':', 1)) for rango in texto.split(',') if rango.strip()]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Barrido de escenarios de la fórmula de riesgo')
+    parser.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    parser.add_argument('--tabla', default=None, help='tabla de escenarios (CSV con encabezado o JSON)')
+    parser.add_argument('--pesos', type=leer_pesos, default=None,
+                        help='pesos separados por comas para armar la grilla de escenarios (p. ej. 0.3,0.5,0.7)')
+    parser.add_argument('--rangos', type=leer_rangos, default=None,
+                        help='rangos de landslide min:max separados por comas (p. ej. 1:10,0:10)')
+    parser.add_argument('--salida', default='escenarios.json',
+                        help='estadísticas por escenario, .json o .csv (default: escenarios.json)')
+    parser.add_argument('--rasters', default=None, help='directorio donde guardar la matriz de cada escenario (.npy)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='procesos entre los que repartir los lotes de escenarios (default: uno por núcleo)')
+    parser.add_argument('--escenarios-por-lote', type=int, default=ESCENARIOS_POR_LOTE,
+                        help=f'escenarios evaluados juntos en cada pasada (default: {ESCENARIOS_POR_LOTE})')
+    args = parser.parse_args()
+
+    if args.tabla:
+        escenarios = leer_escenarios(args.tabla)
+    else:
+        escenarios = grilla_escenarios(args.pesos or [PESO_AMENAZAS], args.rangos or [RANGO_LANDSLIDE])
+
+    inicio = time.perf_counter()
+    resultados = barrer_escenarios(escenarios, args.entrada, args.workers, args.escenarios_por_lote,
+                                   directorio_rasters=args.rasters)
+    guardar_resultados(resultados, args.salida)
+    print(f"{len(resultados)} escenarios evaluados en {time.perf_counter() - inicio:.2f} s → {args.salida}")
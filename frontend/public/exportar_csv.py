@@ -0,0 +1,107 @@
+"""
+Exportador CSV paralelo para matrices raster (riesgo.csv).
+
+Cada bloque de filas se formatea con una tabla de textos por valor: los valores
+distintos del bloque se formatean una sola vez (las matrices de riesgo tienen
+pocos valores distintos) y las filas se arman indexando esa tabla. Los bloques
+se formatean en un pool de procesos y se escriben en orden con escrituras grandes.
+
+Formatos:
+- precision=None (por defecto): el mismo texto que DataFrame.to_csv con float64
+  (repr del valor, p. ej. 4.5, 0.0, 99.0), por lo que el archivo es idéntico byte a byte.
+- precision=N: N decimales fijos (p. ej. 4.50 con N=2).
+- enteros=True: los valores enteros se escriben sin decimales (4, 0, 99).
+
+Los NaN se escriben como campo vacío, igual que pandas. El resultado se lee con
+pd.read_csv(ruta, header=None).
+
+Uso:
+    from exportar_csv import exportar_csv
+    exportar_csv(riesgo, 'riesgo.csv', precision=2, workers=4)
+"""
+
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+FILAS_POR_BLOQUE = 256
+
+# Tamaño del buffer de escritura del archivo
+BUFFER_ESCRITURA = 1 << 22
+
+# Bloques enviados al pool y todavía no escritos, por proceso: acota la memoria de los
+# bloques copiados y de los textos pendientes aunque la matriz sea un memory-map grande
+BLOQUES_EN_VUELO_POR_WORKER = 2
+
+
+def formatear_valor(valor, precision=None, enteros=False):
+    """
+    Texto CSV de un valor float según el formato pedido.
+    """
+    if math.isnan(valor):
+        return ''
+    if enteros and math.isfinite(valor) and valor == int(valor):
+        return str(int(valor))
+    if precision is None:
+        return repr(valor)
+    return f'{valor:.{precision}f}'
+
+
+def formatear_bloque(bloque, precision=None, enteros=False):
+    """
+    Formatea un bloque de filas como texto CSV (bytes, una línea por fila terminada en \\n).
+    """
+    bloque = np.asarray(bloque)
+    if bloque.size == 0:
+        return b''
+
+    valores, inversa = np.unique(bloque, return_inverse=True)
+    textos = np.array([formatear_valor(float(v), precision, enteros) for v in valores], dtype=object)
+    celdas = textos[inversa.reshape(bloque.shape)].tolist()
+
+    return ('\n'.join(','.join(fila) for fila in celdas) + '\n').encode('ascii')
+
+
+def exportar_csv(matriz, ruta, precision=None, enteros=False, workers=None, filas_por_bloque=FILAS_POR_BLOQUE,
+                 modo='w'):
+    """
+    Escribe la matriz como CSV sin índices ni encabezados.
+
+    Los bloques de `filas_por_bloque` filas se formatean en un pool de procesos
+    (workers=None usa uno por núcleo; workers=1 formatea en el proceso actual) y se
+    escriben en orden, con a lo sumo BLOQUES_EN_VUELO_POR_WORKER * workers bloques pendientes. modo='a' agrega al final del archivo (p. ej. escritura por bandas).
+    Con modo='w' se escribe en un temporal que reemplaza a `ruta` al terminar.
+    Devuelve la cantidad de bytes escritos.
+    """
+    filas = matriz.shape[0]
+    rangos = [(inicio, min(inicio + filas_por_bloque, filas)) for inicio in range(0, filas, filas_por_bloque)]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(rangos) or 1))
+
+    escritos = 0
+    destino = f'{ruta}.{os.getpid()}.tmp' if modo == 'w' else ruta
+    with open(destino, modo + 'b', buffering=BUFFER_ESCRITURA) as f:
+        if workers == 1:
+            for inicio, fin in rangos:
+                escritos += f.write(formatear_bloque(matriz[inicio:fin], precision, enteros))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Ventana acotada de futuros en orden de bloque: cada proceso recibe solo su bloque y
+                # el más antiguo se escribe antes de enviar uno nuevo cuando la ventana está llena
+                pendientes = deque()
+                for inicio, fin in rangos:
+                    if len(pendientes) >= BLOQUES_EN_VUELO_POR_WORKER * workers:
+                        escritos += f.write(pendientes.popleft().result())
+                    pendientes.append(executor.submit(formatear_bloque, np.asarray(matriz[inicio:fin]),
+                                                      precision, enteros))
+                while pendientes:
+                    escritos += f.write(pendientes.popleft().result())
+
+    if destino != ruta:
+        os.replace(destino, ruta)
+    return escritos
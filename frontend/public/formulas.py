@@ -0,0 +1,641 @@
+"""
+Motor declarativo de fórmulas de amenazas.
+
+La fórmula de riesgo de calcular_riesgo.py y los colores de cada capa estaban escritos en el
+código. Este módulo evalúa amenazas declaradas en un archivo de configuración (amenazas.json
+por defecto), así agregar una amenaza (sequía, incendios, expansión urbana) no requiere
+editar código:
+
+    {
+      "capas": {"flood": {"archivo": "flood.csv", "titulo": "Inundaciones",
+                          "colores": {"base": "#E43700", "nombre": "Rocket Red"}}, ...},
+      "normalizaciones": {"landslide_n": {"capa": "landslide", "tipo": "rango", "min": 1, "max": 10}},
+      "expresiones": {"factor": "water * (1 - urban) * area_protegida"},
+      "amenazas": {
+        "riesgo": {"expresion": "(flood + landslide_n) * 0.5 * factor",
+                   "sin_dato": {"condicion": "(factor != 0) & (flood == 0)", "valor": 99},
+                   "escala": [0, 10], "colores": {"base": "#E43700", "cero": "#eafe07"}}
+      }
+    }
+
+- capas: nombre → CSV (relativo al directorio de entrada), título y colores. csv_to_jpeg.py toma
+  de acá el esquema de colores de cada capa.
+- normalizaciones: 'rango' lleva la capa al intervalo [min, max] con el mínimo y el máximo
+  globales de la capa (igual que normalizar_valores); 'valores' asigna un valor a cada entero
+  de una capa categórica ({"tipo": "valores", "valores": {"1": 2.5, ...}, "defecto": 0}).
+- expresiones: subexpresiones con nombre que pueden usar las amenazas y otras expresiones.
+- amenazas: expresión, regla opcional de sin dato (donde vale la condición, la salida toma
+  `valor`), escala de colores fija opcional (si no, mínimo-máximo de los valores válidos),
+  colores ('base', 'claro', 'oscuro' o una lista 'gradiente', y 'cero' / 'sin_dato') y dtype.
+
+Las expresiones admiten + - * / **, comparaciones, & | ~ (y `and`, `or`, `not`), números y las
+funciones minimum, maximum, abs, clip(x, min, max) y where(condicion, si, no).
+
+Todas las amenazas pedidas se compilan juntas a un único plan de evaluación (compilar): cada
+subexpresión es un nodo y los nodos repetidos se unifican, también con los operandos de + y *
+en otro orden (son conmutativos en coma flotante), así el factor de water, urban y áreas
+protegidas se calcula una sola vez aunque lo usen varias amenazas. Las operaciones entre
+constantes se resuelven al compilar. A cada nodo se le asigna uno de pocos buffers de un
+bloque de filas según cuándo se usa por última vez (un buffer se reutiliza apenas se libera).
+La grilla se recorre una sola vez por bloques: las capas se leen una vez por bloque, el plan se
+evalúa con ufuncs de NumPy y argumentos out= sobre los buffers preasignados, y cada salida se
+escribe en su .npy, se acumula en su histograma (histograma.py) y, con escala fija, se cuantiza
+para el JPEG en la misma pasada.
+
+Salidas en el directorio de salida (amenazas/ por defecto), por amenaza: <nombre>.npy,
+<nombre>.jpeg, <nombre>_scale.json (mismas claves que riesgo_scale.json) y, con --csv,
+<nombre>.csv. Como los demás scripts, no se recalcula si las capas, la configuración y el
+código no cambiaron (build_manifest.json del directorio de salida).
+
+Con la configuración incluida, amenazas/riesgo.npy tiene exactamente los valores de riesgo.npy.
+
+Uso:
+    python formulas.py [--config amenazas.json] [--entrada DIR] [--salida DIR] [--amenazas riesgo,inundacion]
+                       [--csv] [--grilla FxC] [--forzar] [--mostrar-plan]
+"""
+
+import ast
+import json
+import os
+
+import numpy as np
+
+from alineacion import cargar_capas
+from calcular_riesgo import ELECTRIC_BLUE, darken_color, lighten_color, tabla_landslide
+from histograma import RANGO, HistogramaRiesgo
+from instrumentacion import activar, etapa, medir
+from manifiesto import cargar_manifiesto, guardar_seccion, huella, huella_codigo, vigente
+
+# Directorio del script: las rutas de la configuración y del código de la huella se arman a partir de él
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_AMENAZAS = os.path.join(DIRECTORIO, 'amenazas.json')
+
+DIRECTORIO_SALIDA = 'amenazas'
+
+# Celdas por bloque de filas: los buffers del plan (uno por nodo vivo a la vez) entran en caché
+ELEMENTOS_POR_BLOQUE = 1 << 16
+
+# Código que determina las salidas (su hash forma parte de la huella, junto con la configuración)
+CODIGO_FORMULAS = [os.path.join(DIRECTORIO, archivo)
+                   for archivo in ('formulas.py', 'calcular_riesgo.py', 'alineacion.py', 'renderizado.py', 'histograma.py')]
+
+# Aclarado y oscurecido por defecto del gradiente claro → base → oscuro (los de csv_to_jpeg.py)
+CLARO = 0.7
+OSCURO = 0.6
+
+_BINARIOS = {ast.Add: 'add', ast.Sub: 'subtract', ast.Mult: 'multiply', ast.Div: 'divide', ast.Pow: 'power',
+             ast.BitAnd: 'logical_and', ast.BitOr: 'logical_or'}
+_COMPARACIONES = {ast.Eq: 'equal', ast.NotEq: 'not_equal', ast.Lt: 'less', ast.LtE: 'less_equal',
+                  ast.Gt: 'greater', ast.GtE: 'greater_equal'}
+_FUNCIONES = {'minimum': 2, 'maximum': 2, 'abs': 1, 'clip': 3, 'where': 3}
+
+# Operaciones de la expresión (se evalúan con np.<operación>, salvo where)
+_OPERACIONES = {*_BINARIOS.values(), *_COMPARACIONES.values(), 'negative', 'logical_not', 'minimum', 'maximum',
+                'absolute', 'clip', 'where'}
+_CONMUTATIVAS = {'add', 'multiply', 'logical_and', 'logical_or', 'equal', 'not_equal', 'minimum', 'maximum'}
+_BOOLEANAS = {*_COMPARACIONES.values(), 'logical_and', 'logical_or', 'logical_not'}
+
+
+def cargar_config(ruta=CONFIG_AMENAZAS):
+    """
+    Lee la configuración de amenazas y verifica sus secciones.
+    """
+    with open(ruta, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    for seccion in ('capas', 'amenazas'):
+        if not isinstance(config.get(seccion), dict):
+            raise ValueError(f"{ruta}: falta la sección '{seccion}'")
+    config.setdefault('normalizaciones', {})
+    config.setdefault('expresiones', {})
+    for nombre, capa in config['capas'].items():
+        if 'archivo' not in capa:
+            raise ValueError(f"{ruta}: la capa '{nombre}' no declara su 'archivo'")
+    for nombre, amenaza in config['amenazas'].items():
+        if 'expresion' not in amenaza:
+            raise ValueError(f"{ruta}: la amenaza '{nombre}' no declara su 'expresion'")
+    return config
+
+
+def gradiente_colores(colores, claro=CLARO, oscuro=OSCURO):
+    """
+    Colores del gradiente de un esquema: la lista 'gradiente' o claro → base → oscuro.
+    """
+    if 'gradiente' in colores:
+        return list(colores['gradiente'])
+    base = colores['base']
+    return [lighten_color(base, colores.get('claro', claro)), base, darken_color(base, colores.get('oscuro', oscuro))]
+
+
+def esquema_capa(data_type, ruta=CONFIG_AMENAZAS):
+    """
+    Declaración de la capa cuyo CSV se llama <data_type>.csv si tiene colores, o None.
+    """
+    try:
+        capas = cargar_config(ruta)['capas']
+    except (OSError, ValueError) as e:
+        print(f"✗ No se pudo leer la configuración de colores {ruta}: {e}")
+        return None
+    for capa in capas.values():
+        if os.path.splitext(os.path.basename(capa['archivo']))[0].lower() == data_type and 'colores' in capa:
+            return capa
+    return None
+
+
+def _plegar(operacion, valores):
+    # Operación entre constantes, con la misma aritmética float64 que en la grilla
+    valores = [np.float64(valor) for valor in valores]
+    if operacion == 'where':
+        return float(valores[1] if valores[0] else valores[2])
+    return float(getattr(np, operacion)(*valores))
+
+
+class Compilador:
+    """
+    Traduce las expresiones de la configuración a un grafo de nodos sin repetidos.
+
+    Cada nodo es una tupla: ('capa', nombre), ('const', valor), ('norm', nombre, nodo_capa) u
+    (operación, *nodos_argumento); self.nodos está en orden topológico (los argumentos de un nodo
+    siempre se crean antes que él).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.nodos = []
+        self._indices = {}
+        self._nombres = {}
+        self._en_curso = []
+
+    def nodo(self, clave):
+        operacion, argumentos = clave[0], clave[1:]
+        if operacion in _OPERACIONES:
+            if all(self.nodos[a][0] == 'const' for a in argumentos):
+                return self.nodo(('const', _plegar(operacion, [self.nodos[a][1] for a in argumentos])))
+            if operacion in _CONMUTATIVAS:
+                clave = (operacion, *sorted(argumentos))
+        if clave not in self._indices:
+            self._indices[clave] = len(self.nodos)
+            self.nodos.append(clave)
+        return self._indices[clave]
+
+    def constante(self, valor):
+        return self.nodo(('const', float(valor)))
+
+    def booleano(self, nodo):
+        """
+        El nodo como condición: las expresiones numéricas valen verdadero donde son distintas de 0.
+        """
+        if self.nodos[nodo][0] in _BOOLEANAS:
+            return nodo
+        return self.nodo(('not_equal', nodo, self.constante(0)))
+
+    def donde(self, condicion, si, no):
+        condicion = self.booleano(condicion)
+        if self.nodos[condicion][0] == 'const':
+            return si if self.nodos[condicion][1] else no
+        return self.nodo(('where', condicion, si, no))
+
+    def resolver(self, nombre):
+        """
+        Nodo de un nombre de la configuración: capa, normalización o expresión.
+        """
+        if nombre in self._nombres:
+            return self._nombres[nombre]
+        if nombre in self._en_curso:
+            raise ValueError(f"Definición circular: {' → '.join(self._en_curso + [nombre])}")
+
+        if nombre in self.config['capas']:
+            nodo = self.nodo(('capa', nombre))
+        elif nombre in self.config['normalizaciones']:
+            capa = self.config['normalizaciones'][nombre].get('capa')
+            if capa not in self.config['capas']:
+                raise ValueError(f"La normalización '{nombre}' usa la capa '{capa}', que no está declarada")
+            nodo = self.nodo(('norm', nombre, self.resolver(capa)))
+        elif nombre in self.config['expresiones']:
+            self._en_curso.append(nombre)
+            nodo = self.compilar(self.config['expresiones'][nombre], nombre)
+            self._en_curso.pop()
+        else:
+            raise ValueError(f"'{nombre}' no es una capa, normalización ni expresión declarada")
+
+        self._nombres[nombre] = nodo
+        return nodo
+
+    def compilar(self, texto, contexto):
+        """
+        Nodo de una expresión (texto con sintaxis de Python restringida).
+        """
+        try:
+            arbol = ast.parse(str(texto), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Expresión inválida en '{contexto}': {texto} ({e.msg})") from None
+        return self._visitar(arbol.body, texto, contexto)
+
+    def _visitar(self, elemento, texto, contexto):
+        visitar = lambda hijo: self._visitar(hijo, texto, contexto)
+
+        if isinstance(elemento, ast.Constant) and type(elemento.value) in (int, float):
+            return self.constante(elemento.value)
+        if isinstance(elemento, ast.Name):
+            return self.resolver(elemento.id)
+        if isinstance(elemento, ast.BinOp) and type(elemento.op) in _BINARIOS:
+            return self.nodo((_BINARIOS[type(elemento.op)], visitar(elemento.left), visitar(elemento.right)))
+        if isinstance(elemento, ast.UnaryOp):
+            operando = visitar(elemento.operand)
+            if isinstance(elemento.op, ast.UAdd):
+                return operando
+            if isinstance(elemento.op, ast.USub):
+                return self.nodo(('negative', operando))
+            return self.nodo(('logical_not', operando))
+        if isinstance(elemento, ast.Compare) and all(type(op) in _COMPARACIONES for op in elemento.ops):
+            # a < b < c equivale a (a < b) & (b < c)
+            terminos = [visitar(elemento.left)] + [visitar(termino) for termino in elemento.comparators]
+            resultado = None
+            for op, izquierdo, derecho in zip(elemento.ops, terminos, terminos[1:]):
+                comparacion = self.nodo((_COMPARACIONES[type(op)], izquierdo, derecho))
+                resultado = comparacion if resultado is None else self.nodo(('logical_and', resultado, comparacion))
+            return resultado
+        if isinstance(elemento, ast.BoolOp):
+            operacion = 'logical_and' if isinstance(elemento.op, ast.And) else 'logical_or'
+            resultado = visitar(elemento.values[0])
+            for valor in elemento.values[1:]:
+                resultado = self.nodo((operacion, resultado, visitar(valor)))
+            return resultado
+        if (isinstance(elemento, ast.Call) and isinstance(elemento.func, ast.Name)
+                and elemento.func.id in _FUNCIONES and not elemento.keywords):
+            funcion = elemento.func.id
+            if len(elemento.args) != _FUNCIONES[funcion]:
+                raise ValueError(f"{funcion}() recibe {_FUNCIONES[funcion]} argumentos en '{contexto}': {texto}")
+            argumentos = [visitar(argumento) for argumento in elemento.args]
+            if funcion == 'where':
+                return self.donde(*argumentos)
+            return self.nodo(('absolute' if funcion == 'abs' else funcion, *argumentos))
+
+        raise ValueError(f"Elemento no admitido ({type(elemento).__name__}) en la expresión de '{contexto}': {texto}")
+
+    def amenaza(self, nombre):
+        """
+        Nodo de la salida de una amenaza, con su regla de sin dato aplicada.
+        """
+        definicion = self.config['amenazas'][nombre]
+        nodo = self.compilar(definicion['expresion'], nombre)
+        sin_dato = definicion.get('sin_dato')
+        if sin_dato:
+            condicion = self.compilar(sin_dato['condicion'], nombre)
+            nodo = self.donde(condicion, self.constante(sin_dato['valor']), nodo)
+        return nodo
+
+
+class PlanEvaluacion:
+    """
+    Instrucciones en orden de las amenazas compiladas y asignación de buffers por bloque.
+
+    Un nodo ocupa un buffer desde que se calcula hasta su último uso; las operaciones elemento a
+    elemento escriben sobre el buffer de un argumento que ya no se usa (en el lugar). Las salidas
+    conservan el suyo hasta el final del bloque.
+    """
+
+    def __init__(self, nodos, salidas):
+        self.nodos = nodos
+        self.salidas = salidas
+        self.capas = [clave[1] for clave in nodos if clave[0] == 'capa']
+        self.normalizaciones = [clave[1] for clave in nodos if clave[0] == 'norm']
+
+        ultimo_uso = {}
+        for indice, clave in enumerate(nodos):
+            for argumento in self.argumentos(clave):
+                ultimo_uso[argumento] = indice
+        for nodo in salidas.values():
+            ultimo_uso[nodo] = len(nodos)
+
+        self.instrucciones = []
+        self.asignacion = {}
+        self.buffers = []
+        libres = {bool: [], np.float64: []}
+
+        def liberar(argumentos):
+            for argumento in argumentos:
+                libres[self.buffers[self.asignacion[argumento]]].append(self.asignacion[argumento])
+
+        for indice, clave in enumerate(nodos):
+            if clave[0] in ('capa', 'const'):
+                continue
+            vencidos = {a for a in self.argumentos(clave) if a in self.asignacion and ultimo_uso[a] == indice}
+            # where copia un argumento sobre la salida antes de leer los demás: no puede reusar sus buffers
+            if clave[0] != 'where':
+                liberar(vencidos)
+            dtype = bool if clave[0] in _BOOLEANAS else np.float64
+            if libres[dtype]:
+                self.asignacion[indice] = libres[dtype].pop()
+            else:
+                self.asignacion[indice] = len(self.buffers)
+                self.buffers.append(dtype)
+            if clave[0] == 'where':
+                liberar(vencidos)
+            self.instrucciones.append(indice)
+
+    @staticmethod
+    def argumentos(clave):
+        if clave[0] in ('capa', 'const'):
+            return ()
+        return clave[2:] if clave[0] == 'norm' else clave[1:]
+
+    def describir(self):
+        """
+        Texto del plan: una instrucción por línea con el buffer que escribe.
+        """
+        def nombre(nodo):
+            clave = self.nodos[nodo]
+            if clave[0] == 'capa':
+                return clave[1]
+            if clave[0] == 'const':
+                return f'{clave[1]:g}'
+            return f'b{self.asignacion[nodo]}'
+
+        lineas = []
+        for indice in self.instrucciones:
+            clave = self.nodos[indice]
+            if clave[0] == 'norm':
+                texto = f"normalizar[{clave[1]}]({nombre(clave[2])})"
+            else:
+                texto = f"{clave[0]}({', '.join(nombre(a) for a in clave[1:])})"
+            salidas = [n for n, nodo in self.salidas.items() if nodo == indice]
+            lineas.append(f"  {nombre(indice)} = {texto}" + (f"  → {', '.join(salidas)}" if salidas else ""))
+        for salida, nodo in self.salidas.items():
+            if self.nodos[nodo][0] in ('capa', 'const'):
+                lineas.append(f"  {salida} = {nombre(nodo)}")
+        return '\n'.join(lineas)
+
+    def evaluar_bloque(self, entradas, buffers, normalizaciones, filas):
+        """
+        Evalúa el plan sobre un bloque de `filas` filas. `entradas` son los bloques de las capas y
+        `normalizaciones` lo que devuelve preparar_normalizaciones(). Devuelve {amenaza: valores}.
+        """
+        valores = [None] * len(self.nodos)
+        for indice, clave in enumerate(self.nodos):
+            if clave[0] == 'capa':
+                valores[indice] = entradas[clave[1]]
+            elif clave[0] == 'const':
+                valores[indice] = np.float64(clave[1])
+
+        for indice in self.instrucciones:
+            clave = self.nodos[indice]
+            out = buffers[self.asignacion[indice]][:filas]
+            argumentos = [valores[a] for a in self.argumentos(clave)]
+            if clave[0] == 'norm':
+                _normalizar(argumentos[0], normalizaciones[clave[1]], out)
+            elif clave[0] == 'where':
+                np.copyto(out, argumentos[2])
+                np.copyto(out, argumentos[1], where=argumentos[0])
+            elif clave[0] in _BOOLEANAS:
+                getattr(np, clave[0])(*argumentos, out=out)
+            else:
+                # Aritmética siempre en float64 (las capas vienen en su dtype compacto, p. ej. uint8)
+                getattr(np, clave[0])(*argumentos, out=out, dtype=np.float64)
+            valores[indice] = out
+
+        return {nombre: valores[nodo] for nombre, nodo in self.salidas.items()}
+
+
+def compilar(config, amenazas=None):
+    """
+    Plan de evaluación conjunto de las amenazas pedidas (todas las de la configuración por defecto).
+    """
+    amenazas = list(config['amenazas']) if amenazas is None else list(amenazas)
+    desconocidas = [nombre for nombre in amenazas if nombre not in config['amenazas']]
+    if desconocidas:
+        raise ValueError(f"Amenazas no declaradas: {', '.join(desconocidas)}")
+    compilador = Compilador(config)
+    return PlanEvaluacion(compilador.nodos, {nombre: compilador.amenaza(nombre) for nombre in amenazas})
+
+
+def preparar_normalizaciones(config, nombres, metas):
+    """
+    Para cada normalización usada, ('tabla', tabla, base) si la capa es entera (un acceso por
+    celda, como tabla_landslide) o ('rango', ...) con la transformación de normalizar_valores.
+    """
+    preparadas = {}
+    for nombre in nombres:
+        definicion = config['normalizaciones'][nombre]
+        meta = metas[definicion['capa']]
+        tipo = definicion.get('tipo', 'rango')
+        if tipo == 'rango':
+            rango = (definicion.get('min', 1), definicion.get('max', 10))
+            tabla, base = tabla_landslide(meta, rango)
+            if tabla is not None:
+                preparadas[nombre] = ('tabla', tabla, base)
+            else:
+                preparadas[nombre] = ('rango', meta['min'], meta['max'], *rango)
+        elif tipo == 'valores':
+            if np.dtype(meta['dtype']).kind not in 'iu':
+                raise ValueError(f"La normalización '{nombre}' por valores necesita una capa entera")
+            base = min(0, meta['min'])
+            tabla = np.full(meta['max'] - base + 1, float(definicion.get('defecto', 0)), dtype=np.float64)
+            for valor, normalizado in definicion.get('valores', {}).items():
+                if base <= int(valor) <= meta['max']:
+                    tabla[int(valor) - base] = float(normalizado)
+            preparadas[nombre] = ('tabla', tabla, base)
+        else:
+            raise ValueError(f"Tipo de normalización desconocido en '{nombre}': {tipo}")
+    return preparadas
+
+
+def _normalizar(capa, normalizacion, out):
+    if normalizacion[0] == 'tabla':
+        _, tabla, base = normalizacion
+        np.take(tabla, capa if base == 0 else capa.astype(np.int64) - base, out=out)
+        return
+    # Misma aritmética que normalizar_valores: rango_min + ((valor - min) / (max - min)) * (rango_max - rango_min)
+    _, min_actual, max_actual, rango_min, rango_max = normalizacion
+    if max_actual == min_actual:
+        out[...] = (rango_min + rango_max) / 2
+        return
+    np.copyto(out, capa)
+    out -= min_actual
+    out /= max_actual - min_actual
+    out *= rango_max - rango_min
+    out += rango_min
+
+
+def _escala(definicion, histograma):
+    # (vmin, vmax) del gradiente: la escala declarada o mínimo-máximo de los valores válidos
+    if 'escala' in definicion:
+        return tuple(float(valor) for valor in definicion['escala'])
+    if histograma.cantidad and histograma.maximo > histograma.minimo:
+        return histograma.minimo, histograma.maximo
+    return RANGO
+
+
+def escribir_imagen_amenaza(nombre, definicion, matriz, histograma, directorio, codigos=None):
+    """
+    Guarda <nombre>.jpeg y <nombre>_scale.json de una amenaza. Si no se pasan los códigos ya
+    cuantizados (escala sin declarar), se cuantiza `matriz` con la escala mínimo-máximo.
+    """
+    from renderizado import cuantizar_riesgo, guardar_jpeg, lut_riesgo
+
+    colores = definicion.get('colores', {'base': ELECTRIC_BLUE})
+    gradiente = gradiente_colores(colores)
+    sin_dato = definicion.get('sin_dato')
+    vmin, vmax = _escala(definicion, histograma)
+
+    if codigos is None:
+        codigos = cuantizar_riesgo(matriz, vmax=vmax, valor_sin_dato=histograma.valor_sin_dato, vmin=vmin)
+    jpeg_path = os.path.join(directorio, f'{nombre}.jpeg')
+    guardar_jpeg(codigos, lut_riesgo(gradiente, cero=colores.get('cero', gradiente[0]),
+                                     sin_dato=colores.get('sin_dato', ELECTRIC_BLUE)), jpeg_path, calidad=95)
+
+    especiales = {'0': f"Mostrado como {colores.get('cero', gradiente[0])}"}
+    if sin_dato:
+        especiales[f"{sin_dato['valor']:g}"] = f"Sin dato: {sin_dato['condicion']}"
+    escala_info = {
+        'data_type': nombre,
+        'title': definicion.get('titulo', nombre),
+        'description': definicion['expresion'],
+        'color_scheme': {
+            'base_color': colores.get('base'),
+            'color_name': colores.get('nombre'),
+            'gradient': gradiente,
+            'special_values': especiales,
+            'value_range': {
+                'scale': [vmin, vmax],
+                'actual_data': histograma.resumen()
+            }
+        },
+        'dimensions': f"{matriz.shape[0]}x{matriz.shape[1]}",
+        'files': {'jpeg': f'{nombre}.jpeg', 'npy': f'{nombre}.npy'}
+    }
+
+    json_path = os.path.join(directorio, f'{nombre}_scale.json')
+    ruta_tmp = f'{json_path}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(escala_info, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, json_path)
+    return jpeg_path
+
+
+@medir('formulas.evaluar_amenazas')
+def evaluar_amenazas(ruta_config=CONFIG_AMENAZAS, directorio_entrada='.', directorio_salida=DIRECTORIO_SALIDA,
+                     amenazas=None, grilla=None, csv=False, workers=None, forzar=False,
+                     elementos_por_bloque=ELEMENTOS_POR_BLOQUE, mostrar_plan=False):
+    """
+    Evalúa las amenazas de la configuración en una sola pasada por bloques sobre las capas y
+    escribe sus salidas en directorio_salida. Devuelve {amenaza: resumen del histograma}, o None
+    si las salidas están vigentes. Con grilla (ver alineacion.leer_grilla) las capas se
+    remuestrean a ella; si no, se recortan a las dimensiones mínimas comunes.
+    """
+    from renderizado import cuantizar_riesgo
+
+    config = cargar_config(ruta_config)
+    plan = compilar(config, amenazas)
+    nombres = list(plan.salidas)
+    print(f"Plan de {', '.join(nombres)}: {len(plan.instrucciones)} operaciones, {len(plan.buffers)} buffers "
+          f"por bloque, capas {', '.join(plan.capas)}")
+    if mostrar_plan:
+        print(plan.describir())
+
+    rutas = {capa: os.path.join(directorio_entrada, config['capas'][capa]['archivo']) for capa in plan.capas}
+    salidas = [f'{nombre}{sufijo}' for nombre in nombres
+               for sufijo in ('.npy', '.jpeg', '_scale.json') + (('.csv',) if csv else ())]
+    parametros = {'amenazas': nombres, 'csv': csv}
+    if grilla is not None:
+        parametros['grilla'] = grilla
+    huella_actual = huella(rutas.values(), huella_codigo(*CODIGO_FORMULAS, ruta_config), parametros)
+
+    os.makedirs(directorio_salida, exist_ok=True)
+    registro = cargar_manifiesto(directorio_salida).get('formulas', {}).get('amenazas')
+    if not forzar and vigente(registro, huella_actual, directorio_salida):
+        print("Sin cambios en las capas ni en la configuración: se conservan las salidas de " + ", ".join(nombres))
+        return None
+
+    capas, metas = cargar_capas(rutas, grilla)
+    filas = min(capa.shape[0] for capa in capas.values())
+    columnas = min(capa.shape[1] for capa in capas.values())
+    print(f"Dimensiones ({'grilla' if grilla else 'mínimas'}): {filas} x {columnas}")
+
+    normalizaciones = preparar_normalizaciones(config, plan.normalizaciones, metas)
+    filas_por_bloque = max(1, elementos_por_bloque // max(columnas, 1))
+    buffers = [np.empty((filas_por_bloque, columnas), dtype=dtype) for dtype in plan.buffers]
+
+    matrices, histogramas, codigos = {}, {}, {}
+    for nombre in nombres:
+        definicion = config['amenazas'][nombre]
+        sin_dato = definicion.get('sin_dato')
+        ruta_tmp = os.path.join(directorio_salida, f'{nombre}.npy.{os.getpid()}.tmp')
+        matrices[nombre] = np.lib.format.open_memmap(ruta_tmp, mode='w+', dtype=definicion.get('dtype', 'float64'),
+                                                     shape=(filas, columnas))
+        histogramas[nombre] = HistogramaRiesgo(definicion.get('escala', RANGO),
+                                               valor_sin_dato=sin_dato['valor'] if sin_dato else np.nan)
+        if 'escala' in definicion:
+            codigos[nombre] = np.empty((filas, columnas), dtype=np.uint8)
+
+    with etapa('formulas.evaluacion'), np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for inicio in range(0, filas, filas_por_bloque):
+            fin = min(inicio + filas_por_bloque, filas)
+            entradas = {capa: np.asarray(capas[capa][inicio:fin, :columnas]) for capa in plan.capas}
+            resultados = plan.evaluar_bloque(entradas, buffers, normalizaciones, fin - inicio)
+
+            for nombre, valores in resultados.items():
+                destino = matrices[nombre][inicio:fin]
+                np.copyto(destino, valores, casting='unsafe')
+                if nombre in codigos:
+                    vmin, vmax = _escala(config['amenazas'][nombre], histogramas[nombre])
+                    codigos[nombre][inicio:fin] = cuantizar_riesgo(destino, vmax=vmax,
+                                                                   valor_sin_dato=histogramas[nombre].valor_sin_dato,
+                                                                   vmin=vmin, histograma=histogramas[nombre])
+                else:
+                    histogramas[nombre].actualizar(destino)
+
+    resumenes = {}
+    for nombre in nombres:
+        matrices[nombre].flush()
+        matrices[nombre] = None
+        ruta_npy = os.path.join(directorio_salida, f'{nombre}.npy')
+        os.replace(f'{ruta_npy}.{os.getpid()}.tmp', ruta_npy)
+        matriz = np.load(ruta_npy, mmap_mode='r')
+
+        with etapa('formulas.render', archivo=f'{nombre}.jpeg'):
+            escribir_imagen_amenaza(nombre, config['amenazas'][nombre], matriz, histogramas[nombre],
+                                    directorio_salida, codigos.get(nombre))
+        if csv:
+            from exportar_csv import exportar_csv
+            with etapa('formulas.csv', archivo=f'{nombre}.csv'):
+                exportar_csv(matriz, os.path.join(directorio_salida, f'{nombre}.csv'), workers=workers)
+
+        resumenes[nombre] = histogramas[nombre].resumen()
+        print(f"✓ {nombre}: mínimo {resumenes[nombre]['min']}, máximo {resumenes[nombre]['max']}, "
+              f"promedio {resumenes[nombre]['mean']:.4f}" if resumenes[nombre]['count'] else f"✓ {nombre}: sin valores válidos")
+
+    guardar_seccion(directorio_salida, 'formulas', {'amenazas': {'huella': huella_actual, 'salidas': salidas}})
+    return resumenes
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from alineacion import leer_grilla
+
+    parser = argparse.ArgumentParser(description='Evaluación de las amenazas declaradas en la configuración')
+    parser.add_argument('--config', default=CONFIG_AMENAZAS, help='configuración de capas y amenazas (default: amenazas.json)')
+    parser.add_argument('--entrada', default='.', help='directorio con los CSV de las capas (default: actual)')
+    parser.add_argument('--salida', default=DIRECTORIO_SALIDA, help=f'directorio de las salidas (default: {DIRECTORIO_SALIDA})')
+    parser.add_argument('--amenazas', default=None,
+                        help='amenazas a evaluar separadas por comas (default: todas las de la configuración)')
+    parser.add_argument('--csv', action='store_true', help='exportar también <amenaza>.csv')
+    parser.add_argument('--grilla', default=None,
+                        help="grilla destino 'FILASxCOLUMNAS' o JSON: remuestrear las capas en lugar de recortarlas")
+    parser.add_argument('--workers', type=int, default=None, help='procesos para escribir los CSV (default: uno por núcleo)')
+    parser.add_argument('--forzar', action='store_true', help='recalcular aunque nada haya cambiado')
+    parser.add_argument('--mostrar-plan', action='store_true', help='mostrar las operaciones del plan compilado')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por etapa y guardarlos en DIR (ver instrumentacion.py)')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+
+    inicio = time.perf_counter()
+    evaluar_amenazas(args.config, args.entrada, args.salida,
+                     args.amenazas.split(',') if args.amenazas else None,
+                     leer_grilla(args.grilla) if args.grilla else None, args.csv, args.workers, args.forzar,
+                     mostrar_plan=args.mostrar_plan)
+    print(f"Listo en {time.perf_counter() - inicio:.2f} s")
@@ -0,0 +1,233 @@
+"""
+Histograma acumulable de los valores válidos del riesgo (distintos de 99 y de NaN).
+
+riesgo_scale.json necesitaba el mínimo y el máximo de los valores válidos, y se obtenían con dos
+copias indexadas de la grilla completa (riesgo[riesgo != 99]). HistogramaRiesgo se actualiza bloque
+a bloque, en la misma pasada en la que se cuantiza la imagen (renderizado.cuantizar_riesgo), y da
+a la vez:
+- mínimo, máximo, cantidad y promedio exactos de los valores válidos, cantidad de 99 y de ceros;
+- percentiles: los valores se acumulan en `bins` intervalos fijos sobre `rango` (0,01 de ancho
+  por defecto) más uno por debajo y otro por encima, con la cantidad y la suma de cada intervalo.
+  El cuantil es el promedio de los valores de su intervalo, así que es exacto cuando el intervalo
+  tiene un solo valor distinto (el caso del riesgo, que toma pocos valores) y nunca se aleja más
+  de un ancho de intervalo;
+- histograma de clases 0-10 con el mismo criterio que zonas.py (la clase k cuenta los valores
+  en [k, k + 1) y la clase 10 incluye 10 y los mayores), sumando los intervalos de cada clase.
+
+Los histogramas de distintos bloques, teselas o procesos se combinan sumando (combinar / +=) y
+se serializan con a_dict / desde_dict, así cada proceso puede acumular el suyo.
+
+Con un estiramiento de colores (p. ej. percentiles 2 y 98, ver rango_estirado) el gradiente de
+riesgo.jpeg va del percentil bajo al alto en lugar de la escala fija 0-10.
+"""
+
+import math
+
+import numpy as np
+
+RANGO = (0.0, 10.0)
+BINS = 1000
+
+# Clases 0-10 del histograma de la leyenda (mismo criterio que zonas.CLASES)
+CLASES = 11
+
+PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99)
+
+# Filas por bloque al recorrer una matriz completa (acota los temporales sobre memory-maps)
+FILAS_POR_BLOQUE = 1024
+
+
+def _mismo_valor(a, b):
+    # Comparación de valores sin dato que trata NaN como igual a NaN
+    return (math.isnan(a) and math.isnan(b)) or a == b
+
+
+class HistogramaRiesgo:
+    """
+    Histograma de intervalos fijos y de clases de los valores válidos, acumulable por bloques.
+    """
+
+    def __init__(self, rango=RANGO, bins=BINS, valor_sin_dato=99):
+        """
+        valor_sin_dato puede ser NaN (p. ej. amenazas sin valor sin dato declarado): en ese caso
+        count_sin_dato cuenta los NaN. Con otro valor, los NaN se descartan sin contarse.
+        """
+        self.rango = (float(rango[0]), float(rango[1]))
+        self.bins = bins
+        self.valor_sin_dato = valor_sin_dato
+        # Intervalo 0: por debajo del rango; 1..bins: el rango; bins + 1: por encima
+        self.conteos = np.zeros(bins + 2, dtype=np.int64)
+        self.sumas = np.zeros(bins + 2, dtype=np.float64)
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.count_sin_dato = 0
+        self.count_zero = 0
+
+    @property
+    def cantidad(self):
+        return int(self.conteos.sum())
+
+    @property
+    def clases(self):
+        """
+        Cantidad de valores por clase 0-10, a partir de los intervalos: cada intervalo va a la clase
+        de su borde inferior (exacto cuando los bordes caen en enteros, como con el rango y los
+        intervalos por defecto); los de debajo del rango a la clase 0 y los de encima a la 10.
+        """
+        inicio, fin = self.rango
+        bordes = inicio + np.arange(self.bins) * ((fin - inicio) / self.bins)
+        clase = np.clip(np.floor(np.round(bordes, 9)), 0, CLASES - 1).astype(np.intp)
+        clases = np.bincount(clase, weights=self.conteos[1:-1], minlength=CLASES).astype(np.int64)
+        clases[0] += self.conteos[0]
+        clases[-1] += self.conteos[-1]
+        return clases
+
+    @property
+    def promedio(self):
+        cantidad = self.cantidad
+        return float(self.sumas.sum() / cantidad) if cantidad else None
+
+    def actualizar(self, bloque):
+        """
+        Suma los valores válidos de un bloque (cualquier forma y dtype numérico).
+        """
+        bloque = np.asarray(bloque)
+        sin_dato_nan = math.isnan(self.valor_sin_dato)
+        no_validos = np.isnan(bloque) if sin_dato_nan else bloque == self.valor_sin_dato
+        self.count_sin_dato += int(np.count_nonzero(no_validos))
+        if bloque.dtype.kind == 'f' and not sin_dato_nan:
+            no_validos |= np.isnan(bloque)
+        if np.count_nonzero(no_validos) == bloque.size:
+            return self
+
+        validos = ~no_validos
+        self.count_zero += int(np.count_nonzero(bloque == 0))
+        self.minimo = min(self.minimo, float(np.min(bloque, where=validos, initial=np.inf)))
+        self.maximo = max(self.maximo, float(np.max(bloque, where=validos, initial=-np.inf)))
+
+        # Índice de intervalo (0 debajo del rango, 1..bins el rango, bins + 1 encima) calculado en
+        # float64; las celdas no válidas van a un intervalo descartable (bins + 2)
+        inicio, fin = self.rango
+        posicion = bloque.astype(np.float64).ravel()
+        if inicio:
+            posicion -= inicio
+        posicion *= self.bins / (fin - inicio)
+        posicion += 1
+        np.clip(posicion, 0, self.bins + 1, out=posicion)
+        np.copyto(posicion, self.bins + 2, where=no_validos.ravel())
+        indices = posicion.astype(np.intp)
+
+        self.conteos += np.bincount(indices, minlength=self.bins + 3)[:self.bins + 2]
+        self.sumas += np.bincount(indices, weights=bloque.ravel(), minlength=self.bins + 3)[:self.bins + 2]
+        return self
+
+    def actualizar_por_bloques(self, matriz, filas_por_bloque=FILAS_POR_BLOQUE):
+        """
+        Recorre una matriz completa (puede ser un memory-map) por bloques de filas.
+        """
+        for inicio in range(0, matriz.shape[0], filas_por_bloque):
+            self.actualizar(matriz[inicio:inicio + filas_por_bloque])
+        return self
+
+    def combinar(self, otro):
+        """
+        Suma otro histograma con el mismo rango y cantidad de intervalos.
+        """
+        if (self.rango, self.bins) != (otro.rango, otro.bins) or not _mismo_valor(self.valor_sin_dato,
+                                                                                 otro.valor_sin_dato):
+            raise ValueError("No se pueden combinar histogramas con distinto rango, intervalos o valor sin dato")
+        self.conteos += otro.conteos
+        self.sumas += otro.sumas
+        self.minimo = min(self.minimo, otro.minimo)
+        self.maximo = max(self.maximo, otro.maximo)
+        self.count_sin_dato += otro.count_sin_dato
+        self.count_zero += otro.count_zero
+        return self
+
+    def __iadd__(self, otro):
+        return self.combinar(otro)
+
+    def cuantil(self, q):
+        """
+        Valor del cuantil q (0-1) de los valores válidos, o None si no hay ninguno.
+        """
+        cantidad = self.cantidad
+        if not cantidad:
+            return None
+        posicion = min(max(q, 0.0), 1.0) * (cantidad - 1)
+        intervalo = int(np.searchsorted(np.cumsum(self.conteos), posicion, side='right'))
+        valor = self.sumas[intervalo] / self.conteos[intervalo]
+        return float(min(max(valor, self.minimo), self.maximo))
+
+    def percentiles(self, percentiles=PERCENTILES):
+        return {f'p{p:g}': self.cuantil(p / 100) for p in percentiles}
+
+    def resumen(self, percentiles=PERCENTILES):
+        """
+        Estadísticas para riesgo_scale.json (claves en inglés, como el resto del archivo).
+        """
+        hay_datos = self.cantidad > 0
+        return {
+            'min': self.minimo if hay_datos else None,
+            'max': self.maximo if hay_datos else None,
+            'mean': self.promedio,
+            'count': self.cantidad,
+            'no_data_count': self.count_sin_dato,
+            'zero_count': self.count_zero,
+            'percentiles': self.percentiles(percentiles),
+            'class_histogram': {str(clase): int(n) for clase, n in enumerate(self.clases)}
+        }
+
+    def a_dict(self):
+        """
+        Representación serializable (JSON) con solo los intervalos no vacíos; un valor sin dato
+        NaN se guarda como null.
+        """
+        ocupados = np.flatnonzero(self.conteos)
+        return {
+            'rango': list(self.rango),
+            'bins': self.bins,
+            'valor_sin_dato': None if math.isnan(self.valor_sin_dato) else self.valor_sin_dato,
+            'intervalos': {str(int(i)): [int(self.conteos[i]), float(self.sumas[i])] for i in ocupados},
+            'min': self.minimo if self.cantidad else None,
+            'max': self.maximo if self.cantidad else None,
+            'count_sin_dato': self.count_sin_dato,
+            'count_zero': self.count_zero
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        valor_sin_dato = datos['valor_sin_dato']
+        histograma = cls(datos['rango'], datos['bins'], np.nan if valor_sin_dato is None else valor_sin_dato)
+        for intervalo, (conteo, suma) in datos['intervalos'].items():
+            histograma.conteos[int(intervalo)] = conteo
+            histograma.sumas[int(intervalo)] = suma
+        histograma.minimo = datos['min'] if datos['min'] is not None else np.inf
+        histograma.maximo = datos['max'] if datos['max'] is not None else -np.inf
+        histograma.count_sin_dato = datos['count_sin_dato']
+        histograma.count_zero = datos['count_zero']
+        return histograma
+
+
+def leer_estiramiento(texto):
+    """
+    Percentiles del estiramiento de colores 'BAJO,ALTO' (p. ej. '2,98') → (2.0, 98.0).
+    """
+    try:
+        bajo, alto = (float(valor) for valor in texto.split(','))
+    except ValueError:
+        raise ValueError(f"Estiramiento inválido '{texto}': se esperaba 'BAJO,ALTO' (p. ej. 2,98)") from None
+    if not 0 <= bajo < alto <= 100:
+        raise ValueError(f"Estiramiento inválido '{texto}': hace falta 0 <= BAJO < ALTO <= 100")
+    return bajo, alto
+
+
+def rango_estirado(histograma, estiramiento):
+    """
+    (vmin, vmax) del gradiente para los percentiles del estiramiento, o None si no hay valores
+    válidos o los dos percentiles coinciden (la escala fija 0-10 sigue valiendo).
+    """
+    vmin, vmax = (histograma.cuantil(p / 100) for p in estiramiento)
+    if vmin is None or vmax <= vmin:
+        return None
+    return vmin, vmax
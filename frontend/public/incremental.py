@@ -0,0 +1,265 @@
+"""
+Recálculo incremental del riesgo por teselas.
+
+Cuando se actualiza una capa de amenaza solo en una zona (p. ej. un nuevo relevamiento de
+inundaciones), no hace falta recalcular ni volver a renderizar toda la grilla. Cada cálculo
+completo guarda, junto al almacén por chunks, el hash de cada tesela de 256x256 (la misma
+grilla que los chunks de riesgo_almacen/ y que las teselas del nivel de resolución completa
+de la pirámide) de las cinco capas de entrada:
+
+    riesgo_almacen/hashes_entrada.json
+
+En la ejecución siguiente se vuelven a hashear las teselas de las capas y se comparan: solo
+las teselas en las que cambió alguna capa se recalculan y se parchean en las salidas:
+- riesgo.npy se actualiza en el lugar (memory-map en modo r+)
+- en riesgo_almacen/ se reescriben solo esos chunks y las estadísticas globales se rearman
+  a partir de las parciales de cada chunk (almacen.actualizar_chunks)
+- en teselas/riesgo/ se regeneran solo las teselas de cada nivel que las cubren
+  (piramide.actualizar_piramide)
+- riesgo.jpeg y riesgo.csv son un único archivo cada uno y se vuelven a escribir desde riesgo.npy
+
+El camino incremental solo se usa si el código y los parámetros de la fórmula no cambiaron
+(según build_manifest.json), las dimensiones, el dtype y la normalización de landslide
+(mínimo y máximo de la capa) son los mismos y las salidas pedidas ya existen; si no, se
+recalcula todo. Un cálculo completo borra el estado al empezar y lo vuelve a guardar al
+terminar, así un cálculo interrumpido nunca deja hashes que no correspondan a las salidas.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from alineacion import cargar_capas
+from almacen import TAMANO_CHUNK, actualizar_chunks
+from calcular_riesgo import (DIRECTORIO_ALMACEN, RANGO_LANDSLIDE, SALIDA_TESELAS, VALOR_SIN_DATO,
+                             EstadisticasRiesgo, actualizar_teselas_riesgo, calcular_riesgo_fusionado,
+                             crear_jpeg_riesgo, elegir_dtype_calculo, escribir_csv_riesgo, mostrar_estadisticas,
+                             normalizar_con_tabla, normalizar_valores, registrar_riesgo, rutas_capas,
+                             tabla_landslide)
+from instrumentacion import etapa, medir
+from manifiesto import cargar_manifiesto
+
+ARCHIVO_ESTADO = os.path.join(DIRECTORIO_ALMACEN, 'hashes_entrada.json')
+
+# Incrementar si cambia la forma de hashear las teselas o el contenido del estado
+INCREMENTAL_VERSION = 1
+
+
+def hashes_teselas(capa, tamano_tesela=TAMANO_CHUNK):
+    """
+    Hash (blake2b de 8 bytes) de cada tesela de la capa, con claves 'i.j' como los chunks del
+    almacén. La capa se recorre por bandas de filas, así un memory-map no se lee entero a memoria.
+    """
+    alto, ancho = tamano_tesela
+    hashes = {}
+    for i, inicio in enumerate(range(0, capa.shape[0], alto)):
+        banda = np.asarray(capa[inicio:inicio + alto])
+        for j, columna in enumerate(range(0, capa.shape[1], ancho)):
+            tesela = np.ascontiguousarray(banda[:, columna:columna + ancho])
+            hashes[f'{i}.{j}'] = hashlib.blake2b(tesela.tobytes(), digest_size=8).hexdigest()
+    return hashes
+
+
+def abrir_entradas(directorio_entrada='.', grilla=None):
+    """
+    Abre las cinco capas (memory-map desde la caché) recortadas a las dimensiones mínimas
+    comunes, o alineadas a la grilla destino si se declaró una. Devuelve (capas, metas, tabla,
+    base, dtype) con la normalización de landslide y el dtype de cálculo que usa calcular_riesgo().
+    """
+    capas, metas = cargar_capas(rutas_capas(directorio_entrada), grilla)
+    filas = min(capa.shape[0] for capa in capas.values())
+    columnas = min(capa.shape[1] for capa in capas.values())
+    capas = {nombre: capa[:filas, :columnas] for nombre, capa in capas.items()}
+
+    tabla, base = tabla_landslide(metas['landslide'])
+    dtype = elegir_dtype_calculo(metas, tabla)
+    return capas, metas, tabla, base, dtype
+
+
+@medir('incremental.hashes')
+def estado_entradas(capas, metas, dtype, tamano_tesela=TAMANO_CHUNK):
+    """
+    Estado de las entradas: forma, tamaño de tesela, dtype, rango de landslide y hashes por tesela de cada capa.
+    """
+    forma = next(iter(capas.values())).shape
+    return {
+        'version': INCREMENTAL_VERSION,
+        'forma': [int(forma[0]), int(forma[1])],
+        'tamano_tesela': list(tamano_tesela),
+        'dtype': np.dtype(dtype).str,
+        'landslide': {'min': metas['landslide']['min'], 'max': metas['landslide']['max']},
+        'hashes': {nombre: hashes_teselas(capa, tamano_tesela) for nombre, capa in capas.items()}
+    }
+
+
+def cargar_estado(ruta=ARCHIVO_ESTADO):
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            estado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return estado if estado.get('version') == INCREMENTAL_VERSION else None
+
+
+def guardar_estado(estado, ruta=ARCHIVO_ESTADO):
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+
+
+def invalidar_estado(ruta=ARCHIVO_ESTADO):
+    """
+    Borra el estado antes de un cálculo completo: hasta que termine, las salidas no
+    corresponden a ningún estado y la próxima ejecución tiene que recalcular todo.
+    """
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+def registrar_estado(directorio_entrada='.', grilla=None, ruta=ARCHIVO_ESTADO):
+    """
+    Guarda el estado de las entradas después de un cálculo completo.
+    """
+    capas, metas, _, _, dtype = abrir_entradas(directorio_entrada, grilla)
+    guardar_estado(estado_entradas(capas, metas, dtype), ruta)
+
+
+def teselas_sucias(anterior, actual):
+    """
+    Claves 'i.j' de las teselas en las que cambió alguna capa, o None si los estados no son
+    comparables (otra forma, dtype, tamaño de tesela o normalización de landslide).
+    """
+    if anterior is None or any(anterior.get(campo) != actual[campo]
+                               for campo in ('forma', 'tamano_tesela', 'dtype', 'landslide')):
+        return None
+
+    sucias = set()
+    for nombre, hashes in actual['hashes'].items():
+        previos = anterior['hashes'].get(nombre, {})
+        sucias.update(clave for clave, valor in hashes.items() if previos.get(clave) != valor)
+    return sorted(sucias, key=lambda clave: tuple(int(parte) for parte in clave.split('.')))
+
+
+def _ventana(clave, forma, tamano_tesela=TAMANO_CHUNK):
+    i, j = (int(parte) for parte in clave.split('.'))
+    alto, ancho = tamano_tesela
+    return i * alto, min((i + 1) * alto, forma[0]), j * ancho, min((j + 1) * ancho, forma[1])
+
+
+def recalcular_ventana(capas, metas, tabla, base, dtype, ventana):
+    """
+    Riesgo de una ventana (fila_inicio, fila_fin, columna_inicio, columna_fin) con la misma
+    normalización y dtype que la grilla completa, así el resultado es idéntico al del cálculo completo.
+    """
+    filas, columnas = slice(ventana[0], ventana[1]), slice(ventana[2], ventana[3])
+    landslide = capas['landslide'][filas, columnas]
+    if tabla is not None:
+        landslide = normalizar_con_tabla(landslide, tabla.astype(dtype), base)
+    else:
+        landslide = normalizar_valores(landslide.astype(float), *RANGO_LANDSLIDE,
+                                       min_actual=metas['landslide']['min'], max_actual=metas['landslide']['max'])
+
+    riesgo, _, _ = calcular_riesgo_fusionado(capas['flood'][filas, columnas], landslide,
+                                             capas['water'][filas, columnas], capas['urban'][filas, columnas],
+                                             capas['area_protegida'][filas, columnas], dtype)
+    return riesgo
+
+
+def estadisticas_riesgo(resumen):
+    """
+    EstadisticasRiesgo de toda la grilla a partir de las estadísticas combinadas del almacén,
+    que excluyen los 99: se les suman las celdas sin dato para informar lo mismo que el
+    cálculo completo.
+    """
+    estadisticas = EstadisticasRiesgo()
+    if resumen['cantidad']:
+        estadisticas.acumular(resumen['min'], resumen['max'], resumen['suma'], resumen['cantidad'], 0,
+                              resumen['count_zero'])
+    sin_dato = resumen['count_sin_dato']
+    if sin_dato:
+        estadisticas.acumular(float(VALOR_SIN_DATO), float(VALOR_SIN_DATO), float(VALOR_SIN_DATO) * sin_dato,
+                              sin_dato, sin_dato, 0)
+    return estadisticas
+
+
+def _motivo_completo(registro, huella_actual, salidas):
+    """
+    Motivo por el que no se puede usar el camino incremental, o None si se puede.
+    """
+    if not registro:
+        return "no hay un cálculo anterior registrado"
+    huella_anterior = registro.get('huella', {})
+    if huella_anterior.get('codigo') != huella_actual['codigo']:
+        return "cambió el código del cálculo"
+    if huella_anterior.get('parametros') != huella_actual['parametros']:
+        return "cambiaron los parámetros de la fórmula"
+    if not set(salidas) <= set(registro.get('salidas', [])):
+        return "se piden salidas que el cálculo anterior no generó"
+    if not all(os.path.exists(salida) for salida in salidas + ['riesgo.npy']):
+        return "faltan salidas del cálculo anterior"
+    return None
+
+
+@medir('incremental.calcular_riesgo')
+def calcular_riesgo_incremental(huella_actual, salidas, workers=None, formato_csv=None, directorio_entrada='.',
+                                grilla=None, estiramiento=None):
+    """
+    Recalcula y parchea solo las teselas cuyas capas de entrada cambiaron desde el cálculo
+    anterior (las de las capas alineadas, si se declaró una grilla). Devuelve las estadísticas globales actualizadas (las del almacén), o None si no
+    se puede usar el camino incremental y hay que recalcular todo.
+    """
+    registro = cargar_manifiesto('.').get('calcular_riesgo', {}).get('riesgo')
+    motivo = _motivo_completo(registro, huella_actual, salidas)
+    if motivo is None:
+        anterior = cargar_estado()
+        motivo = "no hay hashes por tesela del cálculo anterior" if anterior is None else None
+
+    if motivo is None:
+        capas, metas, tabla, base, dtype = abrir_entradas(directorio_entrada, grilla)
+        actual = estado_entradas(capas, metas, dtype)
+        sucias = teselas_sucias(anterior, actual)
+        if sucias is None:
+            motivo = "cambiaron las dimensiones, el dtype o la normalización de landslide"
+
+    if motivo is None:
+        riesgo = np.load('riesgo.npy', mmap_mode='r+')
+        if riesgo.shape != tuple(actual['forma']) or riesgo.dtype != dtype:
+            motivo = "riesgo.npy no corresponde a las capas actuales"
+
+    if motivo is not None:
+        print(f"Recálculo completo: {motivo}")
+        return None
+
+    total = len(actual['hashes']['flood'])
+    print(f"Recálculo incremental: {len(sucias)} de {total} teselas cambiaron")
+
+    forma = riesgo.shape
+    ventanas = [_ventana(clave, forma) for clave in sucias]
+    with etapa('incremental.formula'):
+        for f0, f1, c0, c1 in ventanas:
+            riesgo[f0:f1, c0:c1] = recalcular_ventana(capas, metas, tabla, base, dtype, (f0, f1, c0, c1))
+        riesgo.flush()
+
+    with etapa('riesgo.almacen'):
+        meta = actualizar_chunks(riesgo, DIRECTORIO_ALMACEN, sucias, valor_sin_dato=VALOR_SIN_DATO)
+    estadisticas = estadisticas_riesgo(meta['estadisticas'])
+    mostrar_estadisticas(estadisticas)
+
+    correcto = True
+    if sucias:
+        if 'riesgo.csv' in salidas:
+            escribir_csv_riesgo(riesgo, 'riesgo.csv', formato_csv=formato_csv, workers=workers)
+        if 'riesgo.jpeg' in salidas:
+            correcto = crear_jpeg_riesgo(riesgo, estiramiento=estiramiento)
+        if correcto and SALIDA_TESELAS in salidas:
+            correcto = actualizar_teselas_riesgo(riesgo, ventanas, workers)
+
+    if correcto:
+        guardar_estado(actual)
+        registrar_riesgo(huella_actual, salidas)
+    return estadisticas
@@ -0,0 +1,503 @@
+"""
+Modo de ingesta continua: vigila los CSV de las capas y publica sus salidas a medida que cambian.
+
+Una capa nueva llega por la ruta de subida del backend (backend/uploads/, con el nombre
+<capa>-<marca de tiempo>-<aleatorio>.csv que le pone multer en middleware/upload.js) y después
+había que correr a mano csv_to_jpeg.py y calcular_riesgo.py, que recorren todo el directorio.
+Solo se aceptan subidas de capas de entrada declaradas (las de la fórmula de riesgo y las de
+amenazas.json): <capa> es el nombre que eligió quien subió el archivo, y cualquier otro
+(riesgo.csv, por ejemplo) pisaría una salida del pipeline o dejaría CSV arbitrarios en la entrada.
+Las demás subidas se ignoran y se informan una vez.
+ingesta.py lo hace en un solo proceso asyncio, con etapas conectadas por colas acotadas:
+
+    escaneo ──► cola de lectura ──► lectores (hilos) ──► cola de proceso ──► procesadores (pool de procesos)
+                                                                          └──► riesgo (una corrida a la vez)
+
+- escaneo: cada `intervalo` segundos revisa (os.scandir) tamaño y fecha de los CSV de la entrada
+  y de las subidas. Un archivo se encola cuando cambió y quedó igual entre dos revisiones (una
+  subida todavía en curso no se procesa). Con la cola llena el escaneo espera: las colas acotadas
+  frenan a las etapas anteriores en lugar de acumular trabajo en memoria.
+- lectores: en un pool de hilos, para no bloquear el bucle, publican las subidas en la entrada
+  como <capa>.csv, calculan el hash del CSV (lo leen completo, lo que además lo deja en la caché
+  de páginas para la etapa siguiente) y marcan los que no cambiaron de contenido según
+  build_manifest.json. Mientras tanto los procesadores siguen con los archivos anteriores.
+- procesadores: en un pool de procesos convierten cada CSV (caché binaria, JPEG y, con --teselas,
+  la pirámide; ver csv_to_jpeg.convert_csv_file) y lo registran en el manifiesto y en
+  conversion_summary.json.
+- riesgo: si cambió alguna de las cinco capas de la fórmula, cuando no queda ninguna de ellas en
+  proceso se recalcula el riesgo (calcular_riesgo, incremental por teselas). Los cambios que llegan
+  mientras corre se juntan en una sola corrida siguiente.
+
+Todas las salidas que lee el frontend (JPEG, JSON, CSV, teselas) se escriben en un temporal y se
+renombran al terminar (os.replace), así nunca se lee un archivo a medio escribir.
+
+Por archivo se informa la latencia de punta a punta (desde la última modificación del CSV, o
+desde el arranque para los que ya estaban, hasta que sus salidas quedaron publicadas) y cuánto pasó en lectura, en cola y en proceso; el resumen
+(throughput en archivos/s y MB/s, percentiles de latencia y corridas de riesgo) se guarda en
+ingesta_metricas.json después de cada archivo y se muestra al terminar.
+
+Uso:
+    python ingesta.py [--entrada DIR] [--salida DIR] [--subidas ../../backend/uploads] [--teselas]
+    python ingesta.py --una-vez       # procesa lo pendiente y termina
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from calcular_riesgo import ARCHIVOS_CAPAS
+from csv_to_jpeg import convert_csv_file, huella_capa, registrar_conversion
+from formulas import CONFIG_AMENAZAS, cargar_config
+from manifiesto import cargar_manifiesto, vigente
+
+INTERVALO = 1.0
+TAMANO_COLA = 8
+LECTORES = 2
+
+ARCHIVO_METRICAS = 'ingesta_metricas.json'
+
+# Salidas del propio pipeline con extensión .csv: no son capas de entrada
+IGNORADOS = {'riesgo.csv'}
+
+# Nombre que multer le da a las subidas: <capa>-<Date.now()>-<aleatorio>.csv
+PATRON_SUBIDA = re.compile(r'^(?P<capa>.+)-\d{13}-\d+\.csv$')
+
+
+def capas_declaradas(config=CONFIG_AMENAZAS):
+    """
+    Nombres de CSV que puede publicar una subida: las capas de la fórmula de riesgo y las capas de
+    la configuración de amenazas que están directamente en la entrada, salvo IGNORADOS.
+    """
+    archivos = set(ARCHIVOS_CAPAS.values())
+    try:
+        archivos.update(capa['archivo'] for capa in cargar_config(config)['capas'].values())
+    except (OSError, ValueError) as e:
+        print(f"✗ No se pudo leer la configuración de capas {config}: {e}")
+    return {archivo for archivo in archivos if os.path.basename(archivo) == archivo} - IGNORADOS
+
+
+def _percentiles(valores):
+    ms = np.array(valores, dtype=float)
+    if ms.size == 0:
+        return None
+    return {
+        'promedio_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+class MetricasIngesta:
+    """
+    Latencias por etapa de los últimos `maximo` archivos y corridas de riesgo, y totales de la sesión.
+    El throughput se mide entre la primera detección y la última publicación, sin contar el tiempo ocioso
+    previo a la primera detección.
+    """
+
+    def __init__(self, maximo=1000):
+        self.archivos = deque(maxlen=maximo)
+        self.riesgo = deque(maxlen=maximo)
+        self.totales = defaultdict(int)
+        self.primero = None
+        self.ultimo = None
+
+    def registrar_archivo(self, registro, detectado, publicado):
+        self.archivos.append(registro)
+        self.totales[registro['estado']] += 1
+        self.totales['bytes'] += registro['bytes']
+        self.primero = detectado if self.primero is None else min(self.primero, detectado)
+        self.ultimo = publicado if self.ultimo is None else max(self.ultimo, publicado)
+
+    def registrar_riesgo(self, registro, publicado):
+        self.riesgo.append(registro)
+        self.totales['riesgo'] += 1
+        self.ultimo = publicado if self.ultimo is None else max(self.ultimo, publicado)
+
+    def resumen(self):
+        archivos = sum(self.totales[estado] for estado in ('convertido', 'sin_cambios', 'error'))
+        segundos = (self.ultimo - self.primero) if self.primero is not None else 0.0
+        return {
+            'archivos': archivos,
+            'convertidos': self.totales['convertido'],
+            'sin_cambios': self.totales['sin_cambios'],
+            'errores': self.totales['error'],
+            'megabytes': round(self.totales['bytes'] / 1e6, 3),
+            'segundos_activos': round(segundos, 3),
+            'archivos_por_segundo': round(archivos / segundos, 3) if segundos else None,
+            'mb_por_segundo': round(self.totales['bytes'] / 1e6 / segundos, 3) if segundos else None,
+            'latencia': _percentiles([r['latencia_ms'] for r in self.archivos]),
+            'lectura': _percentiles([r['lectura_ms'] for r in self.archivos]),
+            'espera': _percentiles([r['espera_ms'] for r in self.archivos]),
+            'proceso': _percentiles([r['proceso_ms'] for r in self.archivos if r['estado'] == 'convertido']),
+            'riesgo': {
+                'corridas': self.totales['riesgo'],
+                'latencia': _percentiles([r['latencia_ms'] for r in self.riesgo]),
+                'proceso': _percentiles([r['proceso_ms'] for r in self.riesgo])
+            }
+        }
+
+
+def calcular_riesgo_en(directorio_entrada, directorio_salida, teselas=False):
+    """
+    Corre calcular_riesgo() con las salidas en directorio_salida. Se ejecuta en un proceso del
+    pool, por eso cambia y restaura el directorio actual de ese proceso. Devuelve si terminó bien.
+    """
+    from calcular_riesgo import calcular_riesgo
+
+    anterior = os.getcwd()
+    os.chdir(directorio_salida)
+    try:
+        calcular_riesgo(teselas=teselas, workers=1, directorio_entrada=directorio_entrada)
+        return True
+    except Exception as e:
+        print(f"✗ Error calculando el riesgo: {str(e)}")
+        return False
+    finally:
+        os.chdir(anterior)
+
+
+class Ingesta:
+    """
+    Vigila la entrada (y opcionalmente el directorio de subidas) y procesa cada CSV nuevo o
+    modificado. Ver la descripción del módulo.
+    """
+
+    def __init__(self, entrada='.', salida=None, subidas=None, workers=None, lectores=LECTORES, teselas=False,
+                 riesgo=True, intervalo=INTERVALO, tamano_cola=TAMANO_COLA, config=CONFIG_AMENAZAS):
+        self.entrada = os.path.abspath(entrada)
+        self.salida = os.path.abspath(salida or entrada)
+        self.subidas = os.path.abspath(subidas) if subidas else None
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.lectores = max(1, lectores)
+        self.teselas = teselas
+        self.riesgo = riesgo
+        self.intervalo = intervalo
+        self.tamano_cola = tamano_cola
+        self.capas_riesgo = set(ARCHIVOS_CAPAS.values())
+        self.capas_subida = capas_declaradas(config)
+        # subidas ignoradas (se informan una sola vez)
+        self.rechazadas = set()
+
+        # ruta → (tamaño, mtime_ns): ya encolada con esa firma / vista en la revisión anterior
+        self.conocidos = {}
+        self.observados = {}
+        # rutas encoladas o en proceso (no se vuelven a encolar hasta terminar)
+        self.en_curso = set()
+        self.metricas = MetricasIngesta()
+
+    def _revisar(self, estable=True):
+        """
+        CSV nuevos o modificados de la entrada y de las subidas: lista de (ruta, es_subida, firma).
+        Con estable=True solo los que no cambiaron desde la revisión anterior.
+        """
+        candidatos = []
+        for directorio, es_subida in ((self.entrada, False), (self.subidas, True)):
+            if directorio is None or not os.path.isdir(directorio):
+                continue
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    if not entrada.name.endswith('.csv') or not entrada.is_file():
+                        continue
+                    if es_subida and not self._subida_aceptada(entrada.name):
+                        continue
+                    if not es_subida and entrada.name in IGNORADOS:
+                        continue
+
+                    stat = entrada.stat()
+                    firma = (stat.st_size, stat.st_mtime_ns)
+                    anterior = self.observados.get(entrada.path)
+                    self.observados[entrada.path] = firma
+                    if self.conocidos.get(entrada.path) == firma or entrada.path in self.en_curso:
+                        continue
+                    if estable and anterior != firma:
+                        # Puede estar escribiéndose todavía: se toma en la próxima revisión si no cambia
+                        continue
+                    candidatos.append((entrada.path, es_subida, firma))
+        return sorted(candidatos)
+
+    def _subida_aceptada(self, nombre):
+        """
+        Si la subida se publica: tiene el nombre de multer y su capa es una capa de entrada declarada.
+        """
+        coincidencia = PATRON_SUBIDA.match(nombre)
+        if coincidencia and coincidencia['capa'] + '.csv' in self.capas_subida:
+            return True
+        if nombre not in self.rechazadas:
+            self.rechazadas.add(nombre)
+            print(f"⚠️  Subida ignorada: {nombre} no corresponde a una capa de entrada declarada")
+        return False
+
+    def _entrada_de_subida(self, ruta):
+        return os.path.join(self.entrada, PATRON_SUBIDA.match(os.path.basename(ruta))['capa'] + '.csv')
+
+    def _leer(self, tarea):
+        """
+        Etapa de lectura (en un hilo): publica la subida en la entrada y calcula la huella del CSV.
+        """
+        inicio = time.perf_counter()
+        if tarea['subida']:
+            destino = self._entrada_de_subida(tarea['ruta'])
+            ruta_tmp = f'{destino}.{os.getpid()}.tmp'
+            shutil.copyfile(tarea['ruta'], ruta_tmp)
+            os.replace(ruta_tmp, destino)
+            stat = os.stat(destino)
+            tarea['publicada'] = (destino, (stat.st_size, stat.st_mtime_ns))
+
+        ruta = tarea['publicada'][0] if tarea['subida'] else tarea['ruta']
+        nombre = os.path.basename(ruta)
+        tarea['nombre'] = nombre
+        tarea['huella'] = huella_capa(ruta, self.teselas)
+        registro = cargar_manifiesto(self.salida).get('csv_to_jpeg', {}).get(nombre)
+        tarea['vigente'] = vigente(registro, tarea['huella'], self.salida)
+        tarea['lectura'] = time.perf_counter() - inicio
+        return tarea
+
+    def _riesgo_en_curso(self):
+        return any(os.path.dirname(ruta) == self.entrada and os.path.basename(ruta) in self.capas_riesgo
+                   for ruta in self.en_curso)
+
+    async def _escanear(self, una_vez):
+        loop = asyncio.get_running_loop()
+        while True:
+            candidatos = await loop.run_in_executor(self.hilos, self._revisar, not una_vez)
+            for ruta, es_subida, firma in candidatos:
+                self.conocidos[ruta] = firma
+                self.en_curso.add(ruta)
+                if es_subida:
+                    self.en_curso.add(self._entrada_de_subida(ruta))
+                # Los archivos que ya estaban al arrancar cuentan desde el arranque
+                modificado = max(firma[1] / 1e9, self.arranque)
+                await self.cola_lectura.put({'ruta': ruta, 'subida': es_subida, 'bytes': firma[0],
+                                             'modificado': modificado, 'detectado': time.perf_counter()})
+            if una_vez:
+                return
+            await asyncio.sleep(self.intervalo)
+
+    async def _lector(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            tarea = await self.cola_lectura.get()
+            try:
+                tarea = await loop.run_in_executor(self.hilos, self._leer, tarea)
+                if tarea['subida']:
+                    # La copia en la entrada ya está en proceso: que el escaneo no la encole otra vez
+                    destino, firma = tarea['publicada']
+                    self.conocidos[destino] = firma
+                tarea['leido'] = time.perf_counter()
+                await self.cola_proceso.put(tarea)
+            except Exception as e:
+                print(f"✗ Error leyendo {tarea['ruta']}: {str(e)}")
+                self._terminar(tarea, 'error', time.perf_counter())
+            finally:
+                self.cola_lectura.task_done()
+
+    async def _procesador(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            tarea = await self.cola_proceso.get()
+            estado = 'sin_cambios'
+            tarea['inicio_proceso'] = time.perf_counter()
+            try:
+                if not tarea['vigente']:
+                    _, info, _ = await loop.run_in_executor(self.pool, convert_csv_file, tarea['nombre'],
+                                                            self.entrada, self.salida, self.teselas)
+                    if info is None:
+                        estado = 'error'
+                    else:
+                        registrar_conversion(self.salida, tarea['nombre'], tarea['huella'], info)
+                        estado = 'convertido'
+                # Una capa sin cambios solo pide revisar el riesgo la primera vez (puede faltar o estar viejo)
+                if (self.riesgo and tarea['nombre'] in self.capas_riesgo
+                        and (estado == 'convertido' or (estado == 'sin_cambios' and not self.riesgo_revisado))):
+                    self._pedir_riesgo(tarea['modificado'])
+            except Exception as e:
+                print(f"✗ Error procesando {tarea['nombre']}: {str(e)}")
+                estado = 'error'
+            finally:
+                self._terminar(tarea, estado, time.perf_counter())
+                self.cola_proceso.task_done()
+
+    def _terminar(self, tarea, estado, publicado):
+        ahora = time.perf_counter()
+        leido = tarea.get('leido', ahora)
+        inicio_proceso = tarea.get('inicio_proceso', leido)
+        registro = {
+            'archivo': tarea.get('nombre', os.path.basename(tarea['ruta'])),
+            'estado': estado,
+            'bytes': tarea['bytes'],
+            # Desde la última modificación del CSV (incluye la espera hasta detectarlo)
+            'latencia_ms': round(max(0.0, time.time() - (ahora - publicado) - tarea['modificado']) * 1000, 3),
+            'lectura_ms': round(tarea.get('lectura', 0.0) * 1000, 3),
+            'espera_ms': round((inicio_proceso - leido) * 1000, 3),
+            'proceso_ms': round((publicado - inicio_proceso) * 1000, 3)
+        }
+        self.metricas.registrar_archivo(registro, tarea['detectado'], publicado)
+
+        self.en_curso.discard(tarea['ruta'])
+        if tarea['subida']:
+            self.en_curso.discard(self._entrada_de_subida(tarea['ruta']))
+        if not self._riesgo_en_curso():
+            self.capas_riesgo_listas.set()
+
+        simbolo = {'convertido': '✓', 'sin_cambios': '⏭️ ', 'error': '✗'}[estado]
+        print(f"{simbolo} {registro['archivo']}: {registro['latencia_ms'] / 1000:.2f} s de punta a punta "
+              f"(lectura {registro['lectura_ms'] / 1000:.2f} s, cola {registro['espera_ms'] / 1000:.2f} s, "
+              f"proceso {registro['proceso_ms'] / 1000:.2f} s)")
+        self.guardar_metricas()
+
+    def _pedir_riesgo(self, modificado):
+        # Momento de la modificación más antigua que todavía no está en el riesgo publicado
+        self.riesgo_desde = modificado if self.riesgo_desde is None else min(self.riesgo_desde, modificado)
+        self.hay_riesgo.set()
+
+    async def _calcular_riesgo(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.hay_riesgo.wait()
+            # Esperar a que terminen las demás capas de la fórmula que estén en proceso
+            while self._riesgo_en_curso():
+                self.capas_riesgo_listas.clear()
+                await self.capas_riesgo_listas.wait()
+
+            self.hay_riesgo.clear()
+            desde, self.riesgo_desde = self.riesgo_desde, None
+            self.riesgo_corriendo = True
+            inicio = time.perf_counter()
+            try:
+                correcto = await loop.run_in_executor(self.pool, calcular_riesgo_en, self.entrada, self.salida,
+                                                      self.teselas)
+            finally:
+                self.riesgo_corriendo = False
+            self.riesgo_revisado = True
+
+            publicado = time.perf_counter()
+            registro = {
+                'correcto': correcto,
+                'latencia_ms': round(max(0.0, time.time() - desde) * 1000, 3),
+                'proceso_ms': round((publicado - inicio) * 1000, 3)
+            }
+            self.metricas.registrar_riesgo(registro, publicado)
+            print(f"{'✓' if correcto else '✗'} riesgo: {registro['latencia_ms'] / 1000:.2f} s de punta a punta "
+                  f"(cálculo {registro['proceso_ms'] / 1000:.2f} s)")
+            self.guardar_metricas()
+
+    def guardar_metricas(self):
+        ruta = os.path.join(self.salida, ARCHIVO_METRICAS)
+        ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.metricas.resumen(), f, indent=2, ensure_ascii=False)
+        os.replace(ruta_tmp, ruta)
+
+    async def ejecutar(self, una_vez=False):
+        """
+        Corre la ingesta. Con una_vez=True procesa lo que haya pendiente (sin esperar a que los
+        archivos se estabilicen), espera el riesgo si hace falta y termina; si no, vigila hasta
+        que se cancele (Ctrl+C). Devuelve el resumen de métricas.
+        """
+        self.cola_lectura = asyncio.Queue(maxsize=self.tamano_cola)
+        self.cola_proceso = asyncio.Queue(maxsize=self.tamano_cola)
+        self.hay_riesgo = asyncio.Event()
+        self.capas_riesgo_listas = asyncio.Event()
+        self.capas_riesgo_listas.set()
+        self.riesgo_desde = None
+        self.riesgo_corriendo = False
+        self.riesgo_revisado = False
+        self.arranque = time.time()
+
+        os.makedirs(self.salida, exist_ok=True)
+        print(f"👀 Ingesta: {self.entrada}" + (f" + subidas en {self.subidas}" if self.subidas else "")
+              + f" → {self.salida} ({self.workers} procesos, {self.lectores} lectores)")
+
+        self.hilos = ThreadPoolExecutor(max_workers=self.lectores + 1)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        escaneo = asyncio.create_task(self._escanear(una_vez))
+        tareas = ([asyncio.create_task(self._lector()) for _ in range(self.lectores)]
+                  + [asyncio.create_task(self._procesador()) for _ in range(self.workers)]
+                  + [asyncio.create_task(self._calcular_riesgo())])
+        try:
+            if una_vez:
+                await escaneo
+                await self.cola_lectura.join()
+                await self.cola_proceso.join()
+                while self.hay_riesgo.is_set() or self.riesgo_corriendo:
+                    await asyncio.sleep(0.05)
+            else:
+                await asyncio.gather(escaneo, *tareas)
+        finally:
+            for tarea in [escaneo] + tareas:
+                tarea.cancel()
+            await asyncio.gather(escaneo, *tareas, return_exceptions=True)
+            self.pool.shutdown(cancel_futures=True)
+            self.hilos.shutdown(cancel_futures=True)
+            self.guardar_metricas()
+
+        return self.metricas.resumen()
+
+
+def mostrar_resumen(resumen):
+    print("\n" + "=" * 50)
+    print(f"📥 {resumen['archivos']} archivos ({resumen['convertidos']} convertidos, "
+          f"{resumen['sin_cambios']} sin cambios, {resumen['errores']} con error), {resumen['megabytes']} MB")
+    if resumen['archivos_por_segundo'] is not None:
+        print(f"⚡ Throughput: {resumen['archivos_por_segundo']} archivos/s, {resumen['mb_por_segundo']} MB/s "
+              f"en {resumen['segundos_activos']} s")
+    if resumen['latencia']:
+        print(f"⏱️  Latencia de punta a punta: p50 {resumen['latencia']['p50_ms'] / 1000:.2f} s, "
+              f"p95 {resumen['latencia']['p95_ms'] / 1000:.2f} s, máx {resumen['latencia']['max_ms'] / 1000:.2f} s")
+    if resumen['riesgo']['corridas']:
+        print(f"🧮 Riesgo: {resumen['riesgo']['corridas']} corridas, "
+              f"latencia p50 {resumen['riesgo']['latencia']['p50_ms'] / 1000:.2f} s")
+
+
+def ingestar(entrada='.', salida=None, subidas=None, workers=None, lectores=LECTORES, teselas=False, riesgo=True,
+             intervalo=INTERVALO, tamano_cola=TAMANO_COLA, una_vez=False):
+    """
+    Punto de entrada sincrónico: corre la ingesta con asyncio.run y muestra el resumen al terminar
+    (también al interrumpirla con Ctrl+C).
+    """
+    ingesta = Ingesta(entrada, salida, subidas, workers, lectores, teselas, riesgo, intervalo, tamano_cola)
+    try:
+        resumen = asyncio.run(ingesta.ejecutar(una_vez))
+    except KeyboardInterrupt:
+        resumen = ingesta.metricas.resumen()
+    mostrar_resumen(resumen)
+    return resumen
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from instrumentacion import activar
+
+    parser = argparse.ArgumentParser(description='Ingesta continua de capas CSV: conversión, riesgo y publicación atómica')
+    parser.add_argument('--entrada', default='.', help='directorio con los CSV de las capas (default: actual)')
+    parser.add_argument('--salida', default=None, help='directorio de las salidas (default: el de entrada)')
+    parser.add_argument('--subidas', default=None,
+                        help='directorio de subidas del backend (p. ej. ../../backend/uploads): cada '
+                             '<capa>-<marca>-<n>.csv de una capa declarada se publica en la entrada como <capa>.csv')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='procesos para convertir capas y calcular el riesgo (default: uno por núcleo)')
+    parser.add_argument('--lectores', type=int, default=LECTORES, help=f'hilos de lectura (default: {LECTORES})')
+    parser.add_argument('--teselas', action='store_true', help='generar también las pirámides de teselas')
+    parser.add_argument('--sin-riesgo', action='store_true', help='no recalcular el riesgo cuando cambia una capa')
+    parser.add_argument('--intervalo', type=float, default=INTERVALO,
+                        help=f'segundos entre revisiones del directorio (default: {INTERVALO})')
+    parser.add_argument('--tamano-cola', type=int, default=TAMANO_COLA,
+                        help=f'capacidad de cada cola entre etapas (default: {TAMANO_COLA})')
+    parser.add_argument('--una-vez', action='store_true', help='procesar lo pendiente y terminar')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por etapa y guardarlos en DIR')
+    args = parser.parse_args()
+    if args.instrumentar:
+        activar(args.instrumentar)
+
+    ingestar(args.entrada, args.salida, args.subidas, args.workers, args.lectores, args.teselas, not args.sin_riesgo,
+             args.intervalo, args.tamano_cola, args.una_vez)
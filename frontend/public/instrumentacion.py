@@ -0,0 +1,314 @@
+"""
+Instrumentación liviana por etapa para los scripts del pipeline raster.
+
+Cada etapa (lectura de capas, normalización, fórmula, escritura, renderizado, ...) se marca
+con un bloque `with etapa(...)` o con el decorador `medir(...)`, y registra:
+- tiempo de pared y tiempo de CPU del proceso
+- pico de memoria residente durante la etapa (VmHWM, que se reinicia al empezar cada etapa
+  escribiendo en /proc/self/clear_refs; si no se puede, el pico del proceso hasta ese momento)
+- bytes leídos y escritos por el proceso (rchar/wchar de /proc/self/io, incluye lo que
+  viene de la caché de páginas)
+- el archivo procesado, si la etapa es por archivo
+
+Desactivada (por defecto) `etapa()` devuelve siempre el mismo contexto nulo y `medir()`
+llama directamente a la función: el costo es una comparación por llamada.
+
+Se activa con la opción --instrumentar DIR de calcular_riesgo.py, csv_to_jpeg.py,
+csv_dimensions.py y pipeline.py, o con la variable de entorno RIESGO_INSTRUMENTACION=DIR.
+Al terminar el proceso principal se escriben:
+- DIR/instrumentacion.json: eventos y resumen por etapa
+- DIR/traza.json: formato Chrome trace-event (chrome://tracing o https://ui.perfetto.dev)
+
+Los procesos de los pools (ProcessPoolExecutor) heredan la activación; cada uno agrega sus
+eventos a DIR/.eventos/eventos-<pid>.jsonl y el proceso principal los reúne al exportar.
+Las etapas que corren en hilos (csv_dimensions.py) comparten los contadores del proceso,
+así que sus bytes y picos de memoria pueden incluir trabajo de otros hilos.
+
+Uso:
+    from instrumentacion import etapa, medir
+
+    with etapa('riesgo.formula'):
+        ...
+
+    @medir('render.archivo', argumento_archivo=0)
+    def convert_csv_file(csv_file, ...):
+        ...
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+VARIABLE_ENTORNO = 'RIESGO_INSTRUMENTACION'
+
+# Variables que hereda un proceso hijo lanzado con spawn: directorio de eventos y origen del reloj
+_VARIABLE_EVENTOS = 'RIESGO_INSTRUMENTACION_EVENTOS'
+_VARIABLE_ORIGEN = 'RIESGO_INSTRUMENTACION_ORIGEN'
+
+ARCHIVO_RESUMEN = 'instrumentacion.json'
+ARCHIVO_TRAZA = 'traza.json'
+
+_NULO = contextlib.nullcontext()
+
+# None = desactivada; si no, diccionario con pid principal, directorios, origen y eventos
+_estado = None
+_local = threading.local()
+
+
+def _leer_io():
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            campos = dict(linea.split(b':') for linea in f.read().splitlines())
+        return int(campos[b'rchar']), int(campos[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _pico_memoria_kb():
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for linea in f:
+                if linea.startswith(b'VmHWM:'):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss está en kB en Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reiniciar_pico():
+    """
+    Reinicia el pico de memoria residente del proceso (Linux >= 4.0). Devuelve si pudo.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def activa():
+    return _estado is not None
+
+
+def activar(directorio, exportar_al_salir=True):
+    """
+    Activa la instrumentación en este proceso y en los procesos hijos que lance.
+    Con exportar_al_salir, los archivos se escriben al terminar el proceso.
+    """
+    global _estado
+    if _estado is not None:
+        return
+
+    directorio = os.path.abspath(directorio)
+    eventos = os.path.join(directorio, '.eventos')
+    os.makedirs(eventos, exist_ok=True)
+    for archivo in os.listdir(eventos):
+        os.remove(os.path.join(eventos, archivo))
+
+    origen = time.perf_counter_ns()
+    _estado = {'pid': os.getpid(), 'directorio': directorio, 'eventos_dir': eventos, 'origen': origen,
+               'eventos': [], 'lock': threading.Lock(), 'reinicio_pico': _reiniciar_pico()}
+
+    os.environ[VARIABLE_ENTORNO] = directorio
+    os.environ[_VARIABLE_EVENTOS] = eventos
+    os.environ[_VARIABLE_ORIGEN] = str(origen)
+
+    if exportar_al_salir:
+        atexit.register(exportar)
+
+
+def _activar_hijo():
+    """
+    Estado de un proceso hijo lanzado con spawn: sus eventos van al directorio de eventos.
+    """
+    global _estado
+    _estado = {'pid': None, 'directorio': os.environ[VARIABLE_ENTORNO], 'eventos_dir': os.environ[_VARIABLE_EVENTOS],
+               'origen': int(os.environ[_VARIABLE_ORIGEN]), 'eventos': [], 'lock': threading.Lock(),
+               'reinicio_pico': _reiniciar_pico()}
+
+
+def _registrar(evento):
+    estado = _estado
+    if os.getpid() == estado['pid']:
+        with estado['lock']:
+            estado['eventos'].append(evento)
+    else:
+        # Proceso hijo (fork o spawn): una línea por evento en su propio archivo
+        ruta = os.path.join(estado['eventos_dir'], f'eventos-{os.getpid()}.jsonl')
+        with open(ruta, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(evento, ensure_ascii=False) + '\n')
+
+
+class _Etapa:
+    __slots__ = ('nombre', 'datos', 'inicio', 'cpu', 'io', 'pico')
+
+    def __init__(self, nombre, datos):
+        self.nombre = nombre
+        self.datos = datos
+
+    def __enter__(self):
+        pila = getattr(_local, 'pila', None)
+        if pila is None:
+            pila = _local.pila = []
+
+        # El pico hasta ahora pertenece a las etapas abiertas; después se reinicia para esta
+        pico = _pico_memoria_kb()
+        for abierta in pila:
+            abierta.pico = max(abierta.pico, pico)
+        if _estado['reinicio_pico']:
+            _reiniciar_pico()
+        self.pico = _pico_memoria_kb()
+        pila.append(self)
+
+        self.io = _leer_io()
+        self.cpu = time.process_time_ns()
+        self.inicio = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        fin = time.perf_counter_ns()
+        cpu = time.process_time_ns()
+        leidos, escritos = _leer_io()
+        self.pico = max(self.pico, _pico_memoria_kb())
+
+        pila = _local.pila
+        pila.pop()
+        for abierta in pila:
+            abierta.pico = max(abierta.pico, self.pico)
+
+        evento = {
+            'nombre': self.nombre,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'inicio_us': (self.inicio - _estado['origen']) // 1000,
+            'duracion_us': (fin - self.inicio) // 1000,
+            'cpu_us': (cpu - self.cpu) // 1000,
+            'pico_memoria_mb': round(self.pico / 1024, 1),
+            'bytes_leidos': leidos - self.io[0] if leidos is not None else None,
+            'bytes_escritos': escritos - self.io[1] if escritos is not None else None,
+            'error': tipo.__name__ if tipo is not None else None
+        }
+        evento.update(self.datos)
+        _registrar(evento)
+        return False
+
+
+def etapa(nombre, archivo=None, **datos):
+    """
+    Contexto que mide una etapa. Desactivada la instrumentación, no hace nada.
+    """
+    if _estado is None:
+        return _NULO
+    if archivo is not None:
+        datos['archivo'] = os.path.basename(str(archivo))
+    return _Etapa(nombre, datos)
+
+
+def medir(nombre, argumento_archivo=None):
+    """
+    Decorador que mide cada llamada a la función como una etapa. Con argumento_archivo
+    (índice del argumento posicional) el evento registra ese archivo.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if _estado is None:
+                return funcion(*args, **kwargs)
+            archivo = args[argumento_archivo] if argumento_archivo is not None and len(args) > argumento_archivo else None
+            with etapa(nombre, archivo):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def eventos():
+    """
+    Eventos del proceso principal y de los procesos hijos, ordenados por inicio.
+    """
+    todos = list(_estado['eventos'])
+    directorio = _estado['eventos_dir']
+    if os.path.isdir(directorio):
+        for archivo in sorted(os.listdir(directorio)):
+            with open(os.path.join(directorio, archivo), 'r', encoding='utf-8') as f:
+                todos.extend(json.loads(linea) for linea in f if linea.strip())
+    return sorted(todos, key=lambda e: e['inicio_us'])
+
+
+def resumen(lista):
+    """
+    Totales por etapa: cantidad, segundos de pared y de CPU, pico de memoria y bytes.
+    """
+    totales = {}
+    for evento in lista:
+        total = totales.setdefault(evento['nombre'], {'cantidad': 0, 'segundos': 0.0, 'cpu_segundos': 0.0,
+                                                       'pico_memoria_mb': 0.0, 'bytes_leidos': 0,
+                                                       'bytes_escritos': 0})
+        total['cantidad'] += 1
+        total['segundos'] += evento['duracion_us'] / 1e6
+        total['cpu_segundos'] += evento['cpu_us'] / 1e6
+        total['pico_memoria_mb'] = max(total['pico_memoria_mb'], evento['pico_memoria_mb'])
+        total['bytes_leidos'] += evento['bytes_leidos'] or 0
+        total['bytes_escritos'] += evento['bytes_escritos'] or 0
+    for total in totales.values():
+        total['segundos'] = round(total['segundos'], 6)
+        total['cpu_segundos'] = round(total['cpu_segundos'], 6)
+    return totales
+
+
+def traza_chrome(lista):
+    """
+    Eventos en el formato Chrome trace-event (eventos completos 'X', tiempos en microsegundos).
+    """
+    campos_propios = ('nombre', 'pid', 'tid', 'inicio_us', 'duracion_us')
+    traza = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f'pid {pid}'}}
+             for pid in sorted({e['pid'] for e in lista})]
+    for evento in lista:
+        traza.append({
+            'name': evento['nombre'] + (f" {evento['archivo']}" if evento.get('archivo') else ''),
+            'cat': evento['nombre'].split('.', 1)[0],
+            'ph': 'X',
+            'ts': evento['inicio_us'],
+            'dur': evento['duracion_us'],
+            'pid': evento['pid'],
+            'tid': evento['tid'],
+            'args': {clave: valor for clave, valor in evento.items() if clave not in campos_propios}
+        })
+    return {'traceEvents': traza, 'displayTimeUnit': 'ms'}
+
+
+def _guardar_json(ruta, datos):
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+
+
+def exportar():
+    """
+    Escribe instrumentacion.json y traza.json en el directorio de la instrumentación.
+    Solo lo hace el proceso que la activó. Devuelve la ruta del resumen o None.
+    """
+    if _estado is None or os.getpid() != _estado['pid']:
+        return None
+
+    lista = eventos()
+    directorio = _estado['directorio']
+    ruta_resumen = os.path.join(directorio, ARCHIVO_RESUMEN)
+    _guardar_json(ruta_resumen, {'etapas': resumen(lista), 'eventos': lista})
+    _guardar_json(os.path.join(directorio, ARCHIVO_TRAZA), traza_chrome(lista))
+    print(f"Instrumentación: {len(lista)} eventos → {ruta_resumen}, {os.path.join(directorio, ARCHIVO_TRAZA)}")
+    return ruta_resumen
+
+
+if os.environ.get(VARIABLE_ENTORNO):
+    if os.environ.get(_VARIABLE_EVENTOS):
+        _activar_hijo()
+    else:
+        activar(os.environ[VARIABLE_ENTORNO])
@@ -0,0 +1,110 @@
+"""
+Manifiesto de construcción para regenerar solo las salidas cuyas entradas cambiaron.
+
+El manifiesto (build_manifest.json, junto a conversion_summary.json) guarda, por
+cada salida, una huella con los hashes de los archivos de entrada, la versión
+del código que la genera y los parámetros usados. Si la huella coincide con la
+de la ejecución anterior y todos los archivos de salida existen, la salida se
+considera vigente y no se vuelve a generar.
+
+Estructura:
+    {
+      "version": 1,
+      "csv_to_jpeg": {"flood.csv": {"huella": {...}, "salidas": [...], "resultado": {...}}},
+      "calcular_riesgo": {"riesgo": {"huella": {...}, "salidas": [...]}}
+    }
+"""
+
+import contextlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # fcntl no existe en Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from capas import hash_archivo, hash_capa
+
+MANIFIESTO = 'build_manifest.json'
+MANIFIESTO_VERSION = 1
+
+
+def cargar_manifiesto(directorio='.'):
+    """
+    Lee el manifiesto del directorio; devuelve uno vacío si no existe o es de otra versión.
+    """
+    ruta = os.path.join(directorio, MANIFIESTO)
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        manifiesto = None
+
+    if not manifiesto or manifiesto.get('version') != MANIFIESTO_VERSION:
+        manifiesto = {'version': MANIFIESTO_VERSION}
+
+    return manifiesto
+
+
+@contextlib.contextmanager
+def _bloqueo(directorio):
+    """
+    Bloqueo exclusivo entre procesos del manifiesto del directorio (build_manifest.json.lock),
+    para que dos escrituras simultáneas (p. ej. en el modo de ingesta) no pierdan una sección.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directorio, f'{MANIFIESTO}.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def guardar_seccion(directorio, seccion, entradas, combinar=False):
+    """
+    Reemplaza una sección del manifiesto (p. ej. 'csv_to_jpeg') y lo guarda de forma atómica.
+    Se vuelve a leer el archivo para no pisar la sección que escribe el otro script.
+    Con combinar=True las entradas se agregan a las que ya tiene la sección.
+    """
+    with _bloqueo(directorio):
+        manifiesto = cargar_manifiesto(directorio)
+        manifiesto[seccion] = {**manifiesto.get(seccion, {}), **entradas} if combinar else entradas
+
+        ruta = os.path.join(directorio, MANIFIESTO)
+        ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+        os.replace(ruta_tmp, ruta)
+
+
+def huella_codigo(*rutas_fuente):
+    """
+    Hash combinado de los archivos de código que generan una salida: si cambia el script
+    (fórmula, colores, renderizado), cambia la huella.
+    """
+    return {os.path.basename(ruta): hash_archivo(ruta) for ruta in rutas_fuente}
+
+
+def huella(entradas, codigo, parametros):
+    """
+    Arma la huella de una salida: hashes de las entradas, del código y los parámetros.
+    """
+    return {
+        'entradas': {os.path.basename(ruta): hash_capa(ruta) for ruta in entradas},
+        'codigo': codigo,
+        'parametros': parametros
+    }
+
+
+def vigente(registro, huella_actual, directorio='.'):
+    """
+    Indica si un registro del manifiesto corresponde a la huella actual y sus salidas existen.
+    """
+    if not registro or registro.get('huella') != huella_actual:
+        return False
+    return all(os.path.exists(os.path.join(directorio, salida)) for salida in registro.get('salidas', []))
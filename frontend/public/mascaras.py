@@ -0,0 +1,136 @@
+"""
+Máscaras binarias empaquetadas en bits para las capas 0/1 (water, urban, áreas protegidas).
+
+Las tres máscaras de la fórmula solo valen 0 o 1, pero el factor water * (1 - urban) * area_protegida
+se evaluaba como producto de flotantes celda por celda. MascaraBits guarda una máscara con 8 celdas
+por byte (np.packbits por filas, 1/8 de la capa uint8 y 1/64 de una grilla float64) y opera
+byte a byte sobre los bits empaquetados:
+
+    valido = MascaraBits.desde_matriz(water) & ~MascaraBits.desde_matriz(urban) & MascaraBits.desde_matriz(area)
+
+da en bits exactamente las celdas donde el factor vale 1. Para aplicarla a una matriz densa se
+desempaquetan solo las filas de cada bloque (desempaquetar / aplicar), así nunca se arma la máscara
+completa en bool ni en flotante.
+
+Los bits de relleno del último byte de cada fila (cuando las columnas no son múltiplo de 8)
+quedan siempre en 0, también después de ~, así contar() y la comparación entre máscaras son exactas.
+"""
+
+import numpy as np
+
+# Filas empaquetadas por bloque al leer una capa (acota los temporales sobre memory-maps)
+FILAS_POR_BLOQUE = 1024
+
+# Cantidad de bits en 1 de cada byte posible
+_UNOS_POR_BYTE = np.array([bin(valor).count('1') for valor in range(256)], dtype=np.uint8)
+
+
+def es_binaria(meta):
+    """
+    Indica si una capa es una máscara 0/1 según sus metadatos (dtype entero, mínimo y máximo en {0, 1}).
+    """
+    return np.dtype(meta['dtype']).kind in 'iub' and meta['min'] >= 0 and meta['max'] <= 1
+
+
+class MascaraBits:
+    """
+    Máscara booleana de filas x columnas con 8 celdas por byte (bits en orden big-endian por fila).
+    """
+
+    def __init__(self, bits, columnas):
+        self.bits = bits
+        self.columnas = columnas
+
+    @classmethod
+    def desde_matriz(cls, matriz, filas_por_bloque=FILAS_POR_BLOQUE):
+        """
+        Empaqueta las celdas distintas de 0 de la matriz, por bloques de filas.
+        """
+        filas, columnas = matriz.shape
+        bits = np.empty((filas, -(-columnas // 8)), dtype=np.uint8)
+        for inicio in range(0, filas, filas_por_bloque):
+            bloque = np.asarray(matriz[inicio:inicio + filas_por_bloque])
+            bits[inicio:inicio + filas_por_bloque] = np.packbits(bloque != 0, axis=1)
+        return cls(bits, columnas)
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.columnas
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _relleno(self):
+        # Byte con los bits válidos de la última columna empaquetada (los de relleno en 0)
+        sobrantes = -self.columnas % 8
+        return np.uint8((0xFF << sobrantes) & 0xFF)
+
+    def _compatible(self, otra):
+        if self.shape != otra.shape:
+            raise ValueError(f"Máscaras de distinta forma: {self.shape} y {otra.shape}")
+
+    def __and__(self, otra):
+        self._compatible(otra)
+        return MascaraBits(np.bitwise_and(self.bits, otra.bits), self.columnas)
+
+    def __or__(self, otra):
+        self._compatible(otra)
+        return MascaraBits(np.bitwise_or(self.bits, otra.bits), self.columnas)
+
+    def __invert__(self):
+        bits = np.invert(self.bits)
+        if self.columnas % 8:
+            bits[:, -1] &= self._relleno()
+        return MascaraBits(bits, self.columnas)
+
+    def __eq__(self, otra):
+        return isinstance(otra, MascaraBits) and self.shape == otra.shape and np.array_equal(self.bits, otra.bits)
+
+    def __getitem__(self, filas):
+        """
+        Filas de la máscara (slice) como otra MascaraBits, sin copiar.
+        """
+        if not isinstance(filas, slice):
+            raise TypeError("MascaraBits solo admite recortes de filas (slice)")
+        return MascaraBits(self.bits[filas], self.columnas)
+
+    def recortar(self, filas, columnas):
+        """
+        Primeras `filas` x `columnas` celdas. Recortar columnas que no caen en un límite de byte
+        reempaqueta la máscara.
+        """
+        if columnas == self.columnas:
+            return MascaraBits(self.bits[:filas], columnas)
+        bits = self.bits[:filas, :-(-columnas // 8)].copy()
+        if columnas % 8:
+            bits[:, -1] &= np.uint8((0xFF << (-columnas % 8)) & 0xFF)
+        return MascaraBits(bits, columnas)
+
+    def contar(self):
+        """
+        Cantidad de celdas en 1.
+        """
+        return int(_UNOS_POR_BYTE[self.bits].sum(dtype=np.int64))
+
+    def desempaquetar(self, inicio=0, fin=None):
+        """
+        Filas [inicio, fin) como matriz bool densa.
+        """
+        return np.unpackbits(self.bits[inicio:fin], axis=1, count=self.columnas).view(bool)
+
+    def aplicar(self, densa, relleno=0, out=None, filas_por_bloque=FILAS_POR_BLOQUE):
+        """
+        Copia de `densa` con `relleno` en las celdas donde la máscara vale 0, desempaquetando por
+        bloques de filas. Con out=densa la modifica en el lugar.
+        """
+        if densa.shape != self.shape:
+            raise ValueError(f"La matriz {densa.shape} no tiene la forma de la máscara {self.shape}")
+        if out is None:
+            out = np.array(densa)
+        elif out is not densa:
+            np.copyto(out, densa)
+        for inicio in range(0, self.shape[0], filas_por_bloque):
+            fin = min(inicio + filas_por_bloque, self.shape[0])
+            np.copyto(out[inicio:fin], relleno, where=~self.desempaquetar(inicio, fin))
+        return out
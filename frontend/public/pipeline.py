@@ -0,0 +1,257 @@
+"""
+Punto de entrada único del pipeline raster, con subcomandos y rutas explícitas.
+
+Subcomandos:
+    dims    Dimensiones de los CSV de un directorio (csv_dimensions.py)
+    render  Conversión de las capas CSV a JPEG y teselas (csv_to_jpeg.py)
+    risk    Cálculo del mapa de riesgo (calcular_riesgo.py)
+    sweep   Barrido de escenarios de pesos y rangos de la fórmula (escenarios.py)
+    hazards Amenazas declaradas en una configuración, en una sola pasada (formulas.py)
+    region  Riesgo de una región de interés: polígono GeoJSON o rectángulo (region.py)
+    zones   Estadísticas del riesgo por polígono: departamentos, áreas protegidas (zonas.py)
+    watch   Ingesta continua: convierte cada CSV nuevo o modificado y recalcula el riesgo (ingesta.py)
+
+Cada subcomando importa solo los módulos de su etapa: `risk --solo-calculo` no
+importa Pillow, pandas ni el exportador CSV, y `dims` solo importa pandas con --pandas.
+Pensado para invocaciones programadas (cron) que no necesitan renderizar.
+
+Uso:
+    python pipeline.py dims [--entrada DIR] [--salida csv_dimensions.json] [--pandas] [--workers N]
+    python pipeline.py render [--entrada DIR] [--salida DIR] [--workers N] [--forzar] [--teselas]
+    python pipeline.py risk [--entrada DIR] [--salida DIR] [--solo-calculo] [--por-bandas] [...]
+    python pipeline.py sweep [--entrada DIR] (--tabla escenarios.csv | --pesos 0.3,0.5 --rangos 1:10,0:10) [...]
+    python pipeline.py hazards [--config amenazas.json] [--entrada DIR] [--salida amenazas] [--amenazas a,b]
+    python pipeline.py region [--entrada DIR] [--salida DIR] [--geojson ContornoCba.geojson] [--bbox-geo=...]
+    python pipeline.py zones --geojson departamentos.geojson [--riesgo riesgo.npy] [--salida zonas.json]
+    python pipeline.py watch [--entrada DIR] [--salida DIR] [--subidas ../../backend/uploads] [--una-vez]
+"""
+
+import argparse
+import os
+import sys
+
+
+def comando_dims(args):
+    from csv_dimensions import get_csv_dimensions
+
+    dimensiones = get_csv_dimensions(args.entrada, rapido=not args.pandas, workers=args.workers,
+                                     json_filename=args.salida)
+    return 0 if dimensiones else 1
+
+
+def comando_render(args):
+    from csv_to_jpeg import process_csv_files
+
+    resultados = process_csv_files(args.entrada, args.salida, args.workers, args.forzar, args.teselas)
+    return 0 if resultados else 1
+
+
+def comando_risk(args):
+    import calcular_riesgo
+    from alineacion import leer_grilla
+    from histograma import leer_estiramiento
+
+    # Las salidas de calcular_riesgo.py (y su manifiesto) se escriben en el directorio actual
+    entrada = os.path.abspath(args.entrada)
+    if args.grilla and os.path.exists(args.grilla):
+        args.grilla = os.path.abspath(args.grilla)
+    os.makedirs(args.salida, exist_ok=True)
+    os.chdir(args.salida)
+
+    csv = not (args.sin_csv or args.solo_calculo)
+    generar_jpeg = not (args.sin_jpeg or args.solo_calculo)
+    formato_csv = {'precision': args.csv_precision, 'enteros': args.csv_enteros}
+    grilla = leer_grilla(args.grilla) if args.grilla else None
+    estiramiento = leer_estiramiento(args.estiramiento) if args.estiramiento else None
+
+    if args.por_bandas:
+        calcular_riesgo.calcular_riesgo_por_bandas(args.filas_por_banda, generar_jpeg, args.forzar, args.teselas,
+                                                   args.workers, csv, formato_csv, directorio_entrada=entrada,
+                                                   incremental=not args.completo, grilla=grilla,
+                                                   estiramiento=estiramiento)
+    else:
+        calcular_riesgo.calcular_riesgo(args.forzar, args.metodo, args.teselas, args.workers, csv, formato_csv,
+                                        generar_jpeg, directorio_entrada=entrada, incremental=not args.completo,
+                                        grilla=grilla, estiramiento=estiramiento)
+    return 0
+
+
+def comando_sweep(args):
+    import escenarios
+
+    if args.tabla:
+        tabla = escenarios.leer_escenarios(args.tabla)
+    else:
+        pesos = escenarios.leer_pesos(args.pesos) if args.pesos else [escenarios.PESO_AMENAZAS]
+        rangos = escenarios.leer_rangos(args.rangos) if args.rangos else [escenarios.RANGO_LANDSLIDE]
+        tabla = escenarios.grilla_escenarios(pesos, rangos)
+
+    resultados = escenarios.barrer_escenarios(tabla, args.entrada, args.workers, args.escenarios_por_lote,
+                                              directorio_rasters=args.rasters)
+    escenarios.guardar_resultados(resultados, args.salida)
+    print(f"{len(resultados)} escenarios evaluados → {args.salida}")
+    return 0
+
+
+def comando_hazards(args):
+    from alineacion import leer_grilla
+    from formulas import CONFIG_AMENAZAS, evaluar_amenazas
+
+    grilla = leer_grilla(args.grilla) if args.grilla else None
+    evaluar_amenazas(args.config or CONFIG_AMENAZAS, args.entrada, args.salida, args.amenazas.split(',') if args.amenazas else None,
+                     grilla, args.csv, args.workers, args.forzar, mostrar_plan=args.mostrar_plan)
+    return 0
+
+
+def comando_region(args):
+    import region
+
+    bbox_geo = region.leer_bbox(args.bbox_geo) if args.bbox_geo else None
+    bbox_pixeles = [int(v) for v in region.leer_bbox(args.bbox_pixeles)] if args.bbox_pixeles else None
+    region.calcular_riesgo_region(args.geojson, bbox_pixeles, bbox_geo, args.entrada, args.salida,
+                                  generar_jpeg=not args.sin_jpeg)
+    return 0
+
+
+def comando_zones(args):
+    from zonas import calcular_zonas
+
+    calcular_zonas(args.geojson, args.riesgo, args.salida, args.campo_nombre)
+    return 0
+
+
+def comando_watch(args):
+    from ingesta import ingestar
+
+    resumen = ingestar(args.entrada, args.salida, args.subidas, args.workers, args.lectores, args.teselas,
+                       not args.sin_riesgo, args.intervalo, args.tamano_cola, args.una_vez)
+    return 1 if resumen['errores'] else 0
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description='Pipeline raster: dimensiones, renderizado y cálculo de riesgo')
+    parser.add_argument('--instrumentar', metavar='DIR', default=None,
+                        help='medir tiempo, CPU, memoria y E/S por etapa y guardarlos en DIR (antes del subcomando)')
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    dims = subparsers.add_parser('dims', help='dimensiones de los CSV de un directorio')
+    dims.add_argument('--entrada', default='.', help='directorio con los CSV (default: actual)')
+    dims.add_argument('--salida', default='csv_dimensions.json',
+                      help='archivo JSON de salida (default: csv_dimensions.json)')
+    dims.add_argument('--pandas', action='store_true',
+                      help='parsear cada CSV completo en lugar de sondear los bytes')
+    dims.add_argument('--workers', type=int, default=None, help='hilos para revisar archivos en paralelo')
+    dims.set_defaults(funcion=comando_dims)
+
+    render = subparsers.add_parser('render', help='convertir las capas CSV a JPEG')
+    render.add_argument('--entrada', default='.', help='directorio con los CSV (default: actual)')
+    render.add_argument('--salida', default='.', help='directorio de las imágenes (default: actual)')
+    render.add_argument('--workers', type=int, default=None,
+                        help='procesos para convertir archivos en paralelo (default: uno por núcleo)')
+    render.add_argument('--forzar', action='store_true',
+                        help='regenerar todas las imágenes aunque sus CSV no hayan cambiado')
+    render.add_argument('--teselas', action='store_true', help='generar también la pirámide de teselas XYZ')
+    render.set_defaults(funcion=comando_render)
+
+    risk = subparsers.add_parser('risk', help='calcular el mapa de riesgo')
+    risk.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    risk.add_argument('--salida', default='.', help='directorio de los resultados (default: actual)')
+    risk.add_argument('--solo-calculo', action='store_true',
+                      help='solo calcular y guardar riesgo.npy y riesgo_almacen/ (sin CSV, JPEG ni Pillow)')
+    risk.add_argument('--sin-csv', action='store_true', help='no exportar riesgo.csv')
+    risk.add_argument('--sin-jpeg', action='store_true', help='no generar riesgo.jpeg ni riesgo_scale.json')
+    risk.add_argument('--teselas', action='store_true', help='generar también la pirámide de teselas XYZ')
+    risk.add_argument('--por-bandas', action='store_true',
+                      help='procesar la grilla por bandas de filas con memoria acotada')
+    risk.add_argument('--filas-por-banda', type=int, default=256,
+                      help='cantidad de filas por banda en el modo por bandas (default: 256)')
+    risk.add_argument('--metodo', choices=['fusionado', 'clasico'], default='fusionado',
+                      help='camino de cálculo en memoria (default: fusionado)')
+    risk.add_argument('--csv-precision', type=int, default=None, help='decimales fijos en riesgo.csv')
+    risk.add_argument('--csv-enteros', action='store_true', help='escribir sin decimales los valores enteros')
+    risk.add_argument('--workers', type=int, default=None,
+                      help='procesos para escribir riesgo.csv y codificar las teselas (default: uno por núcleo)')
+    risk.add_argument('--forzar', action='store_true',
+                      help='recalcular aunque las entradas y la fórmula no hayan cambiado')
+    risk.add_argument('--completo', action='store_true',
+                      help='recalcular toda la grilla aunque solo hayan cambiado algunas teselas de las capas')
+    risk.add_argument('--grilla', default=None,
+                      help="grilla destino 'FILASxCOLUMNAS' o JSON: remuestrear las capas en lugar de recortarlas")
+    risk.add_argument('--estiramiento', metavar='BAJO,ALTO', default=None,
+                      help='estirar el gradiente de riesgo.jpeg entre dos percentiles (p. ej. 2,98)')
+    risk.set_defaults(funcion=comando_risk)
+
+    sweep = subparsers.add_parser('sweep', help='evaluar muchos escenarios de pesos y rangos de la fórmula')
+    sweep.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    sweep.add_argument('--tabla', default=None, help='tabla de escenarios (CSV con encabezado o JSON)')
+    sweep.add_argument('--pesos', default=None, help='pesos separados por comas para armar la grilla de escenarios')
+    sweep.add_argument('--rangos', default=None, help='rangos de landslide min:max separados por comas (p. ej. 1:10,0:10)')
+    sweep.add_argument('--salida', default='escenarios.json',
+                       help='estadísticas por escenario, .json o .csv (default: escenarios.json)')
+    sweep.add_argument('--rasters', default=None, help='directorio donde guardar la matriz de cada escenario (.npy)')
+    sweep.add_argument('--workers', type=int, default=None,
+                       help='procesos entre los que repartir los lotes de escenarios (default: uno por núcleo)')
+    sweep.add_argument('--escenarios-por-lote', type=int, default=32,
+                       help='escenarios evaluados juntos en cada pasada (default: 32)')
+    sweep.set_defaults(funcion=comando_sweep)
+
+    hazards = subparsers.add_parser('hazards', help='evaluar las amenazas declaradas en una configuración')
+    hazards.add_argument('--config', default=None, help='configuración de capas y amenazas (default: amenazas.json)')
+    hazards.add_argument('--entrada', default='.', help='directorio con los CSV de las capas (default: actual)')
+    hazards.add_argument('--salida', default='amenazas', help='directorio de las salidas (default: amenazas)')
+    hazards.add_argument('--amenazas', default=None, help='amenazas separadas por comas (default: todas)')
+    hazards.add_argument('--csv', action='store_true', help='exportar también <amenaza>.csv')
+    hazards.add_argument('--grilla', default=None,
+                         help="grilla destino 'FILASxCOLUMNAS' o JSON: remuestrear las capas en lugar de recortarlas")
+    hazards.add_argument('--workers', type=int, default=None, help='procesos para escribir los CSV')
+    hazards.add_argument('--forzar', action='store_true', help='recalcular aunque nada haya cambiado')
+    hazards.add_argument('--mostrar-plan', action='store_true', help='mostrar las operaciones del plan compilado')
+    hazards.set_defaults(funcion=comando_hazards)
+
+    roi = subparsers.add_parser('region', help='calcular el riesgo solo en una región de interés')
+    roi.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    roi.add_argument('--salida', default='riesgo_region', help='directorio de salida (default: riesgo_region)')
+    roi.add_argument('--geojson', default=None, help='polígono de la región (p. ej. ContornoCba.geojson)')
+    roi.add_argument('--bbox-geo', default=None, help='rectángulo min_lon,min_lat,max_lon,max_lat')
+    roi.add_argument('--bbox-pixeles', default=None, help='rectángulo fila_inicio,fila_fin,columna_inicio,columna_fin')
+    roi.add_argument('--sin-jpeg', action='store_true', help='no generar riesgo.jpeg de la región')
+    roi.set_defaults(funcion=comando_region)
+
+    zones = subparsers.add_parser('zones', help='estadísticas del riesgo por polígono')
+    zones.add_argument('--geojson', required=True, help='capa de polígonos (una zona por Feature)')
+    zones.add_argument('--riesgo', default='riesgo.npy',
+                       help='riesgo.npy, directorio riesgo_almacen o riesgo.csv (default: riesgo.npy)')
+    zones.add_argument('--salida', default='zonas.json', help='archivo de salida .json o .csv (default: zonas.json)')
+    zones.add_argument('--campo-nombre', default=None, help='propiedad del GeoJSON con el nombre de cada zona')
+    zones.set_defaults(funcion=comando_zones)
+
+    watch = subparsers.add_parser('watch', help='vigilar las capas y publicar sus salidas a medida que cambian')
+    watch.add_argument('--entrada', default='.', help='directorio con los CSV de las capas (default: actual)')
+    watch.add_argument('--salida', default=None, help='directorio de las salidas (default: el de entrada)')
+    watch.add_argument('--subidas', default=None,
+                       help='directorio de subidas del backend: cada <capa>-<marca>-<n>.csv se publica como <capa>.csv')
+    watch.add_argument('--workers', type=int, default=None,
+                       help='procesos para convertir capas y calcular el riesgo (default: uno por núcleo)')
+    watch.add_argument('--lectores', type=int, default=2, help='hilos de lectura (default: 2)')
+    watch.add_argument('--teselas', action='store_true', help='generar también las pirámides de teselas')
+    watch.add_argument('--sin-riesgo', action='store_true', help='no recalcular el riesgo cuando cambia una capa')
+    watch.add_argument('--intervalo', type=float, default=1.0,
+                       help='segundos entre revisiones del directorio (default: 1)')
+    watch.add_argument('--tamano-cola', type=int, default=8, help='capacidad de cada cola entre etapas (default: 8)')
+    watch.add_argument('--una-vez', action='store_true', help='procesar lo pendiente y terminar')
+    watch.set_defaults(funcion=comando_watch)
+
+    return parser
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    if args.instrumentar:
+        from instrumentacion import activar
+
+        activar(args.instrumentar)
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
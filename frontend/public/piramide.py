@@ -0,0 +1,321 @@
+"""
+Pirámide de vistas reducidas y teselas XYZ para los mapas raster.
+
+A partir de la matriz a resolución completa se construyen niveles reducidos a la mitad
+hasta que la grilla entra en una sola tesela, y cada nivel se corta en teselas de
+256x256 píxeles con la misma LUT que la imagen completa (ver renderizado.py):
+
+    teselas/<capa>/{z}/{x}/{y}.jpeg
+    teselas/<capa>/teselas.json   (índice: niveles, tamaño, plantilla y límites geográficos)
+
+El nivel z = zoom_max es la resolución completa y z = 0 la vista más reducida; x es la
+columna y y la fila de la tesela contando desde arriba a la izquierda (esquema XYZ en
+píxeles, apto para Leaflet con L.CRS.Simple). Las teselas del borde se completan con el
+código de relleno hasta 256x256.
+
+Métodos de reducción (bloques de 2x2):
+- 'media': promedio de los valores; con `especiales` (p. ej. 0 y 99 en el riesgo) el
+  bloque toma el valor especial cuando ese valor es mayoría en el bloque y si no el
+  promedio de los valores restantes, para no mezclar "sin dato" con valores reales.
+- 'moda': valor más frecuente del bloque, para capas categóricas (enteras).
+
+Si cambia solo una parte de la matriz, actualizar_piramide() regenera únicamente las teselas
+de cada nivel que cubren las ventanas modificadas.
+
+Uso:
+    from piramide import generar_piramide
+    indice = generar_piramide(matriz, cuantizar, lut, 'teselas/riesgo', metodo='media', especiales=(0, 99))
+"""
+
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+TAMANO_TESELA = 256
+
+# Archivo índice de cada pirámide
+INDICE_TESELAS = 'teselas.json'
+
+# Límites geográficos de la grilla (frontend/src/constants/geographicBounds.js)
+LIMITES_GEOGRAFICOS = {
+    'min_lat': -35.1,
+    'max_lat': -29.4,
+    'min_lon': -66.0,
+    'max_lon': -61.7
+}
+
+# Filas de salida reducidas por bloque (acota los temporales sobre memory-maps)
+FILAS_POR_BLOQUE = 512
+
+
+def _bloques_2x2(banda):
+    """
+    Reordena una banda de filas pares en bloques de 2x2: devuelve una vista (filas/2, columnas/2, 4).
+    Las filas/columnas impares se completan repitiendo el borde, lo que no altera
+    la media ni la moda del bloque incompleto (cada valor real queda repetido igual cantidad de veces).
+    """
+    filas, columnas = banda.shape
+    if filas % 2 or columnas % 2:
+        banda = np.pad(banda, ((0, filas % 2), (0, columnas % 2)), mode='edge')
+    f2, c2 = banda.shape[0] // 2, banda.shape[1] // 2
+    return banda.reshape(f2, 2, c2, 2).transpose(0, 2, 1, 3).reshape(f2, c2, 4)
+
+
+def reducir_media(matriz, especiales=()):
+    """
+    Reduce la matriz a la mitad promediando bloques de 2x2 (en float32).
+    Los valores de `especiales` no se promedian: si uno de ellos es mayoría estricta
+    del bloque frente a los demás grupos el bloque lo conserva; si no, se promedian los valores restantes.
+    """
+    filas, columnas = matriz.shape
+    salida = np.empty((-(-filas // 2), -(-columnas // 2)), dtype=np.float32)
+
+    for inicio in range(0, salida.shape[0], FILAS_POR_BLOQUE):
+        banda = np.asarray(matriz[2 * inicio:2 * (inicio + FILAS_POR_BLOQUE)], dtype=np.float32)
+        bloques = _bloques_2x2(banda)
+        destino = salida[inicio:inicio + FILAS_POR_BLOQUE]
+
+        if not especiales:
+            np.mean(bloques, axis=2, out=destino)
+            continue
+
+        normales = np.ones(bloques.shape, dtype=bool)
+        conteos = []
+        for valor in especiales:
+            es_valor = bloques == valor
+            normales &= ~es_valor
+            conteos.append(np.count_nonzero(es_valor, axis=2))
+
+        cantidad = np.count_nonzero(normales, axis=2)
+        suma = np.sum(bloques, axis=2, where=normales)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.divide(suma, cantidad, out=destino)
+
+        # El grupo más numeroso gana; ante empate, los valores normales
+        mayor = cantidad
+        for valor, conteo in zip(especiales, conteos):
+            gana = conteo > mayor
+            destino[gana] = valor
+            mayor = np.maximum(mayor, conteo)
+
+    return salida
+
+
+def reducir_moda(matriz):
+    """
+    Reduce la matriz a la mitad tomando el valor más frecuente de cada bloque de 2x2
+    (ante empate, el menor). Pensada para capas categóricas enteras.
+    """
+    filas, columnas = matriz.shape
+    salida = np.empty((-(-filas // 2), -(-columnas // 2)), dtype=matriz.dtype)
+
+    for inicio in range(0, salida.shape[0], FILAS_POR_BLOQUE):
+        bloques = _bloques_2x2(np.asarray(matriz[2 * inicio:2 * (inicio + FILAS_POR_BLOQUE)]))
+        destino = salida[inicio:inicio + FILAS_POR_BLOQUE]
+
+        mejor_conteo = np.zeros(bloques.shape[:2], dtype=np.int8)
+        for valor in np.unique(bloques):
+            conteo = np.count_nonzero(bloques == valor, axis=2).astype(np.int8)
+            gana = conteo > mejor_conteo
+            destino[gana] = valor
+            mejor_conteo[gana] = conteo[gana]
+
+    return salida
+
+
+def cantidad_niveles(filas, columnas, tamano_tesela=TAMANO_TESELA):
+    """
+    Zoom máximo de la pirámide: cantidad de reducciones a la mitad hasta que la grilla entra en una tesela.
+    """
+    lado = max(filas, columnas)
+    return max(0, math.ceil(math.log2(lado / tamano_tesela))) if lado > tamano_tesela else 0
+
+
+def construir_niveles(matriz, metodo='media', especiales=(), tamano_tesela=TAMANO_TESELA):
+    """
+    Devuelve la lista de niveles [z=0 (más reducido), ..., z=zoom_max (matriz original)].
+    """
+    zoom_max = cantidad_niveles(*matriz.shape, tamano_tesela)
+    niveles = [matriz]
+    for _ in range(zoom_max):
+        if metodo == 'moda':
+            niveles.append(reducir_moda(niveles[-1]))
+        else:
+            niveles.append(reducir_media(niveles[-1], especiales))
+    return niveles[::-1]
+
+
+def _guardar_tesela(directorio, z, x, y, bloque, lut, relleno, calidad, tesela):
+    """
+    Completa `tesela` (buffer tamano_tesela x tamano_tesela) con el bloque de códigos y la guarda
+    en {z}/{x}/{y}.jpeg. Se escribe en un temporal y se renombra, así una tesela reemplazada
+    nunca se lee a medio escribir.
+    """
+    tesela.fill(relleno)
+    tesela[:bloque.shape[0], :bloque.shape[1]] = bloque
+
+    ruta = os.path.join(directorio, str(z), str(x))
+    os.makedirs(ruta, exist_ok=True)
+    ruta_tesela = os.path.join(ruta, f'{y}.jpeg')
+    ruta_tmp = f'{ruta_tesela}.{os.getpid()}.tmp'
+    Image.fromarray(lut[tesela]).save(ruta_tmp, format='JPEG', quality=calidad)
+    os.replace(ruta_tmp, ruta_tesela)
+
+
+def _guardar_fila_teselas(directorio, z, y, banda, lut, relleno, calidad, tamano_tesela=TAMANO_TESELA):
+    """
+    Guarda las teselas de una fila (banda de códigos uint8 de hasta tamano_tesela filas).
+    Devuelve la cantidad de teselas escritas. Se ejecuta en los procesos del pool.
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    tesela = np.empty((tamano_tesela, tamano_tesela), dtype=np.uint8)
+
+    for x, inicio in enumerate(range(0, banda.shape[1], tamano_tesela)):
+        _guardar_tesela(directorio, z, x, y, banda[:, inicio:inicio + tamano_tesela], lut, relleno, calidad, tesela)
+
+    return -(-banda.shape[1] // tamano_tesela)
+
+
+def _guardar_teselas_sueltas(directorio, teselas, lut, relleno, calidad, tamano_tesela=TAMANO_TESELA):
+    """
+    Guarda una lista de teselas (z, x, y, códigos). Devuelve la cantidad escrita.
+    Se ejecuta en los procesos del pool.
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    tesela = np.empty((tamano_tesela, tamano_tesela), dtype=np.uint8)
+    for z, x, y, bloque in teselas:
+        _guardar_tesela(directorio, z, x, y, bloque, lut, relleno, calidad, tesela)
+    return len(teselas)
+
+
+def generar_piramide(matriz, cuantizar, lut, directorio, metodo='media', especiales=(), relleno=0,
+                     workers=None, calidad=90, tamano_tesela=TAMANO_TESELA):
+    """
+    Construye la pirámide de la matriz y la guarda como teselas XYZ en `directorio`.
+
+    `cuantizar` convierte cada nivel en códigos uint8 de la LUT (debe usar la misma escala
+    para todos los niveles); `relleno` es el código con que se completan las teselas del borde.
+    Las filas de teselas se codifican en un pool de procesos (workers=None usa uno por núcleo,
+    workers=1 las codifica en el proceso actual). Devuelve el índice guardado en teselas.json.
+    """
+    niveles = construir_niveles(matriz, metodo, especiales, tamano_tesela)
+    tareas = []
+    descripcion_niveles = []
+
+    for z, nivel in enumerate(niveles):
+        codigos = cuantizar(nivel)
+        teselas_y = -(-codigos.shape[0] // tamano_tesela)
+        descripcion_niveles.append({
+            'z': z,
+            'filas': int(codigos.shape[0]),
+            'columnas': int(codigos.shape[1]),
+            'teselas_x': -(-codigos.shape[1] // tamano_tesela),
+            'teselas_y': teselas_y
+        })
+        for y in range(teselas_y):
+            tareas.append((z, y, codigos[y * tamano_tesela:(y + 1) * tamano_tesela]))
+
+    os.makedirs(directorio, exist_ok=True)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tareas)))
+
+    argumentos = ([directorio] * len(tareas), [t[0] for t in tareas], [t[1] for t in tareas],
+                  [t[2] for t in tareas], [lut] * len(tareas), [relleno] * len(tareas),
+                  [calidad] * len(tareas), [tamano_tesela] * len(tareas))
+    if workers == 1:
+        total = sum(map(_guardar_fila_teselas, *argumentos))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            total = sum(executor.map(_guardar_fila_teselas, *argumentos))
+
+    indice = {
+        'esquema': 'xyz',
+        'plantilla': '{z}/{x}/{y}.jpeg',
+        'tamano_tesela': tamano_tesela,
+        'zoom_min': 0,
+        'zoom_max': len(niveles) - 1,
+        'dimensiones': [int(matriz.shape[0]), int(matriz.shape[1])],
+        'metodo': metodo,
+        'especiales': list(especiales),
+        'teselas': total,
+        'niveles': descripcion_niveles,
+        'limites': LIMITES_GEOGRAFICOS
+    }
+
+    ruta_indice = os.path.join(directorio, INDICE_TESELAS)
+    ruta_tmp = f'{ruta_indice}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(indice, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta_indice)
+
+    return indice
+
+
+def teselas_afectadas(ventanas, zoom_max, tamano_tesela=TAMANO_TESELA):
+    """
+    Teselas (z, x, y) de todos los niveles que cubren alguna de las ventanas de resolución
+    completa (fila_inicio, fila_fin, columna_inicio, columna_fin). Una tesela del nivel z
+    abarca un bloque alineado de tamano_tesela * 2^(zoom_max - z) celdas de lado.
+    """
+    afectadas = set()
+    for z in range(zoom_max + 1):
+        lado = tamano_tesela << (zoom_max - z)
+        for fila_inicio, fila_fin, columna_inicio, columna_fin in ventanas:
+            for y in range(fila_inicio // lado, (fila_fin - 1) // lado + 1):
+                for x in range(columna_inicio // lado, (columna_fin - 1) // lado + 1):
+                    afectadas.add((z, x, y))
+    return sorted(afectadas)
+
+
+def actualizar_piramide(matriz, ventanas, cuantizar, lut, directorio, metodo='media', especiales=(), relleno=0,
+                        workers=None, calidad=90, tamano_tesela=TAMANO_TESELA):
+    """
+    Vuelve a generar solo las teselas de una pirámide existente que cubren las ventanas de
+    resolución completa que cambiaron (ver teselas_afectadas), sin reconstruir los niveles.
+
+    Cada tesela del nivel z se obtiene reduciendo zoom_max - z veces el bloque de la matriz
+    completa que abarca; como los bloques de 2x2 están alineados (y el borde impar solo aparece
+    al final de la grilla) el resultado es idéntico al de generar_piramide(). Devuelve el índice,
+    o None si no hay una pirámide compatible en `directorio` y hay que generarla completa.
+    """
+    ruta_indice = os.path.join(directorio, INDICE_TESELAS)
+    try:
+        with open(ruta_indice, 'r', encoding='utf-8') as f:
+            indice = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (indice.get('dimensiones') != [int(matriz.shape[0]), int(matriz.shape[1])]
+            or indice.get('tamano_tesela') != tamano_tesela or indice.get('metodo') != metodo
+            or indice.get('especiales') != list(especiales)
+            or indice.get('zoom_max') != cantidad_niveles(*matriz.shape, tamano_tesela)):
+        return None
+
+    zoom_max = indice['zoom_max']
+    teselas = []
+    for z, x, y in teselas_afectadas(ventanas, zoom_max, tamano_tesela):
+        lado = tamano_tesela << (zoom_max - z)
+        nivel = matriz[y * lado:(y + 1) * lado, x * lado:(x + 1) * lado]
+        for _ in range(zoom_max - z):
+            nivel = reducir_moda(nivel) if metodo == 'moda' else reducir_media(nivel, especiales)
+        teselas.append((z, x, y, cuantizar(nivel)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(teselas)))
+
+    if workers == 1:
+        _guardar_teselas_sueltas(directorio, teselas, lut, relleno, calidad, tamano_tesela)
+    else:
+        lotes = [teselas[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_guardar_teselas_sueltas, [directorio] * workers, lotes, [lut] * workers,
+                              [relleno] * workers, [calidad] * workers, [tamano_tesela] * workers))
+
+    return dict(indice, actualizadas=len(teselas))
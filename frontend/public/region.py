@@ -0,0 +1,370 @@
+"""
+Cálculo del riesgo restringido a una región de interés (polígono GeoJSON o rectángulo).
+
+La región se rasteriza una sola vez a una máscara booleana de la grilla y se guarda en la
+caché de capas (.cache_capas/region_<clave>.npy); la clave depende del contenido del
+GeoJSON, del rectángulo, de las dimensiones de la grilla y de sus límites geográficos.
+
+La grilla se divide en teselas de 256x256 (las mismas que los chunks de riesgo_almacen/):
+solo se leen, calculan y dibujan las teselas que intersectan la máscara, dentro del
+rectángulo que la contiene. Para un municipio es una fracción chica de la provincia.
+
+Los límites de la grilla son los de piramide.LIMITES_GEOGRAFICOS: la fila 0 es el borde
+norte (max_lat) y la columna 0 el borde oeste (min_lon); una celda pertenece al polígono
+si su centro está adentro (regla par-impar, así los huecos de los polígonos quedan afuera).
+
+Salidas (en riesgo_region/ por defecto):
+- riesgo.npy: riesgo del rectángulo que contiene la región; NaN fuera de la región
+  (las celdas NaN se dibujan como sin dato)
+- riesgo.jpeg: imagen del mismo rectángulo con la LUT de riesgo.jpeg
+- region.json: desplazamiento y dimensiones del rectángulo en la grilla completa, sus
+  límites geográficos, teselas calculadas y estadísticas de las celdas de la región
+
+Uso:
+    python region.py --geojson ContornoCba.geojson
+    python region.py --bbox-geo=-64.3,-31.5,-64.0,-31.3 [--salida DIR] [--sin-jpeg]
+    python region.py --bbox-pixeles 400,700,300,600 [--entrada DIR]
+
+(con valores negativos, --bbox-geo=... con '=' para que no se lean como otra opción)
+"""
+
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from calcular_riesgo import (EstadisticasRiesgo, RANGO_LANDSLIDE, calcular_riesgo_fusionado,
+                             colores_riesgo, elegir_dtype_calculo, normalizar_con_tabla, normalizar_valores,
+                             rutas_capas, tabla_landslide)
+from capas import CACHE_DIR, cargar_capa, hash_archivo, metadatos_capa
+
+TAMANO_TESELA = 256
+
+DIRECTORIO_REGION = 'riesgo_region'
+
+# Incrementar si cambia la forma de rasterizar la región
+REGION_VERSION = 1
+
+
+def leer_poligonos_geojson(ruta):
+    """
+    Polígonos de un GeoJSON (FeatureCollection, Feature o geometría suelta): lista de
+    (propiedades, anillos) por Feature con geometría Polygon o MultiPolygon, donde anillos son
+    matrices n x 2 de lon, lat (incluidos los huecos).
+    """
+    with open(ruta, 'r', encoding='utf-8') as f:
+        datos = json.load(f)
+
+    if datos.get('type') == 'FeatureCollection':
+        features = datos['features']
+    elif datos.get('type') == 'Feature':
+        features = [datos]
+    else:
+        features = [{'type': 'Feature', 'properties': {}, 'geometry': datos}]
+
+    poligonos = []
+    for feature in features:
+        geometria = feature.get('geometry') or {}
+        if geometria.get('type') == 'Polygon':
+            partes = [geometria['coordinates']]
+        elif geometria.get('type') == 'MultiPolygon':
+            partes = geometria['coordinates']
+        else:
+            continue
+        anillos = [np.asarray(anillo, dtype=np.float64)[:, :2] for parte in partes for anillo in parte]
+        poligonos.append((feature.get('properties') or {}, anillos))
+
+    if not poligonos:
+        raise ValueError(f"{ruta} no contiene polígonos")
+    return poligonos
+
+
+def leer_anillos_geojson(ruta):
+    """
+    Anillos (matrices n x 2 de lon, lat) de todos los polígonos de un GeoJSON, incluidos los huecos.
+    """
+    return [anillo for _, anillos in leer_poligonos_geojson(ruta) for anillo in anillos]
+
+
+def limites_grilla(limites=None):
+    """
+    Límites geográficos de la grilla: los dados o, por defecto, piramide.LIMITES_GEOGRAFICOS.
+    """
+    if limites is None:
+        from piramide import LIMITES_GEOGRAFICOS
+        return LIMITES_GEOGRAFICOS
+    return limites
+
+
+def geo_a_pixel(lon, lat, forma, limites=None):
+    """
+    Convierte coordenadas geográficas a coordenadas continuas (columna, fila) de la grilla,
+    con el centro de la celda (0, 0) en (0.5, 0.5).
+    """
+    limites = limites_grilla(limites)
+    filas, columnas = forma
+    columna = (np.asarray(lon) - limites['min_lon']) * columnas / (limites['max_lon'] - limites['min_lon'])
+    fila = (limites['max_lat'] - np.asarray(lat)) * filas / (limites['max_lat'] - limites['min_lat'])
+    return columna, fila
+
+
+def pixel_a_geo(columna, fila, forma, limites=None):
+    """
+    Inversa de geo_a_pixel: (lon, lat) de una posición continua de la grilla.
+    """
+    limites = limites_grilla(limites)
+    filas, columnas = forma
+    lon = limites['min_lon'] + np.asarray(columna) * (limites['max_lon'] - limites['min_lon']) / columnas
+    lat = limites['max_lat'] - np.asarray(fila) * (limites['max_lat'] - limites['min_lat']) / filas
+    return lon, lat
+
+
+def rasterizar_filas(anillos, forma, limites=None):
+    """
+    Rasteriza los anillos solo en las filas que atraviesan: devuelve (primera_fila, bloque)
+    con bloque la máscara booleana de esas filas (ancho completo), o (0, None) si el
+    polígono queda fuera de la grilla.
+
+    Para cada fila se calculan a la vez los cruces de todos los lados con la horizontal que
+    pasa por el centro de sus celdas; cada cruce suma 1 desde la primera columna a su derecha
+    y la paridad de la suma acumulada por fila indica si la celda está adentro.
+    """
+    filas, columnas = forma
+    lados = []
+    for anillo in anillos:
+        x, y = geo_a_pixel(anillo[:, 0], anillo[:, 1], forma, limites)
+        lados.append(np.stack([x, y, np.roll(x, -1), np.roll(y, -1)], axis=1))
+    x0, y0, x1, y1 = np.concatenate(lados).T
+
+    # Solo las filas que atraviesa el polígono
+    primera = max(0, int(math.floor(min(y0.min(), y1.min()))))
+    ultima = min(filas, int(math.ceil(max(y0.max(), y1.max()))) + 1)
+    if primera >= ultima:
+        return 0, None
+
+    centros = np.arange(primera, ultima, dtype=np.float64)[:, None] + 0.5
+    cruza = (y0 <= centros) != (y1 <= centros)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cruce = x0 + (centros - y0) * (x1 - x0) / (y1 - y0)
+
+    fila_cruce, lado_cruce = np.nonzero(cruza)
+    columna_cruce = np.clip(np.ceil(x_cruce[fila_cruce, lado_cruce] - 0.5), 0, columnas).astype(np.int64)
+
+    cruces = np.zeros((ultima - primera, columnas + 1), dtype=np.int32)
+    np.add.at(cruces, (fila_cruce, columna_cruce), 1)
+    return primera, (np.cumsum(cruces[:, :columnas], axis=1) & 1).astype(bool)
+
+
+def rasterizar_anillos(anillos, forma, limites=None):
+    """
+    Máscara booleana de las celdas cuyo centro está dentro de los anillos (regla par-impar).
+    """
+    mascara = np.zeros(forma, dtype=bool)
+    primera, bloque = rasterizar_filas(anillos, forma, limites)
+    if bloque is not None:
+        mascara[primera:primera + bloque.shape[0]] = bloque
+    return mascara
+
+
+def bbox_geo_a_pixeles(bbox, forma, limites=None):
+    """
+    Rectángulo geográfico (min_lon, min_lat, max_lon, max_lat) → (fila_inicio, fila_fin,
+    columna_inicio, columna_fin) de las celdas cuyo centro cae adentro.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    (c0, c1), (f0, f1) = geo_a_pixel([min_lon, max_lon], [max_lat, min_lat], forma, limites)
+    return (max(0, math.ceil(f0 - 0.5)), min(forma[0], math.ceil(f1 - 0.5)),
+            max(0, math.ceil(c0 - 0.5)), min(forma[1], math.ceil(c1 - 0.5)))
+
+
+def mascara_region(forma, geojson=None, bbox_pixeles=None, bbox_geo=None, limites=None):
+    """
+    Máscara de la región: intersección del polígono del GeoJSON y de los rectángulos dados
+    (en píxeles: fila_inicio, fila_fin, columna_inicio, columna_fin; o geográfico).
+    """
+    if geojson is None and bbox_pixeles is None and bbox_geo is None:
+        raise ValueError("Hay que indicar un GeoJSON o un rectángulo para la región")
+
+    if geojson is not None:
+        mascara = rasterizar_anillos(leer_anillos_geojson(geojson), forma, limites)
+    else:
+        mascara = np.ones(forma, dtype=bool)
+
+    for rectangulo in (bbox_pixeles, bbox_geo and bbox_geo_a_pixeles(bbox_geo, forma, limites)):
+        if rectangulo:
+            f0, f1, c0, c1 = rectangulo
+            recorte = np.zeros(forma, dtype=bool)
+            recorte[f0:f1, c0:c1] = True
+            mascara &= recorte
+
+    return mascara
+
+
+def cargar_mascara_region(forma, geojson=None, bbox_pixeles=None, bbox_geo=None, limites=None,
+                          directorio_cache=CACHE_DIR):
+    """
+    Igual que mascara_region() pero cacheada en directorio_cache/region_<clave>.npy: el
+    polígono se rasteriza solo la primera vez para cada GeoJSON, rectángulo y grilla.
+    """
+    parametros = {
+        'version': REGION_VERSION,
+        'forma': list(forma),
+        'geojson': hash_archivo(geojson) if geojson is not None else None,
+        'bbox_pixeles': list(bbox_pixeles) if bbox_pixeles else None,
+        'bbox_geo': list(bbox_geo) if bbox_geo else None,
+        'limites': limites_grilla(limites)
+    }
+    clave = hashlib.sha256(json.dumps(parametros, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    ruta = os.path.join(directorio_cache, f'region_{clave}.npy')
+
+    if os.path.exists(ruta):
+        return np.load(ruta)
+
+    mascara = mascara_region(forma, geojson, bbox_pixeles, bbox_geo, limites)
+    os.makedirs(directorio_cache, exist_ok=True)
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'wb') as f:
+        np.save(f, mascara)
+    os.replace(ruta_tmp, ruta)
+    return mascara
+
+
+def teselas_region(mascara, tamano_tesela=TAMANO_TESELA):
+    """
+    Índices (i, j) de las teselas de tamano_tesela x tamano_tesela que intersectan la máscara.
+    """
+    filas, columnas = mascara.shape
+    ti, tj = -(-filas // tamano_tesela), -(-columnas // tamano_tesela)
+    relleno = np.zeros((ti * tamano_tesela, tj * tamano_tesela), dtype=bool)
+    relleno[:filas, :columnas] = mascara
+    ocupadas = relleno.reshape(ti, tamano_tesela, tj, tamano_tesela).any(axis=(1, 3))
+    return [tuple(int(v) for v in indice) for indice in np.argwhere(ocupadas)]
+
+
+def calcular_riesgo_region(geojson=None, bbox_pixeles=None, bbox_geo=None, directorio_entrada='.',
+                           directorio_salida=DIRECTORIO_REGION, generar_jpeg=True, tamano_tesela=TAMANO_TESELA):
+    """
+    Calcula el riesgo solo en las teselas que intersectan la región y guarda el rectángulo
+    que la contiene en directorio_salida (riesgo.npy, riesgo.jpeg y region.json).
+    Devuelve el resumen guardado en region.json.
+    """
+    inicio = time.perf_counter()
+    rutas = rutas_capas(directorio_entrada)
+    capas = {nombre: cargar_capa(ruta) for nombre, ruta in rutas.items()}
+    metas = {nombre: metadatos_capa(ruta) for nombre, ruta in rutas.items()}
+    forma = (min(c.shape[0] for c in capas.values()), min(c.shape[1] for c in capas.values()))
+
+    directorio_cache = os.path.join(os.path.abspath(directorio_entrada), CACHE_DIR)
+    mascara = cargar_mascara_region(forma, geojson, bbox_pixeles, bbox_geo, directorio_cache=directorio_cache)
+    if not mascara.any():
+        raise ValueError("La región no contiene ninguna celda de la grilla")
+
+    # Normalización de landslide y dtype de cálculo iguales a los de la grilla completa
+    tabla, base = tabla_landslide(metas['landslide'])
+    dtype = elegir_dtype_calculo(metas, tabla)
+
+    filas_region = np.flatnonzero(mascara.any(axis=1))
+    columnas_region = np.flatnonzero(mascara.any(axis=0))
+    f0, f1 = int(filas_region[0]), int(filas_region[-1]) + 1
+    c0, c1 = int(columnas_region[0]), int(columnas_region[-1]) + 1
+
+    riesgo = np.full((f1 - f0, c1 - c0), np.nan, dtype=dtype)
+    estadisticas = EstadisticasRiesgo()
+    teselas = teselas_region(mascara, tamano_tesela)
+
+    for i, j in teselas:
+        # Intersección de la tesela con el rectángulo de la región
+        fa, fb = max(f0, i * tamano_tesela), min(f1, (i + 1) * tamano_tesela)
+        ca, cb = max(c0, j * tamano_tesela), min(c1, (j + 1) * tamano_tesela)
+        ventana = (slice(fa, fb), slice(ca, cb))
+
+        landslide = capas['landslide'][ventana]
+        if tabla is not None:
+            landslide = normalizar_con_tabla(landslide, tabla.astype(dtype), base)
+        else:
+            landslide = normalizar_valores(landslide.astype(float), *RANGO_LANDSLIDE,
+                                           min_actual=metas['landslide']['min'],
+                                           max_actual=metas['landslide']['max'])
+
+        valores, _, _ = calcular_riesgo_fusionado(capas['flood'][ventana], landslide, capas['water'][ventana],
+                                                  capas['urban'][ventana], capas['area_protegida'][ventana], dtype)
+        adentro = mascara[ventana]
+        estadisticas.actualizar(valores[adentro])
+        destino = riesgo[fa - f0:fb - f0, ca - c0:cb - c0]
+        np.copyto(destino, valores, where=adentro)
+
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta_npy = os.path.join(directorio_salida, 'riesgo.npy')
+    ruta_tmp = f'{ruta_npy}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'wb') as f:
+        np.save(f, riesgo)
+    os.replace(ruta_tmp, ruta_npy)
+
+    if generar_jpeg:
+        from renderizado import cuantizar_riesgo, guardar_jpeg, lut_riesgo
+
+        guardar_jpeg(cuantizar_riesgo(riesgo, vmax=10, valor_sin_dato=99), lut_riesgo(colores_riesgo()),
+                     os.path.join(directorio_salida, 'riesgo.jpeg'), calidad=95)
+
+    (min_lon, max_lon), (max_lat, min_lat) = pixel_a_geo([c0, c1], [f0, f1], forma)
+    total_teselas = -(-forma[0] // tamano_tesela) * -(-forma[1] // tamano_tesela)
+    resumen = {
+        'grilla': list(forma),
+        'desplazamiento': [f0, c0],
+        'dimensiones': [f1 - f0, c1 - c0],
+        'limites': {'min_lat': float(min_lat), 'max_lat': float(max_lat),
+                    'min_lon': float(min_lon), 'max_lon': float(max_lon)},
+        'celdas_region': int(np.count_nonzero(mascara)),
+        'tamano_tesela': tamano_tesela,
+        'teselas_calculadas': len(teselas),
+        'teselas_totales': total_teselas,
+        'estadisticas': {
+            'min': estadisticas.minimo,
+            'max': estadisticas.maximo,
+            'promedio': estadisticas.promedio,
+            'count_99': estadisticas.count_99,
+            'count_zero': estadisticas.count_zero
+        },
+        'segundos': round(time.perf_counter() - inicio, 3)
+    }
+
+    ruta_resumen = os.path.join(directorio_salida, 'region.json')
+    ruta_tmp = f'{ruta_resumen}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(resumen, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta_resumen)
+
+    print(f"✓ Región {f1 - f0}x{c1 - c0} ({resumen['celdas_region']} celdas): "
+          f"{len(teselas)} de {total_teselas} teselas en {resumen['segundos']:.2f} s → {directorio_salida}")
+    return resumen
+
+
+def leer_bbox(texto):
+    """
+    Rectángulo desde un texto con cuatro números separados por comas.
+    """
+    valores = [float(v) for v in texto.split(',')]
+    if len(valores) != 4:
+        raise ValueError(f"Se esperaban cuatro valores separados por comas: {texto}")
+    return valores
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cálculo del riesgo en una región de interés')
+    parser.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    parser.add_argument('--salida', default=DIRECTORIO_REGION, help=f'directorio de salida (default: {DIRECTORIO_REGION})')
+    parser.add_argument('--geojson', default=None, help='polígono de la región (p. ej. ContornoCba.geojson)')
+    parser.add_argument('--bbox-geo', type=leer_bbox, default=None,
+                        help='rectángulo min_lon,min_lat,max_lon,max_lat')
+    parser.add_argument('--bbox-pixeles', type=lambda t: [int(v) for v in leer_bbox(t)], default=None,
+                        help='rectángulo fila_inicio,fila_fin,columna_inicio,columna_fin')
+    parser.add_argument('--sin-jpeg', action='store_true', help='no generar riesgo.jpeg de la región')
+    args = parser.parse_args()
+
+    calcular_riesgo_region(args.geojson, args.bbox_pixeles, args.bbox_geo, args.entrada, args.salida,
+                           generar_jpeg=not args.sin_jpeg)
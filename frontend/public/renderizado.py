@@ -0,0 +1,151 @@
+"""
+Renderizado directo de matrices a JPEG mediante tablas de colores (LUT).
+
+Reemplaza el camino figura → imshow → savefig de matplotlib: la matriz se
+cuantiza a códigos uint8, los códigos se traducen a RGB indexando una tabla
+de 256 colores con NumPy y el resultado se codifica directamente con Pillow.
+La imagen tiene exactamente las dimensiones de la matriz (una fila/columna
+por píxel, sin recortes).
+
+Para el mapa de riesgo los valores especiales usan códigos reservados de la
+misma tabla, por lo que se resuelven en la misma pasada que el gradiente:
+- Código 0: valor 0 → Neon Yellow (#eafe07)
+- Códigos 1-254: valores (0, 10] → gradiente
+- Código 255: valor 99 o NaN → Electric Blue (#0042A6)
+"""
+
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+NEON_YELLOW = '#eafe07'
+ELECTRIC_BLUE = '#0042A6'
+
+# Códigos reservados en la LUT del mapa de riesgo
+CODIGO_CERO = 0
+CODIGO_SIN_DATO = 255
+
+# Filas procesadas por bloque al cuantizar (acota los temporales sobre memory-maps)
+FILAS_POR_BLOQUE = 1024
+
+
+def hex_a_rgb(color):
+    """
+    Convierte un color hexadecimal (#rrggbb) en una tupla (r, g, b) con valores 0-255.
+    """
+    color = color.lstrip('#')
+    return tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
+
+
+def lut_gradiente(colores, n=256):
+    """
+    Tabla de `n` colores (float 0-1, forma n x 3) interpolando linealmente entre los
+    colores dados, equiespaciados. Equivale a LinearSegmentedColormap.from_list de matplotlib.
+    """
+    posiciones = np.linspace(0, 1, len(colores))
+    rgb = np.array([hex_a_rgb(c) for c in colores], dtype=float) / 255
+    x = np.linspace(0, 1, n)
+    return np.stack([np.interp(x, posiciones, rgb[:, canal]) for canal in range(3)], axis=1)
+
+
+def lut_a_uint8(lut):
+    """
+    Convierte una LUT float 0-1 a uint8 (con el mismo truncamiento que usa matplotlib).
+    """
+    return (np.asarray(lut) * 255).astype(np.uint8)
+
+
+def color_en_lut(lut, fraccion):
+    """
+    Devuelve el color hexadecimal de la LUT para una fracción 0-1 del gradiente.
+    """
+    n = len(lut)
+    indice = min(max(int(fraccion * n), 0), n - 1)
+    r, g, b = lut_a_uint8(lut[indice])
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def cuantizar_lineal(matriz, vmin, vmax, n=256):
+    """
+    Cuantiza la matriz a códigos 0..n-1 de forma lineal entre vmin y vmax
+    (mismo criterio que Normalize + Colormap de matplotlib). Los NaN van al código 0.
+    """
+    codigos = np.empty(matriz.shape, dtype=np.uint8)
+    rango = vmax - vmin
+    escala = n / rango if rango else 0.0
+
+    for inicio in range(0, matriz.shape[0], FILAS_POR_BLOQUE):
+        bloque = np.asarray(matriz[inicio:inicio + FILAS_POR_BLOQUE], dtype=np.float32)
+        x = (bloque - vmin) * escala
+        np.nan_to_num(x, copy=False, nan=0.0)
+        np.clip(x, 0, n - 1, out=x)
+        codigos[inicio:inicio + FILAS_POR_BLOQUE] = x
+
+    return codigos
+
+
+def lut_riesgo(colores_gradiente, cero=NEON_YELLOW, sin_dato=ELECTRIC_BLUE):
+    """
+    LUT de 256 colores (uint8) para el mapa de riesgo: código 0 en Neon Yellow,
+    códigos 1-254 con el gradiente y código 255 en Electric Blue (los colores de 0 y sin dato
+    se pueden cambiar, p. ej. para las amenazas de formulas.py).
+    """
+    lut = np.empty((256, 3), dtype=np.uint8)
+    lut[1:CODIGO_SIN_DATO] = lut_a_uint8(lut_gradiente(colores_gradiente, CODIGO_SIN_DATO - 1))
+    lut[CODIGO_CERO] = hex_a_rgb(cero)
+    lut[CODIGO_SIN_DATO] = hex_a_rgb(sin_dato)
+    return lut
+
+
+def cuantizar_riesgo(matriz, vmax=10, valor_sin_dato=99, vmin=0, histograma=None):
+    """
+    Cuantiza la matriz de riesgo a los códigos de lut_riesgo():
+    0 → código 0, 99/NaN → código 255 y (vmin, vmax] → códigos 1-254.
+
+    Si se pasa un histograma.HistogramaRiesgo, se actualiza con cada bloque en la misma pasada.
+    """
+    codigos = np.empty(matriz.shape, dtype=np.uint8)
+    niveles = CODIGO_SIN_DATO - 1  # 254 niveles de gradiente
+
+    for inicio in range(0, matriz.shape[0], FILAS_POR_BLOQUE):
+        bloque = np.asarray(matriz[inicio:inicio + FILAS_POR_BLOQUE], dtype=np.float32)
+        destino = codigos[inicio:inicio + FILAS_POR_BLOQUE]
+        if histograma is not None:
+            histograma.actualizar(matriz[inicio:inicio + FILAS_POR_BLOQUE])
+
+        x = (bloque - vmin if vmin else bloque) * (niveles / (vmax - vmin))
+        np.nan_to_num(x, copy=False, nan=0.0)
+        np.clip(x, 0, niveles - 1, out=x)
+        destino[...] = x
+        destino += 1
+
+        destino[bloque == 0] = CODIGO_CERO
+        destino[(bloque == valor_sin_dato) | np.isnan(bloque)] = CODIGO_SIN_DATO
+
+    return codigos
+
+
+def codificar_imagen(codigos, lut, formato='JPEG', calidad=95):
+    """
+    Traduce los códigos uint8 a RGB con la LUT y devuelve la imagen codificada (bytes) en
+    el formato pedido ('JPEG' o 'PNG'), sin pasar por disco.
+    """
+    buffer = io.BytesIO()
+    rgb = np.asarray(lut, dtype=np.uint8)[codigos]
+    opciones = {'quality': calidad, 'optimize': True} if formato.upper() == 'JPEG' else {}
+    Image.fromarray(rgb).save(buffer, format=formato.upper(), **opciones)
+    return buffer.getvalue()
+
+
+def guardar_jpeg(codigos, lut, ruta, calidad=95):
+    """
+    Traduce los códigos uint8 a RGB con la LUT y guarda la imagen como JPEG con Pillow.
+    Se escribe en un temporal y se renombra, así el frontend nunca lee un JPEG a medio escribir.
+    """
+    rgb = np.asarray(lut, dtype=np.uint8)[codigos]
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    Image.fromarray(rgb).save(ruta_tmp, format='JPEG', quality=calidad, optimize=True)
+    os.replace(ruta_tmp, ruta)
+    return ruta
@@ -0,0 +1,421 @@
+"""
+Servicio residente de cálculo de riesgo para el backend Node.
+
+Mantiene las cinco capas decodificadas en memoria y recalcula el riesgo de una ventana
+de la grilla o con otros parámetros de la fórmula sin volver a leer los CSV. Escucha
+solo en la máquina local: HTTP en una dirección loopback (127.0.0.1 por defecto) o un socket
+Unix. Otra dirección se rechaza salvo que se pida explícitamente con --permitir-remoto.
+
+Endpoints:
+    GET  /salud      Estado, dimensiones y momento de la última carga de capas
+    GET  /metricas   Latencias por endpoint (cantidad, promedio, p50, p95, p99, máximo en ms)
+    GET  /riesgo     Riesgo de una ventana. Parámetros (query string, todos opcionales):
+                     fila_inicio, fila_fin, columna_inicio, columna_fin (default: grilla completa)
+                     peso (default 0.5), landslide_min / landslide_max (default 1 / 10;
+                     se redondean a 3 decimales y landslide_min debe ser menor que landslide_max)
+                     formato = json (estadísticas) | npy (matriz float64) | png | jpeg
+    POST /recargar   Vuelve a cargar las capas
+
+Si un CSV de entrada cambia (tamaño o fecha de modificación), las capas se recargan en la
+siguiente consulta. Cada respuesta informa sus tiempos en los encabezados Server-Timing
+(calculo, codificacion, total) y X-Tiempo-Total-ms.
+
+Uso:
+    python servidor_riesgo.py [--entrada DIR] [--host 127.0.0.1] [--puerto 8765] [--permitir-remoto]
+    python servidor_riesgo.py [--entrada DIR] --socket /tmp/riesgo.sock
+"""
+
+import functools
+import io
+import ipaddress
+import json
+import math
+import os
+import socketserver
+import stat
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from calcular_riesgo import (PESO_AMENAZAS, RANGO_LANDSLIDE, calcular_riesgo_fusionado, colores_riesgo,
+                             normalizar_con_tabla, normalizar_valores, rutas_capas, tabla_landslide)
+from capas import cargar_capa, metadatos_capa
+from renderizado import codificar_imagen, cuantizar_riesgo, lut_riesgo
+
+PUERTO_POR_DEFECTO = 8765
+
+# Tablas de normalización de landslide en caché por estado de capas (una por rango pedido)
+TABLAS_EN_CACHE = 32
+
+# Decimales a los que se redondea el rango de normalización de landslide de la consulta
+DECIMALES_RANGO = 3
+
+TIPOS_CONTENIDO = {
+    'json': 'application/json',
+    'npy': 'application/octet-stream',
+    'png': 'image/png',
+    'jpeg': 'image/jpeg'
+}
+
+
+class CapasResidentes:
+    """
+    Capas de entrada decodificadas en memoria, recortadas a las dimensiones mínimas comunes.
+    Cada recarga arma un estado nuevo que reemplaza al anterior de una vez, así las consultas
+    en curso siguen usando un estado consistente.
+    """
+
+    def __init__(self, directorio='.'):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        self.estado = None
+        self.cargar()
+
+    def _firma(self):
+        firma = {}
+        for nombre, ruta in rutas_capas(self.directorio).items():
+            stat = os.stat(ruta)
+            firma[nombre] = (stat.st_size, stat.st_mtime_ns)
+        return firma
+
+    def cargar(self):
+        inicio = time.perf_counter()
+        firma = self._firma()
+        rutas = rutas_capas(self.directorio)
+
+        # np.array copia el memory-map de la caché a memoria
+        capas = {nombre: np.array(cargar_capa(ruta)) for nombre, ruta in rutas.items()}
+        metas = {nombre: metadatos_capa(ruta) for nombre, ruta in rutas.items()}
+
+        filas = min(capa.shape[0] for capa in capas.values())
+        columnas = min(capa.shape[1] for capa in capas.values())
+
+        self.estado = {
+            'firma': firma,
+            'capas': {nombre: capa[:filas, :columnas] for nombre, capa in capas.items()},
+            'meta_landslide': metas['landslide'],
+            # Caché acotada de tablas por rango: las consultas eligen el rango libremente
+            'tabla': functools.lru_cache(maxsize=TABLAS_EN_CACHE)(
+                functools.partial(tabla_landslide, metas['landslide'])),
+            'forma': (filas, columnas),
+            'cargado': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'segundos_carga': time.perf_counter() - inicio
+        }
+        print(f"Capas cargadas: {filas}x{columnas} en {self.estado['segundos_carga']:.2f} s")
+
+    def actualizar_si_cambio(self):
+        """
+        Recarga las capas si algún CSV de entrada cambió desde la última carga.
+        """
+        if self._firma() != self.estado['firma']:
+            with self._lock:
+                if self._firma() != self.estado['firma']:
+                    self.cargar()
+
+    def _landslide(self, estado, ventana, rango):
+        meta = estado['meta_landslide']
+        tabla, base = estado['tabla'](rango)
+
+        landslide = estado['capas']['landslide'][ventana]
+        if tabla is not None:
+            return normalizar_con_tabla(landslide, tabla, base)
+        return normalizar_valores(landslide.astype(float), *rango, min_actual=meta['min'], max_actual=meta['max'])
+
+    def calcular(self, ventana, peso=PESO_AMENAZAS, rango=RANGO_LANDSLIDE):
+        """
+        Calcula el riesgo (float64) de la ventana (tupla de slices) con el peso y el rango
+        de normalización de landslide dados. Devuelve (riesgo, estadisticas).
+        """
+        estado = self.estado
+        capas = estado['capas']
+        landslide = self._landslide(estado, ventana, rango)
+
+        riesgo, estadisticas, _ = calcular_riesgo_fusionado(
+            capas['flood'][ventana], landslide, capas['water'][ventana], capas['urban'][ventana],
+            capas['area_protegida'][ventana], np.float64, peso=peso)
+        return riesgo, estadisticas
+
+
+class MetricasLatencia:
+    """
+    Latencias de las últimas `maximo` consultas por endpoint y cantidad total de consultas.
+    """
+
+    def __init__(self, maximo=1000):
+        self._lock = threading.Lock()
+        self.muestras = defaultdict(lambda: deque(maxlen=maximo))
+        self.totales = defaultdict(int)
+        self.errores = defaultdict(int)
+
+    def registrar(self, endpoint, segundos, error=False):
+        with self._lock:
+            self.muestras[endpoint].append(segundos * 1000)
+            self.totales[endpoint] += 1
+            if error:
+                self.errores[endpoint] += 1
+
+    def resumen(self):
+        with self._lock:
+            resumen = {}
+            for endpoint, muestras in self.muestras.items():
+                ms = np.array(muestras)
+                resumen[endpoint] = {
+                    'cantidad': self.totales[endpoint],
+                    'errores': self.errores[endpoint],
+                    'promedio_ms': round(float(ms.mean()), 3),
+                    'p50_ms': round(float(np.percentile(ms, 50)), 3),
+                    'p95_ms': round(float(np.percentile(ms, 95)), 3),
+                    'p99_ms': round(float(np.percentile(ms, 99)), 3),
+                    'max_ms': round(float(ms.max()), 3)
+                }
+            return resumen
+
+
+def _entero(parametros, nombre, defecto=None):
+    valor = parametros.get(nombre, [None])[0]
+    return defecto if valor in (None, '') else int(valor)
+
+
+def _rango(parametros, eje, tamano):
+    """
+    Slice [<eje>_inicio, <eje>_fin) de la consulta, acotado a la grilla (admite índices negativos).
+    """
+    inicio, fin, _ = slice(_entero(parametros, f'{eje}_inicio'), _entero(parametros, f'{eje}_fin')).indices(tamano)
+    if inicio >= fin:
+        raise ValueError(f"La ventana pedida está vacía en {eje}s ({inicio}:{fin})")
+    return slice(inicio, fin)
+
+
+def _flotante(parametros, nombre, defecto):
+    valor = parametros.get(nombre, [None])[0]
+    if valor in (None, ''):
+        return defecto
+    valor = float(valor)
+    if not math.isfinite(valor):
+        raise ValueError(f"El parámetro {nombre} debe ser un número finito")
+    return valor
+
+
+def _rango_landslide(parametros):
+    """
+    Rango de normalización de landslide de la consulta, redondeado a DECIMALES_RANGO para que
+    valores casi iguales compartan la tabla en caché.
+    """
+    rango = tuple(round(_flotante(parametros, nombre, defecto), DECIMALES_RANGO)
+                  for nombre, defecto in (('landslide_min', RANGO_LANDSLIDE[0]),
+                                          ('landslide_max', RANGO_LANDSLIDE[1])))
+    if rango[0] >= rango[1]:
+        raise ValueError(f"Rango de landslide inválido {rango}: landslide_min debe ser menor que landslide_max")
+    return rango
+
+
+class ManejadorRiesgo(BaseHTTPRequestHandler):
+    """
+    Manejador HTTP del servicio. Las capas y las métricas se comparten entre hilos
+    a través de los atributos del servidor.
+    """
+
+    server_version = 'ServidorRiesgo/1.0'
+
+    def address_string(self):
+        # En un socket Unix la dirección del cliente no es una tupla (host, puerto)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, formato, *args):
+        if self.server.registrar_accesos:
+            super().log_message(formato, *args)
+
+    def _responder(self, estado, cuerpo, tipo='application/json', encabezados=None):
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for clave, valor in (encabezados or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _responder_json(self, estado, datos, encabezados=None):
+        self._responder(estado, json.dumps(datos, ensure_ascii=False).encode('utf-8'), encabezados=encabezados)
+
+    def _atender(self, endpoint, funcion):
+        inicio = time.perf_counter()
+        error = False
+        try:
+            funcion(inicio)
+        except (ValueError, KeyError) as e:
+            error = True
+            self._responder_json(400, {'error': str(e)})
+        except Exception as e:
+            error = True
+            self._responder_json(500, {'error': str(e)})
+        finally:
+            self.server.metricas.registrar(endpoint, time.perf_counter() - inicio, error)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/salud':
+            self._atender('/salud', lambda inicio: self._salud())
+        elif url.path == '/metricas':
+            self._atender('/metricas', lambda inicio: self._responder_json(200, self.server.metricas.resumen()))
+        elif url.path == '/riesgo':
+            self._atender('/riesgo', lambda inicio: self._riesgo(parse_qs(url.query), inicio))
+        else:
+            self._responder_json(404, {'error': f'Ruta no encontrada: {url.path}'})
+
+    def do_POST(self):
+        if urlparse(self.path).path == '/recargar':
+            self._atender('/recargar', lambda inicio: self._recargar())
+        else:
+            self._responder_json(404, {'error': f'Ruta no encontrada: {self.path}'})
+
+    def _salud(self):
+        estado = self.server.capas.estado
+        self._responder_json(200, {
+            'estado': 'ok',
+            'dimensiones': list(estado['forma']),
+            'cargado': estado['cargado'],
+            'segundos_carga': round(estado['segundos_carga'], 3)
+        })
+
+    def _recargar(self):
+        with self.server.capas._lock:
+            self.server.capas.cargar()
+        self._salud()
+
+    def _riesgo(self, parametros, inicio):
+        capas = self.server.capas
+        capas.actualizar_si_cambio()
+        filas, columnas = capas.estado['forma']
+
+        formato = parametros.get('formato', ['json'])[0].lower()
+        if formato not in TIPOS_CONTENIDO:
+            raise ValueError(f"Formato no soportado: {formato} (json, npy, png o jpeg)")
+
+        ventana = (_rango(parametros, 'fila', filas), _rango(parametros, 'columna', columnas))
+
+        peso = _flotante(parametros, 'peso', PESO_AMENAZAS)
+        rango = _rango_landslide(parametros)
+
+        riesgo, estadisticas = capas.calcular(ventana, peso, rango)
+        fin_calculo = time.perf_counter()
+
+        if formato == 'json':
+            cuerpo = json.dumps({
+                'ventana': [ventana[0].start, ventana[0].stop, ventana[1].start, ventana[1].stop],
+                'forma': list(riesgo.shape),
+                'parametros': {'peso': peso, 'rango_landslide': list(rango)},
+                'estadisticas': {
+                    'min': estadisticas.minimo,
+                    'max': estadisticas.maximo,
+                    'promedio': estadisticas.promedio,
+                    'count_99': estadisticas.count_99,
+                    'count_zero': estadisticas.count_zero
+                }
+            }, ensure_ascii=False).encode('utf-8')
+        elif formato == 'npy':
+            buffer = io.BytesIO()
+            np.save(buffer, riesgo)
+            cuerpo = buffer.getvalue()
+        else:
+            codigos = cuantizar_riesgo(riesgo, vmax=10, valor_sin_dato=99)
+            cuerpo = codificar_imagen(codigos, lut_riesgo(colores_riesgo()), formato.upper())
+
+        fin = time.perf_counter()
+        calculo_ms = (fin_calculo - inicio) * 1000
+        total_ms = (fin - inicio) * 1000
+        self._responder(200, cuerpo, TIPOS_CONTENIDO[formato], {
+            'Server-Timing': (f'calculo;dur={calculo_ms:.3f}, codificacion;dur={total_ms - calculo_ms:.3f}, '
+                              f'total;dur={total_ms:.3f}'),
+            'X-Tiempo-Total-ms': f'{total_ms:.3f}',
+            'X-Forma': f'{riesgo.shape[0]}x{riesgo.shape[1]}'
+        })
+
+
+class ServidorHTTP(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def es_loopback(host):
+    """
+    True si host es 'localhost' o una dirección IPv4/IPv6 loopback (127.0.0.0/8, ::1).
+    """
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def crear_servidor(capas, host='127.0.0.1', puerto=PUERTO_POR_DEFECTO, socket_unix=None, registrar_accesos=False,
+                   permitir_remoto=False):
+    """
+    Crea el servidor HTTP (TCP en host:puerto, o sobre el socket Unix si se indica).
+    El servicio no tiene autenticación: un host que no sea loopback solo se acepta con
+    permitir_remoto=True. Si socket_unix ya existe solo se reemplaza un socket (uno viejo de
+    una ejecución anterior); cualquier otro archivo en esa ruta es un error.
+    """
+    if not socket_unix and not permitir_remoto and not es_loopback(host):
+        raise ValueError(f"El host {host} no es una dirección loopback (ver permitir_remoto / --permitir-remoto)")
+
+    if socket_unix:
+        try:
+            modo = os.lstat(socket_unix).st_mode
+        except FileNotFoundError:
+            modo = None
+        if modo is not None:
+            if not stat.S_ISSOCK(modo):
+                raise ValueError(f"{socket_unix} existe y no es un socket Unix: no se reemplaza")
+            os.remove(socket_unix)
+        servidor = ServidorUnix(socket_unix, ManejadorRiesgo)
+    else:
+        servidor = ServidorHTTP((host, puerto), ManejadorRiesgo)
+
+    servidor.capas = capas
+    servidor.metricas = MetricasLatencia()
+    servidor.registrar_accesos = registrar_accesos
+    return servidor
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Servicio residente de cálculo de riesgo (solo local)')
+    parser.add_argument('--entrada', default='.', help='directorio con las cinco capas CSV (default: actual)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='dirección loopback de escucha (default: 127.0.0.1)')
+    parser.add_argument('--permitir-remoto', action='store_true',
+                        help='aceptar un --host que no sea loopback (el servicio no tiene autenticación)')
+    parser.add_argument('--puerto', type=int, default=PUERTO_POR_DEFECTO,
+                        help=f'puerto HTTP (default: {PUERTO_POR_DEFECTO})')
+    parser.add_argument('--socket', default=None, help='escuchar en este socket Unix en lugar de TCP')
+    parser.add_argument('--registrar-accesos', action='store_true', help='mostrar cada consulta en la consola')
+    args = parser.parse_args()
+
+    if not args.socket and not args.permitir_remoto and not es_loopback(args.host):
+        parser.error(f"--host {args.host} no es una dirección loopback; agregar --permitir-remoto para usarlo")
+
+    if args.socket and os.path.lexists(args.socket) and not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+        parser.error(f"--socket {args.socket} existe y no es un socket Unix")
+
+    servidor = crear_servidor(CapasResidentes(args.entrada), args.host, args.puerto, args.socket,
+                              args.registrar_accesos, args.permitir_remoto)
+    direccion = args.socket or f'http://{servidor.server_address[0]}:{servidor.server_address[1]}'
+    print(f"Servicio de riesgo escuchando en {direccion}")
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
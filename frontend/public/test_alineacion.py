@@ -0,0 +1,114 @@
+"""
+Pruebas de la alineación de capas a una grilla destino (alineacion.py).
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from alineacion import cargar_capa_alineada, elegir_metodo, leer_grilla, remuestrear
+
+
+def _bordes(origen, destino):
+    return [i * origen // destino for i in range(destino + 1)]
+
+
+def _por_bloques(matriz, filas, columnas, reducir):
+    """
+    Referencia celda por celda: reducir() sobre el bloque de origen que cubre cada celda destino.
+    """
+    bordes_f, bordes_c = _bordes(matriz.shape[0], filas), _bordes(matriz.shape[1], columnas)
+    return np.array([[reducir(matriz[bordes_f[i]:bordes_f[i + 1], bordes_c[j]:bordes_c[j + 1]])
+                      for j in range(columnas)] for i in range(filas)])
+
+
+def _moda(bloque):
+    valores, conteos = np.unique(bloque, return_counts=True)
+    # np.unique ordena: argmax se queda con el menor de los empatados
+    return valores[np.argmax(conteos)]
+
+
+@pytest.fixture
+def capa():
+    generador = np.random.default_rng(7)
+    return generador.integers(0, 4, (47, 61), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('filas, columnas', [(10, 13), (47, 20), (9, 61)])
+def test_media_y_moda_por_bloques(capa, filas, columnas):
+    # Bloques de 2 filas por banda: las bandas cortan la grilla destino en varios pedazos
+    media = remuestrear(capa, filas, columnas, 'media', filas_por_bloque=2)
+    assert media.dtype == np.float32
+    np.testing.assert_allclose(media, _por_bloques(capa.astype(np.float64), filas, columnas, np.mean), rtol=1e-6)
+
+    moda = remuestrear(capa, filas, columnas, 'moda', filas_por_bloque=2)
+    assert moda.dtype == capa.dtype
+    np.testing.assert_array_equal(moda, _por_bloques(capa, filas, columnas, _moda))
+
+
+def _centros(origen, destino):
+    # Celda de origen que contiene el centro de cada celda destino
+    return (2 * np.arange(destino) + 1) * origen // (2 * destino)
+
+
+@pytest.mark.parametrize('filas, columnas', [(10, 13), (94, 61), (120, 30)])
+def test_vecino(capa, filas, columnas):
+    esperado = capa[np.ix_(_centros(capa.shape[0], filas), _centros(capa.shape[1], columnas))]
+    np.testing.assert_array_equal(remuestrear(capa, filas, columnas, 'vecino', filas_por_bloque=7), esperado)
+
+
+@pytest.mark.parametrize('metodo', ['media', 'moda'])
+def test_ejes_ampliados_por_vecino(capa, metodo):
+    # Los dos ejes se amplían: cada celda destino cae en una sola celda de origen
+    np.testing.assert_array_equal(remuestrear(capa, 94, 122, metodo), remuestrear(capa, 94, 122, 'vecino'))
+
+    # Solo se amplían las filas: las columnas se reducen por bloques y las filas se toman por vecino
+    reducidas = remuestrear(capa, capa.shape[0], 30, metodo)
+    np.testing.assert_array_equal(remuestrear(capa, 120, 30, metodo, filas_por_bloque=7),
+                                  reducidas[_centros(capa.shape[0], 120)])
+
+
+def test_capa_alineada_en_cache(capa, tmp_path, capsys):
+    ruta_csv = str(tmp_path / 'landslide.csv')
+    np.savetxt(ruta_csv, capa, fmt='%d', delimiter=',')
+
+    alineada, meta = cargar_capa_alineada(ruta_csv, 10, 13)
+    assert meta['metodo'] == 'moda' and meta['shape'] == [10, 13]
+    np.testing.assert_array_equal(alineada, remuestrear(capa, 10, 13, 'moda'))
+    assert "Alineando" in capsys.readouterr().out
+
+    # Sin cambios en el CSV se abre desde la caché
+    desde_cache, _ = cargar_capa_alineada(ruta_csv, 10, 13)
+    np.testing.assert_array_equal(desde_cache, alineada)
+    assert "Alineando" not in capsys.readouterr().out
+
+    # Un CSV nuevo invalida la capa alineada
+    np.savetxt(ruta_csv, capa[::-1], fmt='%d', delimiter=',')
+    os.utime(ruta_csv, ns=(0, 0))
+    recalculada, _ = cargar_capa_alineada(ruta_csv, 10, 13)
+    np.testing.assert_array_equal(recalculada, remuestrear(capa[::-1], 10, 13, 'moda'))
+    assert "Alineando" in capsys.readouterr().out
+
+    # Con la forma de la grilla se usa la capa tal cual
+    original, _ = cargar_capa_alineada(ruta_csv, *capa.shape)
+    np.testing.assert_array_equal(original, capa[::-1])
+
+
+def test_leer_grilla_y_metodo(tmp_path):
+    assert leer_grilla('1296X978') == {'filas': 1296, 'columnas': 978, 'metodos': {}}
+    ruta = tmp_path / 'grilla.json'
+    ruta.write_text('{"filas": 20, "columnas": 30, "metodos": {"landslide": "media"}}')
+    assert leer_grilla(str(ruta))['metodos'] == {'landslide': 'media'}
+
+    for texto in ('20x', '0x10'):
+        with pytest.raises(ValueError):
+            leer_grilla(texto)
+    ruta.write_text('{"filas": 20, "columnas": 30, "metodos": {"landslide": "bilineal"}}')
+    with pytest.raises(ValueError):
+        leer_grilla(str(ruta))
+
+    assert elegir_metodo({'dtype': '|u1', 'min': 0, 'max': 1}) == 'moda'
+    assert elegir_metodo({'dtype': '<f4', 'min': 0, 'max': 1}) == 'media'
+    assert elegir_metodo({'dtype': '<i4', 'min': 0, 'max': 1000}) == 'media'
+    assert elegir_metodo({'dtype': '|u1', 'min': 0, 'max': 1}, 'vecino') == 'vecino'
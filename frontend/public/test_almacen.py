@@ -0,0 +1,73 @@
+"""
+Pruebas del almacén por chunks comprimidos (almacen.py).
+"""
+
+import numpy as np
+import pytest
+
+from almacen import AlmacenChunks, actualizar_chunks, escribir_almacen
+
+
+@pytest.fixture
+def riesgo():
+    # Forma que no es múltiplo del chunk: la última fila y columna de chunks quedan incompletas
+    generador = np.random.default_rng(1)
+    return generador.choice([0.0, 1.5, 3.0, 8.5, 99.0], size=(70, 45)).astype(np.float32)
+
+
+def _estadisticas_numpy(matriz):
+    validos = matriz[matriz != 99].astype(np.float64)
+    return {
+        'min': float(validos.min()),
+        'max': float(validos.max()),
+        'cantidad': int(validos.size),
+        'count_sin_dato': int(np.count_nonzero(matriz == 99)),
+        'count_zero': int(np.count_nonzero(matriz == 0))
+    }
+
+
+def test_ida_y_vuelta(riesgo, tmp_path):
+    meta = escribir_almacen(riesgo, str(tmp_path), tamano_chunk=(16, 20))
+    almacen = AlmacenChunks(str(tmp_path))
+
+    assert almacen.shape == riesgo.shape
+    assert almacen.dtype == riesgo.dtype
+    assert len(meta['chunks']) == 5 * 3
+    np.testing.assert_array_equal(np.asarray(almacen), riesgo)
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+@pytest.mark.parametrize('ventana', [(0, 16, 0, 20), (10, 50, 15, 44), (69, 70, 0, 45), (-5, None, -3, None)])
+def test_leer_ventana(riesgo, tmp_path, ventana):
+    escribir_almacen(riesgo, str(tmp_path), tamano_chunk=(16, 20))
+    almacen = AlmacenChunks(str(tmp_path))
+    f0, f1, c0, c1 = ventana
+
+    np.testing.assert_array_equal(almacen[f0:f1, c0:c1], riesgo[f0:f1, c0:c1])
+    with pytest.raises(IndexError):
+        almacen[::2, :]
+
+
+def test_estadisticas(riesgo, tmp_path):
+    meta = escribir_almacen(riesgo, str(tmp_path), tamano_chunk=(16, 20))
+    estadisticas = meta['estadisticas']
+
+    for clave, valor in _estadisticas_numpy(riesgo).items():
+        assert estadisticas[clave] == valor
+    assert estadisticas['promedio'] == pytest.approx(riesgo[riesgo != 99].astype(np.float64).mean())
+
+
+def test_actualizar_chunks(riesgo, tmp_path):
+    escribir_almacen(riesgo, str(tmp_path), tamano_chunk=(16, 20))
+
+    # Cambia una ventana contenida en los chunks 1.0 y 1.1
+    nuevo = riesgo.copy()
+    nuevo[20:30, 15:25] = 10.0
+    meta = actualizar_chunks(nuevo, str(tmp_path), ['1.0', '1.1'])
+
+    np.testing.assert_array_equal(np.asarray(AlmacenChunks(str(tmp_path))), nuevo)
+    for clave, valor in _estadisticas_numpy(nuevo).items():
+        assert meta['estadisticas'][clave] == valor
+
+    with pytest.raises(ValueError):
+        actualizar_chunks(nuevo[:10], str(tmp_path), ['0.0'])
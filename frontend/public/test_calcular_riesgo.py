@@ -0,0 +1,118 @@
+"""
+Pruebas de regresión del cálculo de riesgo con dtypes compactos.
+
+Las capas sintéticas (uint8) recorren todas las combinaciones de valores que enumera
+elegir_dtype_calculo(): cada flood 0-10, cada valor de landslide y cada máscara 0/1. El resultado
+en el dtype elegido debe coincidir con la fórmula original en float64, y riesgo.csv debe ser
+idéntico byte a byte entre el cálculo en memoria y el cálculo por bandas.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calcular_riesgo as cr
+
+FLOOD = range(0, 11)
+MASCARA = (0, 1)
+
+
+def _combinaciones(landslide_max):
+    """
+    Capas con una celda por combinación (flood, landslide, water, urban, area_protegida),
+    ordenadas en una grilla de 2 * (landslide_max + 1) filas.
+    """
+    combinaciones = np.array(list(itertools.product(FLOOD, range(landslide_max + 1), MASCARA, MASCARA, MASCARA)),
+                             dtype=np.uint8)
+    filas = 2 * (landslide_max + 1)
+    return {nombre: combinaciones[:, i].reshape(filas, -1)
+            for i, nombre in enumerate(('flood', 'landslide', 'water', 'urban', 'area_protegida'))}
+
+
+def _riesgo_float64(capas):
+    """
+    Fórmula de referencia en float64, como antes de los dtypes compactos.
+    """
+    flood = capas['flood'].astype(np.float64)
+    landslide = cr.normalizar_valores(capas['landslide'].astype(np.float64), *cr.RANGO_LANDSLIDE)
+    water = capas['water'].astype(np.float64)
+    urban = capas['urban'].astype(np.float64)
+    area_protegida = capas['area_protegida'].astype(np.float64)
+
+    riesgo = (flood + landslide) * 0.5 * water * (1 - urban) * area_protegida
+    factor = water * (1 - urban) * area_protegida
+    riesgo[(factor != 0) & (flood == 0)] = cr.VALOR_SIN_DATO
+    return riesgo
+
+
+# landslide 0-4: float32 es exacto; 0-7: algún (flood + landslide) * 0.5 no es exacto en float32
+DTYPE_ESPERADO = {4: np.float32, 7: np.float64}
+
+
+@pytest.fixture(params=sorted(DTYPE_ESPERADO), ids=lambda maximo: f'landslide_0_{maximo}')
+def entrada(request, tmp_path, escribir_capas):
+    capas = _combinaciones(request.param)
+    return escribir_capas(tmp_path / 'capas', capas), capas
+
+
+def test_elegir_dtype_calculo_compacto(entrada):
+    directorio, capas = entrada
+    datos = cr.preparar_entradas(directorio)
+
+    assert datos['dtype'] == DTYPE_ESPERADO[int(capas['landslide'].max())]
+    for nombre in ('flood', 'water', 'urban', 'area_protegida'):
+        assert datos[nombre].dtype == np.uint8
+
+
+@pytest.mark.parametrize('con_mascara', [True, False], ids=['bits', 'sin_bits'])
+def test_aplicar_formula_igual_a_float64(entrada, con_mascara):
+    directorio, capas = entrada
+    datos = cr.preparar_entradas(directorio)
+
+    riesgo = cr.aplicar_formula(datos['flood'], datos['landslide'], datos['water'], datos['urban'],
+                                datos['area_protegida'], datos['dtype'],
+                                valido=datos['valido'].desempaquetar() if con_mascara else None)
+
+    assert riesgo.dtype == datos['dtype']
+    np.testing.assert_array_equal(riesgo.astype(np.float64), _riesgo_float64(capas))
+
+
+@pytest.mark.parametrize('metodo', ['fusionado', 'clasico'])
+def test_calcular_riesgo_igual_a_float64(entrada, tmp_path, monkeypatch, metodo):
+    directorio, capas = entrada
+    salida = tmp_path / 'salida'
+    salida.mkdir()
+    monkeypatch.chdir(salida)
+
+    cr.calcular_riesgo(forzar=True, metodo=metodo, workers=1, generar_jpeg=False,
+                       directorio_entrada=directorio, incremental=False)
+
+    riesgo = np.load(salida / 'riesgo.npy')
+    esperado = _riesgo_float64(capas)
+    np.testing.assert_array_equal(riesgo.astype(np.float64), esperado)
+
+    # riesgo.csv como lo escribía pandas a partir de la matriz float64
+    csv_float64 = pd.DataFrame(esperado).to_csv(header=False, index=False)
+    assert (salida / 'riesgo.csv').read_text() == csv_float64
+
+
+def test_riesgo_csv_igual_en_memoria_y_por_bandas(entrada, tmp_path, monkeypatch):
+    directorio, _ = entrada
+    en_memoria = tmp_path / 'en_memoria'
+    por_bandas = tmp_path / 'por_bandas'
+    en_memoria.mkdir()
+    por_bandas.mkdir()
+
+    monkeypatch.chdir(en_memoria)
+    cr.calcular_riesgo(forzar=True, workers=1, generar_jpeg=False, directorio_entrada=directorio,
+                       incremental=False)
+
+    # Bandas de 3 filas: la última queda incompleta
+    monkeypatch.chdir(por_bandas)
+    cr.calcular_riesgo_por_bandas(filas_por_banda=3, generar_jpeg=False, forzar=True, workers=1,
+                                  directorio_entrada=directorio, incremental=False)
+
+    assert (en_memoria / 'riesgo.csv').read_bytes() == (por_bandas / 'riesgo.csv').read_bytes()
+    np.testing.assert_array_equal(np.load(en_memoria / 'riesgo.npy'), np.load(por_bandas / 'riesgo.npy'))
@@ -0,0 +1,65 @@
+"""
+Pruebas del exportador CSV paralelo (exportar_csv.py).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from exportar_csv import exportar_csv, formatear_valor
+
+
+@pytest.fixture
+def matriz():
+    # Valores con repr largo o exponente además de los del riesgo, y NaN
+    generador = np.random.default_rng(5)
+    valores = [0.0, 0.5, 4.5, 10.0, 99.0, 1 / 3, 2.2, 1e-7, 1.5e16, -3.75, np.nan]
+    return generador.choice(valores, size=(23, 17))
+
+
+def _csv_pandas(matriz):
+    return pd.DataFrame(matriz.astype(np.float64)).to_csv(header=False, index=False).encode('ascii')
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_igual_a_pandas_float64(matriz, tmp_path, dtype):
+    ruta = tmp_path / 'riesgo.csv'
+    matriz = matriz.astype(dtype)
+
+    escritos = exportar_csv(matriz, str(ruta), workers=1, filas_por_bloque=5)
+    assert ruta.read_bytes() == _csv_pandas(matriz)
+    assert escritos == ruta.stat().st_size
+
+
+def test_paralelo_y_por_bandas_igual_a_un_proceso(matriz, tmp_path):
+    exportar_csv(matriz, str(tmp_path / 'uno.csv'), workers=1)
+    # Bloques de 2 filas con 3 procesos: más bloques que la ventana de bloques en vuelo
+    exportar_csv(matriz, str(tmp_path / 'paralelo.csv'), workers=3, filas_por_bloque=2)
+
+    ruta_bandas = tmp_path / 'bandas.csv'
+    ruta_bandas.write_bytes(b'')
+    for inicio in range(0, matriz.shape[0], 10):
+        exportar_csv(matriz[inicio:inicio + 10], str(ruta_bandas), workers=1, filas_por_bloque=4, modo='a')
+
+    esperado = (tmp_path / 'uno.csv').read_bytes()
+    assert (tmp_path / 'paralelo.csv').read_bytes() == esperado
+    assert ruta_bandas.read_bytes() == esperado
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_formatos(matriz, tmp_path):
+    assert formatear_valor(4.5) == '4.5'
+    assert formatear_valor(4.5, precision=2) == '4.50'
+    assert formatear_valor(99.0, enteros=True) == '99'
+    assert formatear_valor(4.5, enteros=True) == '4.5'
+    assert formatear_valor(float('nan'), precision=2) == ''
+
+    ruta = tmp_path / 'riesgo.csv'
+    exportar_csv(matriz, str(ruta), precision=3, workers=1)
+    leida = pd.read_csv(ruta, header=None).to_numpy()
+    np.testing.assert_allclose(leida, np.round(matriz, 3), rtol=0, atol=0)
+
+    exportar_csv(matriz, str(ruta), enteros=True, workers=1)
+    primera = ruta.read_text().splitlines()[0].split(',')
+    assert primera == [formatear_valor(float(v), enteros=True) for v in matriz[0]]
+    np.testing.assert_array_equal(pd.read_csv(ruta, header=None).to_numpy(), matriz)
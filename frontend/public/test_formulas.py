@@ -0,0 +1,155 @@
+"""
+Pruebas del motor declarativo de fórmulas de amenazas (formulas.py).
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+import calcular_riesgo as cr
+from formulas import CONFIG_AMENAZAS, cargar_config, compilar, evaluar_amenazas, preparar_normalizaciones
+
+FORMA = (40, 30)
+
+
+@pytest.fixture
+def capas(capas_aleatorias):
+    return capas_aleatorias(FORMA, 4)
+
+
+def _config(expresiones=None, amenazas=None, normalizaciones=None):
+    return {
+        'capas': {nombre: {'archivo': archivo} for nombre, archivo in cr.ARCHIVOS_CAPAS.items()},
+        'normalizaciones': normalizaciones or {},
+        'expresiones': expresiones or {},
+        'amenazas': {nombre: {'expresion': expresion} for nombre, expresion in (amenazas or {}).items()}
+    }
+
+
+def _evaluar(config, capas):
+    """
+    Evalúa todas las amenazas de la configuración sobre las capas en un solo bloque.
+    """
+    plan = compilar(config)
+    metas = {nombre: {'dtype': capa.dtype.str, 'min': int(capa.min()), 'max': int(capa.max())}
+             for nombre, capa in capas.items()}
+    normalizaciones = preparar_normalizaciones(config, plan.normalizaciones, metas)
+    buffers = [np.empty(FORMA, dtype=dtype) for dtype in plan.buffers]
+    resultados = plan.evaluar_bloque(capas, buffers, normalizaciones, FORMA[0])
+    return plan, {nombre: np.array(valores) for nombre, valores in resultados.items()}
+
+
+def _contar(plan, operacion):
+    return sum(1 for indice in plan.instrucciones if plan.nodos[indice][0] == operacion)
+
+
+def test_subexpresiones_comunes_y_constantes(capas):
+    config = _config(expresiones={'factor': 'water * (1 - urban) * area_protegida'},
+                     amenazas={'a': 'flood * factor * (2 * 3)', 'b': '(1 - urban) * water * area_protegida + flood',
+                               'c': 'where(factor, flood, -1)'})
+    plan, resultados = _evaluar(config, capas)
+
+    # El factor se calcula una vez aunque 'b' lo escriba en otro orden, y 2 * 3 se pliega al compilar
+    assert _contar(plan, 'subtract') == 1
+    assert _contar(plan, 'multiply') == 2 + 2
+    assert ('const', 6.0) in plan.nodos
+
+    flood, water, urban, area = (capas[n].astype(np.float64) for n in ('flood', 'water', 'urban', 'area_protegida'))
+    factor = water * (1 - urban) * area
+    np.testing.assert_array_equal(resultados['a'], flood * factor * 6)
+    np.testing.assert_array_equal(resultados['b'], factor + flood)
+    np.testing.assert_array_equal(resultados['c'], np.where(factor != 0, flood, -1))
+
+
+def test_operadores_y_funciones(capas):
+    config = _config(amenazas={
+        'comparacion': '1 < flood <= 7',
+        'logica': '(water == 1) & ~(urban == 1) | (flood > 9)',
+        'funciones': 'clip(abs(flood - 5), 1, 3) + minimum(flood, landslide) - maximum(water, urban) ** 2',
+        'division': 'flood / (landslide + 1)'
+    })
+    _, resultados = _evaluar(config, capas)
+
+    flood, landslide, water, urban = (capas[n].astype(np.float64) for n in ('flood', 'landslide', 'water', 'urban'))
+    np.testing.assert_array_equal(resultados['comparacion'], (1 < flood) & (flood <= 7))
+    np.testing.assert_array_equal(resultados['logica'], (water == 1) & ~(urban == 1) | (flood > 9))
+    np.testing.assert_array_equal(resultados['funciones'],
+                                  np.clip(abs(flood - 5), 1, 3) + np.minimum(flood, landslide)
+                                  - np.maximum(water, urban) ** 2)
+    np.testing.assert_array_equal(resultados['division'], flood / (landslide + 1))
+
+
+def test_normalizaciones(capas):
+    config = _config(
+        normalizaciones={'rango': {'capa': 'landslide', 'tipo': 'rango', 'min': 1, 'max': 10},
+                         'clases': {'capa': 'flood', 'tipo': 'valores', 'valores': {'0': 5, '10': 1.5}, 'defecto': 2}},
+        amenazas={'rango': 'rango', 'clases': 'clases'})
+    _, resultados = _evaluar(config, capas)
+
+    np.testing.assert_array_equal(resultados['rango'],
+                                  cr.normalizar_valores(capas['landslide'].astype(np.float64), *cr.RANGO_LANDSLIDE))
+    esperado = np.where(capas['flood'] == 0, 5.0, np.where(capas['flood'] == 10, 1.5, 2.0))
+    np.testing.assert_array_equal(resultados['clases'], esperado)
+
+
+@pytest.mark.parametrize('expresiones, expresion, mensaje', [
+    ({'x': 'y + 1', 'y': 'x * 2'}, 'x', 'circular'),
+    ({}, 'sequia * 2', 'no es una capa'),
+    ({}, 'flood.real', 'no admitido'),
+    ({}, '__import__("os")', 'no admitido'),
+    ({}, 'clip(flood, 1)', 'argumentos'),
+    ({}, 'flood +', 'inválida'),
+])
+def test_errores_de_configuracion(expresiones, expresion, mensaje):
+    with pytest.raises(ValueError, match=mensaje):
+        compilar(_config(expresiones=expresiones, amenazas={'a': expresion}))
+
+
+def test_config_incluida_igual_a_calcular_riesgo(capas, tmp_path, monkeypatch, escribir_capas):
+    entrada = escribir_capas(tmp_path / 'capas', capas)
+
+    salida = tmp_path / 'amenazas'
+    # Bloques de 7 filas: la última queda incompleta
+    resumenes = evaluar_amenazas(CONFIG_AMENAZAS, entrada, str(salida), amenazas=['riesgo', 'inundacion'],
+                                 elementos_por_bloque=7 * FORMA[1])
+    assert set(resumenes) == {'riesgo', 'inundacion'}
+
+    riesgo_calculado = tmp_path / 'riesgo'
+    riesgo_calculado.mkdir()
+    monkeypatch.chdir(riesgo_calculado)
+    cr.calcular_riesgo(forzar=True, csv=False, generar_jpeg=False, directorio_entrada=entrada, incremental=False)
+
+    riesgo = np.load(riesgo_calculado / 'riesgo.npy').astype(np.float64)
+    np.testing.assert_array_equal(np.load(salida / 'riesgo.npy'), riesgo)
+    with open(salida / 'riesgo_scale.json', encoding='utf-8') as f:
+        actual_data = json.load(f)['color_scheme']['value_range']['actual_data']
+    assert actual_data == resumenes['riesgo']
+    assert actual_data['no_data_count'] == int(np.count_nonzero(riesgo == 99))
+    assert not list(salida.glob('*.tmp'))
+
+    # Sin cambios en las capas ni en la configuración no se recalcula
+    assert evaluar_amenazas(CONFIG_AMENAZAS, entrada, str(salida), amenazas=['riesgo', 'inundacion']) is None
+
+
+def test_sin_dato_nan_en_escala(capas, tmp_path, escribir_capas):
+    entrada = escribir_capas(tmp_path / 'capas', capas)
+    ruta_config = tmp_path / 'config.json'
+    ruta_config.write_text(json.dumps(_config(amenazas={'cociente': 'flood * water / water'})))
+
+    # Sin 'sin_dato' declarado, los 0 / 0 (NaN) se cuentan como sin dato en la escala
+    resumen = evaluar_amenazas(str(ruta_config), entrada, str(tmp_path / 'salida'))['cociente']
+    assert resumen['no_data_count'] == int(np.count_nonzero(capas['water'] == 0))
+    assert resumen['count'] == int(np.count_nonzero(capas['water'] == 1))
+    assert resumen['max'] == float(capas['flood'][capas['water'] == 1].max())
+
+
+def test_cargar_config_incompleta(tmp_path):
+    ruta_config = tmp_path / 'config.json'
+    ruta_config.write_text(json.dumps({'capas': {'flood': {}}, 'amenazas': {}}))
+    with pytest.raises(ValueError, match='archivo'):
+        cargar_config(str(ruta_config))
+
+    ruta_config.write_text(json.dumps({'capas': {}}))
+    with pytest.raises(ValueError, match='amenazas'):
+        cargar_config(str(ruta_config))
@@ -0,0 +1,84 @@
+"""
+Pruebas del histograma acumulable de valores válidos del riesgo (histograma.py).
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from histograma import HistogramaRiesgo, leer_estiramiento, rango_estirado
+
+
+@pytest.fixture
+def riesgo():
+    generador = np.random.default_rng(0)
+    matriz = generador.choice([0.0, 1.0, 2.5, 4.5, 7.0, 10.0, 99.0], size=(64, 48)).astype(np.float32)
+    matriz[5, :10] = np.nan
+    return matriz
+
+
+def test_resumen_igual_a_numpy(riesgo):
+    histograma = HistogramaRiesgo().actualizar_por_bloques(riesgo, filas_por_bloque=7)
+    validos = riesgo[(riesgo != 99) & ~np.isnan(riesgo)].astype(np.float64)
+
+    resumen = histograma.resumen()
+    assert resumen['min'] == validos.min()
+    assert resumen['max'] == validos.max()
+    assert resumen['mean'] == pytest.approx(validos.mean())
+    assert resumen['count'] == validos.size
+    assert resumen['no_data_count'] == np.count_nonzero(riesgo == 99)
+    assert resumen['zero_count'] == np.count_nonzero(riesgo == 0)
+    # Pocos valores distintos: cada intervalo tiene un solo valor y los cuantiles son exactos
+    for p in (1, 25, 50, 75, 99):
+        assert histograma.cuantil(p / 100) == np.percentile(validos, p, method='inverted_cdf')
+    clases = np.bincount(np.minimum(validos, 10).astype(int), minlength=11)
+    assert [resumen['class_histogram'][str(k)] for k in range(11)] == clases.tolist()
+
+
+def test_combinar_igual_a_una_pasada(riesgo):
+    completo = HistogramaRiesgo().actualizar(riesgo)
+    partes = HistogramaRiesgo().actualizar(riesgo[:30])
+    partes += HistogramaRiesgo().actualizar(riesgo[30:])
+
+    assert partes.resumen() == completo.resumen()
+    with pytest.raises(ValueError):
+        partes.combinar(HistogramaRiesgo(bins=10))
+
+
+def test_serializacion(riesgo):
+    histograma = HistogramaRiesgo().actualizar(riesgo)
+    copia = HistogramaRiesgo.desde_dict(json.loads(json.dumps(histograma.a_dict())))
+    assert copia.resumen() == histograma.resumen()
+
+
+def test_valor_sin_dato_nan():
+    bloque = np.array([[np.nan, 1.0, 2.0], [99.0, np.nan, 0.0]])
+    histograma = HistogramaRiesgo(valor_sin_dato=np.nan).actualizar(bloque)
+
+    # Con sin dato NaN, los NaN se cuentan como sin dato y 99 es un valor válido más
+    assert histograma.count_sin_dato == 2
+    assert histograma.cantidad == 4
+    assert histograma.maximo == 99.0
+
+    otro = HistogramaRiesgo(valor_sin_dato=float('nan')).actualizar(bloque)
+    histograma.combinar(otro)
+    assert histograma.count_sin_dato == 4
+
+    texto = json.dumps(histograma.a_dict(), allow_nan=False)
+    copia = HistogramaRiesgo.desde_dict(json.loads(texto))
+    assert np.isnan(copia.valor_sin_dato)
+    assert copia.resumen() == histograma.resumen()
+
+    with pytest.raises(ValueError):
+        histograma.combinar(HistogramaRiesgo())
+
+
+def test_estiramiento(riesgo):
+    assert leer_estiramiento('2,98') == (2.0, 98.0)
+    with pytest.raises(ValueError):
+        leer_estiramiento('98,2')
+
+    histograma = HistogramaRiesgo().actualizar(riesgo)
+    assert rango_estirado(histograma, (0, 100)) == (0.0, 10.0)
+    assert rango_estirado(HistogramaRiesgo(), (2, 98)) is None
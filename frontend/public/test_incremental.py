@@ -0,0 +1,103 @@
+"""
+Pruebas del recálculo incremental del riesgo por teselas (incremental.py).
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import calcular_riesgo as cr
+from incremental import teselas_sucias
+
+# 2 x 3 teselas de 256: la última fila y columna de teselas quedan incompletas
+FORMA = (300, 520)
+
+
+@pytest.fixture
+def entrada(tmp_path, capas_aleatorias, escribir_capas):
+    capas = capas_aleatorias(FORMA, 6)
+    return escribir_capas(tmp_path / 'capas', capas), capas
+
+
+def _calcular(directorio, monkeypatch, entrada, **opciones):
+    os.makedirs(directorio, exist_ok=True)
+    monkeypatch.chdir(directorio)
+    cr.calcular_riesgo(teselas=True, workers=1, directorio_entrada=entrada, **opciones)
+
+
+def _archivos(directorio):
+    """
+    {ruta relativa: bytes} de las salidas que el incremental parchea o reescribe.
+    """
+    archivos = {}
+    for nombre in ('riesgo.npy', 'riesgo.csv', 'riesgo.jpeg', 'riesgo_scale.json', 'riesgo_almacen', 'teselas'):
+        ruta = os.path.join(directorio, nombre)
+        rutas = [ruta] if os.path.isfile(ruta) else [os.path.join(base, archivo)
+                                                     for base, _, nombres in os.walk(ruta) for archivo in nombres]
+        for ruta_archivo in rutas:
+            with open(ruta_archivo, 'rb') as f:
+                archivos[os.path.relpath(ruta_archivo, directorio)] = f.read()
+    return archivos
+
+
+def _estadisticas(salida):
+    """
+    Bloque de estadísticas que muestra calcular_riesgo().
+    """
+    lineas = salida.splitlines()
+    inicio = lineas.index("Estadísticas del riesgo calculado:")
+    return lineas[inicio:inicio + 6]
+
+
+def test_parche_igual_a_calculo_completo(entrada, tmp_path, monkeypatch, capsys, escribir_capas):
+    directorio, capas = entrada
+    incremental = str(tmp_path / 'incremental')
+    _calcular(incremental, monkeypatch, directorio)
+
+    # Cambia flood solo dentro de la tesela 1.1
+    capas['flood'][260:270, 300:310] = 10
+    escribir_capas(directorio, capas)
+    capsys.readouterr()
+    _calcular(incremental, monkeypatch, directorio)
+    salida_incremental = capsys.readouterr().out
+    assert "Recálculo incremental: 1 de 6 teselas cambiaron" in salida_incremental
+
+    completo = str(tmp_path / 'completo')
+    _calcular(completo, monkeypatch, directorio, incremental=False)
+    # Mismas estadísticas (con los 99) que el cálculo completo
+    assert _estadisticas(salida_incremental) == _estadisticas(capsys.readouterr().out)
+
+    archivos = _archivos(completo)
+    assert any(ruta.startswith('teselas') for ruta in archivos)
+    assert _archivos(incremental) == archivos
+
+
+def test_cambio_de_rango_de_landslide_recalcula_todo(entrada, tmp_path, monkeypatch, capsys, escribir_capas):
+    directorio, capas = entrada
+    salida = str(tmp_path / 'salida')
+    _calcular(salida, monkeypatch, directorio)
+
+    # Un solo valor nuevo cambia el máximo de landslide y con él la normalización de toda la grilla
+    capas['landslide'][0, 0] = 9
+    escribir_capas(directorio, capas)
+    capsys.readouterr()
+    _calcular(salida, monkeypatch, directorio)
+    assert "Recálculo completo" in capsys.readouterr().out
+
+    datos = cr.preparar_entradas(directorio)
+    esperado = cr.aplicar_formula(datos['flood'], datos['landslide'], datos['water'], datos['urban'],
+                                  datos['area_protegida'], datos['dtype'])
+    np.testing.assert_array_equal(np.load(os.path.join(salida, 'riesgo.npy')), esperado)
+
+
+def test_teselas_sucias():
+    anterior = {'forma': [300, 520], 'tamano_tesela': [256, 256], 'dtype': '<f4',
+                'landslide': {'min': 0, 'max': 4},
+                'hashes': {'flood': {'0.0': 'a', '0.1': 'b', '1.0': 'c'}, 'water': {'0.0': 'd', '1.0': 'e'}}}
+    actual = {**anterior, 'hashes': {'flood': {'0.0': 'a', '0.1': 'x', '1.0': 'c'},
+                                     'water': {'0.0': 'd', '1.0': 'y'}}}
+    assert teselas_sucias(anterior, actual) == ['0.1', '1.0']
+    assert teselas_sucias(anterior, anterior) == []
+    assert teselas_sucias(anterior, {**actual, 'dtype': '<f8'}) is None
+    assert teselas_sucias(None, actual) is None
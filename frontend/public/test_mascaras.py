@@ -0,0 +1,76 @@
+"""
+Pruebas de las máscaras binarias empaquetadas en bits (mascaras.py).
+"""
+
+import numpy as np
+import pytest
+
+from mascaras import MascaraBits, es_binaria
+
+# 29 columnas: el último byte de cada fila tiene 3 bits de relleno
+FORMA = (37, 29)
+
+
+@pytest.fixture
+def mascaras():
+    generador = np.random.default_rng(8)
+    return [generador.integers(0, 2, FORMA, dtype=np.uint8) for _ in range(3)]
+
+
+def test_operaciones_igual_a_bool(mascaras):
+    water, urban, area = mascaras
+    # Bloques de 5 filas al empaquetar: el último queda incompleto
+    a, b, c = (MascaraBits.desde_matriz(m, filas_por_bloque=5) for m in mascaras)
+
+    valido = a & ~b & c
+    esperado = (water == 1) & (urban == 0) & (area == 1)
+    np.testing.assert_array_equal(valido.desempaquetar(), esperado)
+    # Es exactamente donde el factor de la fórmula vale 1
+    np.testing.assert_array_equal(esperado, water * (1 - urban.astype(np.int16)) * area == 1)
+    np.testing.assert_array_equal((a | b).desempaquetar(), (water == 1) | (urban == 1))
+    assert valido.contar() == int(esperado.sum())
+    assert valido.shape == FORMA and valido.nbytes == FORMA[0] * 4
+
+
+def test_relleno_en_cero(mascaras):
+    a = MascaraBits.desde_matriz(mascaras[0])
+    negada = ~a
+    # Los 3 bits de relleno del último byte siguen en 0 después de ~
+    assert not np.any(negada.bits[:, -1] & 0b111)
+    assert negada.contar() == FORMA[0] * FORMA[1] - a.contar()
+    assert ~negada == a
+    assert ~MascaraBits.desde_matriz(np.zeros(FORMA)) == MascaraBits.desde_matriz(np.ones(FORMA))
+
+
+def test_recortes(mascaras):
+    matriz = mascaras[0]
+    a = MascaraBits.desde_matriz(matriz)
+
+    assert a[10:20] == MascaraBits.desde_matriz(matriz[10:20])
+    np.testing.assert_array_equal(a.desempaquetar(3, 9), matriz[3:9] == 1)
+    for columnas in (29, 24, 13):
+        assert a.recortar(30, columnas) == MascaraBits.desde_matriz(matriz[:30, :columnas])
+    with pytest.raises(TypeError):
+        a[3]
+    with pytest.raises(ValueError):
+        a & a.recortar(30, 29)
+
+
+def test_aplicar(mascaras):
+    valido = MascaraBits.desde_matriz(mascaras[0])
+    densa = np.random.default_rng(9).random(FORMA)
+    esperado = np.where(mascaras[0] == 1, densa, 99.0)
+
+    np.testing.assert_array_equal(valido.aplicar(densa, 99.0, filas_por_bloque=4), esperado)
+    en_el_lugar = densa.copy()
+    assert valido.aplicar(en_el_lugar, 99.0, out=en_el_lugar) is en_el_lugar
+    np.testing.assert_array_equal(en_el_lugar, esperado)
+    with pytest.raises(ValueError):
+        valido.aplicar(densa[:10], 99.0)
+
+
+def test_es_binaria():
+    assert es_binaria({'dtype': '|u1', 'min': 0, 'max': 1})
+    assert es_binaria({'dtype': '<i8', 'min': 1, 'max': 1})
+    assert not es_binaria({'dtype': '|u1', 'min': 0, 'max': 2})
+    assert not es_binaria({'dtype': '<f8', 'min': 0, 'max': 1})
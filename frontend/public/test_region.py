@@ -0,0 +1,98 @@
+"""
+Pruebas del cálculo de riesgo restringido a una región de interés (region.py).
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import calcular_riesgo as cr
+from region import calcular_riesgo_region, cargar_mascara_region, mascara_region, teselas_region
+
+FORMA = (150, 140)
+TESELA = 64
+
+
+@pytest.fixture
+def entrada(tmp_path, capas_aleatorias, escribir_capas):
+    """
+    Capas sintéticas en tmp_path/capas y el riesgo de la grilla completa como referencia.
+    """
+    directorio = escribir_capas(tmp_path / 'capas', capas_aleatorias(FORMA, 2))
+    datos = cr.preparar_entradas(directorio)
+    referencia = cr.aplicar_formula(datos['flood'], datos['landslide'], datos['water'], datos['urban'],
+                                    datos['area_protegida'], datos['dtype'])
+    return directorio, referencia
+
+
+@pytest.fixture
+def region_con_hueco(poligono):
+    return [poligono(FORMA, 10, 40, 20, 60), poligono(FORMA, 20, 30, 30, 40)]
+
+
+def test_mascara_geojson_con_hueco(tmp_path, region_con_hueco):
+    geojson = tmp_path / 'region.geojson'
+    geojson.write_text(json.dumps({'type': 'Feature', 'properties': {},
+                                   'geometry': {'type': 'Polygon', 'coordinates': region_con_hueco}}))
+
+    esperada = np.zeros(FORMA, dtype=bool)
+    esperada[20:60, 10:40] = True
+    esperada[30:40, 20:30] = False
+    np.testing.assert_array_equal(mascara_region(FORMA, geojson=str(geojson)), esperada)
+
+    # Intersección con un rectángulo en píxeles
+    recortada = mascara_region(FORMA, geojson=str(geojson), bbox_pixeles=(0, 25, 0, 150))
+    np.testing.assert_array_equal(recortada, esperada & (np.arange(FORMA[0]) < 25)[:, None])
+
+    with pytest.raises(ValueError):
+        mascara_region(FORMA)
+
+
+def test_mascara_en_cache(tmp_path):
+    directorio_cache = str(tmp_path / 'cache')
+    mascara = cargar_mascara_region(FORMA, bbox_pixeles=(5, 50, 60, 90), directorio_cache=directorio_cache)
+
+    archivos = os.listdir(directorio_cache)
+    assert len(archivos) == 1 and archivos[0].startswith('region_') and archivos[0].endswith('.npy')
+    np.testing.assert_array_equal(
+        cargar_mascara_region(FORMA, bbox_pixeles=(5, 50, 60, 90), directorio_cache=directorio_cache), mascara)
+
+
+def test_teselas_region():
+    mascara = np.zeros(FORMA, dtype=bool)
+    mascara[70, 10] = True
+    mascara[140:, 130:] = True
+    assert teselas_region(mascara, TESELA) == [(1, 0), (2, 2)]
+
+
+def test_riesgo_region_igual_a_grilla_completa(entrada, tmp_path):
+    directorio, referencia = entrada
+    salida = str(tmp_path / 'region')
+
+    resumen = calcular_riesgo_region(bbox_pixeles=(50, 130, 70, 135), directorio_entrada=directorio,
+                                     directorio_salida=salida, generar_jpeg=False, tamano_tesela=TESELA)
+
+    riesgo = np.load(os.path.join(salida, 'riesgo.npy'))
+    np.testing.assert_array_equal(riesgo, referencia[50:130, 70:135])
+    assert resumen['desplazamiento'] == [50, 70]
+    assert resumen['dimensiones'] == [80, 65]
+    assert resumen['teselas_calculadas'] == 3 * 2
+    assert resumen['celdas_region'] == 80 * 65
+    assert not [archivo for archivo in os.listdir(salida) if archivo.endswith('.tmp')]
+
+
+def test_riesgo_region_nan_fuera_del_poligono(entrada, tmp_path, region_con_hueco):
+    directorio, referencia = entrada
+    geojson = tmp_path / 'region.geojson'
+    geojson.write_text(json.dumps({'type': 'Polygon', 'coordinates': region_con_hueco}))
+    salida = str(tmp_path / 'region')
+
+    calcular_riesgo_region(geojson=str(geojson), directorio_entrada=directorio, directorio_salida=salida,
+                           generar_jpeg=False, tamano_tesela=TESELA)
+
+    riesgo = np.load(os.path.join(salida, 'riesgo.npy'))
+    esperado = referencia[20:60, 10:40].astype(riesgo.dtype)
+    esperado[10:20, 10:20] = np.nan
+    np.testing.assert_array_equal(riesgo, esperado)
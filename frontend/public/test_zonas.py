@@ -0,0 +1,99 @@
+"""
+Pruebas de las estadísticas zonales del riesgo (zonas.py).
+"""
+
+import csv
+import json
+import os
+
+import numpy as np
+import pytest
+
+from almacen import escribir_almacen
+from zonas import CLASES, calcular_zonas, estadisticas_zonales, rasterizar_zonas
+
+FORMA = (60, 50)
+
+
+@pytest.fixture
+def riesgo():
+    generador = np.random.default_rng(3)
+    matriz = generador.choice([0.0, 0.5, 3.25, 9.5, 10.0, 12.0, 99.0], size=FORMA)
+    matriz[generador.random(FORMA) < 0.05] = np.nan
+    return matriz
+
+
+@pytest.fixture
+def geojson(tmp_path, poligono):
+    # Dos rectángulos superpuestos (la superposición queda en el segundo) y uno fuera de la grilla
+    caracteristicas = [
+        {'type': 'Feature', 'properties': {'nombre': 'Norte', 'id': 'N'},
+         'geometry': {'type': 'Polygon', 'coordinates': [poligono(FORMA, 0, 30, 0, 20)]}},
+        {'type': 'Feature', 'properties': {'name': 'Centro'},
+         'geometry': {'type': 'Polygon', 'coordinates': [poligono(FORMA, 20, 50, 10, 40)]}},
+        {'type': 'Feature', 'properties': {},
+         'geometry': {'type': 'Polygon', 'coordinates': [poligono(FORMA, 60, 70, 70, 80)]}}
+    ]
+    ruta = tmp_path / 'zonas.geojson'
+    ruta.write_text(json.dumps({'type': 'FeatureCollection', 'features': caracteristicas}))
+    return str(ruta)
+
+
+def _estadisticas_por_zona(riesgo, etiquetas, numero):
+    valores = riesgo[etiquetas == numero]
+    validos = valores[(valores != 99) & ~np.isnan(valores)]
+    return {
+        'celdas': int(valores.size),
+        'celdas_validas': int(validos.size),
+        'promedio': pytest.approx(float(validos.mean())) if validos.size else None,
+        'min': float(validos.min()) if validos.size else None,
+        'max': float(validos.max()) if validos.size else None,
+        'count_99': int(np.count_nonzero(valores == 99)),
+        'count_nan': int(np.count_nonzero(np.isnan(valores))),
+        'histograma': np.bincount(np.minimum(validos, CLASES - 1).astype(int), minlength=CLASES).tolist()
+    }
+
+
+def test_rasterizar_zonas(geojson):
+    etiquetas, zonas = rasterizar_zonas(geojson, FORMA)
+
+    esperadas = np.zeros(FORMA, dtype=etiquetas.dtype)
+    esperadas[0:20, 0:30] = 1
+    esperadas[10:40, 20:50] = 2
+    np.testing.assert_array_equal(etiquetas, esperadas)
+    assert zonas == [{'id': 'N', 'nombre': 'Norte'}, {'id': 2, 'nombre': 'Centro'}, {'id': 3, 'nombre': 'zona_3'}]
+
+
+def test_estadisticas_igual_a_recorrer_cada_zona(riesgo, geojson):
+    etiquetas, zonas = rasterizar_zonas(geojson, FORMA)
+    resultados = estadisticas_zonales(riesgo, etiquetas, zonas)
+
+    for numero, resultado in enumerate(resultados, start=1):
+        for clave, valor in _estadisticas_por_zona(riesgo, etiquetas, numero).items():
+            assert resultado[clave] == valor, (numero, clave)
+
+    # La zona fuera de la grilla no tiene celdas
+    assert resultados[2]['celdas'] == 0 and resultados[2]['promedio'] is None
+
+    with pytest.raises(ValueError):
+        estadisticas_zonales(riesgo[:10], etiquetas, zonas)
+
+
+def test_calcular_zonas_desde_npy_y_almacen(riesgo, geojson, tmp_path):
+    ruta_npy = str(tmp_path / 'riesgo.npy')
+    np.save(ruta_npy, riesgo)
+    escribir_almacen(riesgo, str(tmp_path / 'riesgo_almacen'), tamano_chunk=(16, 16))
+
+    desde_npy = calcular_zonas(geojson, ruta_npy, str(tmp_path / 'zonas.json'))
+    desde_almacen = calcular_zonas(geojson, str(tmp_path / 'riesgo_almacen'), str(tmp_path / 'zonas.csv'))
+    assert desde_npy == desde_almacen
+
+    # La rasterización queda en la caché junto al riesgo
+    assert any(nombre.startswith('zonas_') for nombre in os.listdir(tmp_path / '.cache_capas'))
+
+    with open(tmp_path / 'zonas.json', encoding='utf-8') as f:
+        assert json.load(f)['zonas'] == desde_npy
+    with open(tmp_path / 'zonas.csv', encoding='utf-8', newline='') as f:
+        filas = list(csv.reader(f))
+    assert filas[0][-1] == f'clase_{CLASES - 1}'
+    assert [fila[1] for fila in filas[1:]] == ['Norte', 'Centro', 'zona_3']
@@ -0,0 +1,235 @@
+"""
+Estadísticas zonales del riesgo por polígono (departamentos, áreas protegidas, etc.).
+
+La capa de polígonos (GeoJSON) se rasteriza una sola vez a una grilla de etiquetas
+(0 = fuera de toda zona, 1..N = número de zona en el orden del archivo) con las mismas
+dimensiones y límites geográficos que el riesgo, y se guarda en la caché de capas
+(.cache_capas/zonas_<clave>.npz) junto con el orden de las celdas agrupadas por zona.
+Si dos polígonos se superponen, la celda queda en el último.
+
+Todas las zonas se resumen en una sola pasada vectorizada sobre la matriz de riesgo,
+sin recorrer los polígonos:
+- un np.bincount de (zona, clase) da a la vez el histograma de clases 0-10, la cantidad
+  de celdas sin dato (99) y de celdas sin valor (NaN) de cada zona;
+- un np.bincount con pesos da la suma de los valores válidos (para el promedio);
+- np.minimum/maximum.reduceat sobre las celdas ordenadas por zona dan mínimo y máximo.
+
+La clase k del histograma cuenta los valores válidos en [k, k + 1); la clase 10 incluye
+el 10 y los valores mayores (p. ej. escenarios con peso > 0.5).
+
+Salida (JSON para el frontend, o CSV según la extensión):
+    id, nombre, celdas, celdas_validas, promedio, min, max, count_99, count_nan, histograma
+
+Uso:
+    python zonas.py --geojson departamentos.geojson [--campo-nombre nombre] [--riesgo riesgo.npy]
+    python zonas.py --geojson ContornoCba.geojson --riesgo riesgo_almacen --salida zonas.csv
+"""
+
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from capas import CACHE_DIR, cargar_capa, hash_archivo
+from region import limites_grilla, leer_poligonos_geojson, rasterizar_filas
+
+VALOR_SIN_DATO = 99
+
+# Clases del histograma: 0-10, más una para el 99 y otra para NaN
+CLASES = 11
+CLASE_SIN_DATO = CLASES
+CLASE_NAN = CLASES + 1
+
+# Propiedades del GeoJSON que se prueban, en orden, como nombre de la zona
+CAMPOS_NOMBRE = ('nombre', 'name', 'NAME', 'departamento', 'NOMBRE', 'nam')
+
+# Incrementar si cambia la forma de rasterizar o el contenido de la caché
+ZONAS_VERSION = 1
+
+
+def _nombre_zona(propiedades, numero, campo_nombre=None):
+    campos = (campo_nombre,) if campo_nombre else CAMPOS_NOMBRE
+    for campo in campos:
+        if propiedades.get(campo) not in (None, ''):
+            return str(propiedades[campo])
+    return f'zona_{numero}'
+
+
+def rasterizar_zonas(geojson, forma, campo_nombre=None, limites=None):
+    """
+    Grilla de etiquetas de los polígonos del GeoJSON y descripción de cada zona.
+    Devuelve (etiquetas, zonas) con zonas = [{'id', 'nombre'}] en el orden de las etiquetas 1..N.
+    """
+    poligonos = leer_poligonos_geojson(geojson)
+    dtype = np.uint16 if len(poligonos) < np.iinfo(np.uint16).max else np.int32
+    etiquetas = np.zeros(forma, dtype=dtype)
+    zonas = []
+
+    for numero, (propiedades, anillos) in enumerate(poligonos, start=1):
+        zonas.append({'id': propiedades.get('id') if propiedades.get('id') is not None else numero,
+                      'nombre': _nombre_zona(propiedades, numero, campo_nombre)})
+        primera, bloque = rasterizar_filas(anillos, forma, limites)
+        if bloque is not None:
+            etiquetas[primera:primera + bloque.shape[0]][bloque] = numero
+
+    return etiquetas, zonas
+
+
+def ordenar_por_zona(etiquetas, cantidad_zonas):
+    """
+    Orden de las celdas (índices planos) agrupadas por zona y el índice de inicio de cada
+    zona 0..N en ese orden. Se calcula una vez y se guarda con las etiquetas.
+    """
+    planas = etiquetas.ravel()
+    orden = np.argsort(planas, kind='stable').astype(np.int64 if planas.size >= 2 ** 31 else np.int32)
+    conteos = np.bincount(planas, minlength=cantidad_zonas + 1)
+    inicios = np.concatenate([[0], np.cumsum(conteos)[:-1]])
+    return orden, inicios
+
+
+def cargar_zonas(geojson, forma, campo_nombre=None, limites=None, directorio_cache=CACHE_DIR):
+    """
+    Etiquetas, zonas, orden e inicios de la capa de polígonos, desde la caché
+    directorio_cache/zonas_<clave>.npz o rasterizando el GeoJSON la primera vez.
+    """
+    parametros = {
+        'version': ZONAS_VERSION,
+        'forma': list(forma),
+        'geojson': hash_archivo(geojson),
+        'campo_nombre': campo_nombre,
+        'limites': limites_grilla(limites)
+    }
+    clave = hashlib.sha256(json.dumps(parametros, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    ruta = os.path.join(directorio_cache, f'zonas_{clave}.npz')
+
+    if os.path.exists(ruta):
+        with np.load(ruta) as datos:
+            return (datos['etiquetas'], json.loads(str(datos['zonas'])), datos['orden'], datos['inicios'])
+
+    etiquetas, zonas = rasterizar_zonas(geojson, forma, campo_nombre, limites)
+    orden, inicios = ordenar_por_zona(etiquetas, len(zonas))
+
+    os.makedirs(directorio_cache, exist_ok=True)
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'wb') as f:
+        np.savez(f, etiquetas=etiquetas, zonas=np.array(json.dumps(zonas, ensure_ascii=False)),
+                 orden=orden, inicios=inicios)
+    os.replace(ruta_tmp, ruta)
+    return etiquetas, zonas, orden, inicios
+
+
+def estadisticas_zonales(riesgo, etiquetas, zonas, orden=None, inicios=None, valor_sin_dato=VALOR_SIN_DATO):
+    """
+    Estadísticas de todas las zonas en una pasada sobre la matriz de riesgo.
+    Devuelve una lista con un diccionario por zona (en el orden de `zonas`).
+    """
+    cantidad = len(zonas) + 1
+    valores = np.asarray(riesgo, dtype=np.float64).ravel()
+    planas = etiquetas.ravel()
+    if valores.size != planas.size:
+        raise ValueError(f"El riesgo {np.shape(riesgo)} y las etiquetas {etiquetas.shape} no tienen la misma forma")
+    if orden is None:
+        orden, inicios = ordenar_por_zona(etiquetas, len(zonas))
+
+    sin_dato = valores == valor_sin_dato
+    sin_valor = np.isnan(valores)
+    validos = ~(sin_dato | sin_valor)
+
+    # Clase de cada celda: 0-10 para los valores válidos, 11 para el 99 y 12 para NaN
+    clase = np.floor(np.where(validos, valores, 0))
+    np.clip(clase, 0, CLASES - 1, out=clase)
+    clase = clase.astype(np.intp)
+    clase[sin_dato] = CLASE_SIN_DATO
+    clase[sin_valor] = CLASE_NAN
+
+    conteos = np.bincount(planas.astype(np.intp) * (CLASE_NAN + 1) + clase,
+                          minlength=cantidad * (CLASE_NAN + 1)).reshape(cantidad, CLASE_NAN + 1)
+    suma = np.bincount(planas, weights=np.where(validos, valores, 0), minlength=cantidad)
+    celdas_validas = conteos[:, :CLASES].sum(axis=1)
+
+    # Mínimo y máximo por zona sobre las celdas ordenadas por zona (las zonas vacías no tienen segmento)
+    minimos = np.full(cantidad, np.nan)
+    maximos = np.full(cantidad, np.nan)
+    con_celdas = conteos.sum(axis=1) > 0
+    if con_celdas.any():
+        segmentos = inicios[con_celdas]
+        minimos[con_celdas] = np.minimum.reduceat(np.where(validos, valores, np.inf)[orden], segmentos)
+        maximos[con_celdas] = np.maximum.reduceat(np.where(validos, valores, -np.inf)[orden], segmentos)
+
+    resultados = []
+    for numero, zona in enumerate(zonas, start=1):
+        hay_validos = celdas_validas[numero] > 0
+        resultados.append({
+            'id': zona['id'],
+            'nombre': zona['nombre'],
+            'celdas': int(conteos[numero].sum()),
+            'celdas_validas': int(celdas_validas[numero]),
+            'promedio': float(suma[numero] / celdas_validas[numero]) if hay_validos else None,
+            'min': float(minimos[numero]) if hay_validos else None,
+            'max': float(maximos[numero]) if hay_validos else None,
+            'count_99': int(conteos[numero, CLASE_SIN_DATO]),
+            'count_nan': int(conteos[numero, CLASE_NAN]),
+            'histograma': [int(c) for c in conteos[numero, :CLASES]]
+        })
+    return resultados
+
+
+def cargar_riesgo(ruta):
+    """
+    Matriz de riesgo desde riesgo.npy (memory-map), un almacén por chunks (directorio) o un CSV.
+    """
+    if os.path.isdir(ruta):
+        from almacen import AlmacenChunks
+        return np.asarray(AlmacenChunks(ruta))
+    if ruta.lower().endswith('.npy'):
+        return np.load(ruta, mmap_mode='r')
+    return cargar_capa(ruta)
+
+
+def guardar_estadisticas(resultados, ruta):
+    """
+    Guarda las estadísticas zonales como JSON o como CSV (una columna por clase) según la extensión.
+    """
+    ruta_tmp = f'{ruta}.{os.getpid()}.tmp'
+    with open(ruta_tmp, 'w', encoding='utf-8', newline='') as f:
+        if ruta.lower().endswith('.csv'):
+            escritor = csv.writer(f)
+            campos = ['id', 'nombre', 'celdas', 'celdas_validas', 'promedio', 'min', 'max', 'count_99', 'count_nan']
+            escritor.writerow(campos + [f'clase_{k}' for k in range(CLASES)])
+            for r in resultados:
+                escritor.writerow([r[c] for c in campos] + r['histograma'])
+        else:
+            json.dump({'clases': list(range(CLASES)), 'zonas': resultados}, f, indent=2, ensure_ascii=False)
+    os.replace(ruta_tmp, ruta)
+
+
+def calcular_zonas(geojson, ruta_riesgo='riesgo.npy', salida='zonas.json', campo_nombre=None):
+    """
+    Rasteriza (o lee de la caché) la capa de polígonos, calcula las estadísticas de todas
+    las zonas sobre el riesgo y las guarda en `salida`. Devuelve la lista de resultados.
+    """
+    riesgo = cargar_riesgo(ruta_riesgo)
+    directorio_cache = os.path.join(os.path.dirname(os.path.abspath(ruta_riesgo)), CACHE_DIR)
+    etiquetas, zonas, orden, inicios = cargar_zonas(geojson, riesgo.shape, campo_nombre,
+                                                    directorio_cache=directorio_cache)
+    resultados = estadisticas_zonales(riesgo, etiquetas, zonas, orden, inicios)
+    guardar_estadisticas(resultados, salida)
+    print(f"✓ Estadísticas de {len(resultados)} zonas guardadas: {salida}")
+    return resultados
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Estadísticas zonales del riesgo por polígono')
+    parser.add_argument('--geojson', required=True, help='capa de polígonos (una zona por Feature)')
+    parser.add_argument('--riesgo', default='riesgo.npy',
+                        help='riesgo.npy, directorio riesgo_almacen o riesgo.csv (default: riesgo.npy)')
+    parser.add_argument('--salida', default='zonas.json', help='archivo de salida .json o .csv (default: zonas.json)')
+    parser.add_argument('--campo-nombre', default=None,
+                        help='propiedad del GeoJSON con el nombre de cada zona (default: nombre, name, ...)')
+    args = parser.parse_args()
+
+    calcular_zonas(args.geojson, args.riesgo, args.salida, args.campo_nombre)